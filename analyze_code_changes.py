@@ -1,87 +1,137 @@
-import requests
-import csv
+import asyncio
+import argparse
+import threading
+import time
+import socket
+import sqlite3
+import multiprocessing
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-import time
-import re
 import json
 from collections import defaultdict
 from urllib.parse import urlparse
+from github_client import GitHubClient, AsyncGitHubClient
+from http_cache import DEFAULT_CACHE_PATH, open_default_cache
+from github_graphql import resolve_commit_dates
+from pr_enumeration import iter_merged_prs
+from checkpoint import Checkpoint
+from pr_diff import fetch_pr_files
+from diff_scanner import scan_patch, scan_file_batch
+from repo_index import open_repo_index
+from overlap_join import OVERLAP_PATH, count_overlap, overlapping_repos
+from result_writers import ResultWriters
+from online_stats import SummaryAggregator
+from instrumentation import METRICS, ProgressReporter, stage, timed
+from rate_limiter import load_tokens
+from work_queue import WorkQueue, default_worker_id
+from git_mirror import (GitMirror, GitMirrorError, MIRROR_DIR, API_REQUEST_SECONDS, LOCAL_DIFF_SECONDS,
+                        choose_backend)
 
 load_dotenv()
 
 # Configuration
 TARGET_LANGUAGES = ["JavaScript", "Python", "TypeScript"]
 MIN_STARS = 25
-RATE_LIMIT_DELAY = 1  # seconds
+MAX_CONCURRENCY = 16  # API requests in flight at once
+MAX_CONCURRENT_REPOS = 8  # Repos processed at once (each runs dates -> PRs -> files in order)
+USE_GRAPHQL_DATES = True  # Resolve commit dates with batched GraphQL instead of 2 REST calls per repo
+DATE_BATCH_SIZE = 50  # Commits resolved per GraphQL query
+PR_ENUMERATION_MODE = 'list'  # 'list' (/pulls with early cutoff) or 'search' (merged:v1..v2 queries)
+PR_FILES_MODE = 'diff'  # 'diff' (one unified-diff request per PR) or 'files' (paginated /files)
+DIFF_WORKERS = max((os.cpu_count() or 2) - 1, 1)  # Processes scanning diffs; 0 scans in the fetch threads
+DIFF_BATCH_FILES = 200  # Files per task handed to a diff worker
+GIT_MIRROR_MODE = 'auto'  # 'api', 'git' (clone every repo) or 'auto' (cost model per repo, see git_mirror.py)
+KEEP_MIRRORS = False  # Keep clones in MIRROR_DIR after their repo finishes instead of deleting them
+CHECKPOINT_PATH = 'code_changes_checkpoint.sqlite'  # Per-repo progress; delete to start over
+OUTPUT_STEM = 'code_changes_analysis'  # Detailed results go to <stem>.csv / <stem>.parquet
+OUTPUT_FORMATS = ['csv']  # Any of 'csv', 'parquet'; records are streamed to each as repos finish
+SUMMARY_PATH = 'code_changes_summary.json'
+SUMMARY_INTERVAL = 50  # Rewrite the summary snapshot every this many finished repos (0 = only at the end)
+TRACE_PATH = 'code_changes_trace.json'  # Stage spans and all metrics (chrome://tracing / Perfetto)
+METRICS_PATH = 'code_changes_metrics.prom'  # Prometheus text, rewritten with every progress line
+PROGRESS_INTERVAL = 60  # Seconds between progress lines (0 = none)
+QUEUE_BATCH_SIZE = 20  # Repos a queue worker leases at a time
+QUEUE_POLL_SECONDS = 30  # Wait between lease attempts while other workers hold the remaining repos
+HEARTBEAT_GIVE_UP = 2 / 3  # Share of the lease after which failed renewals abandon the worker's batch
+# Persistent host-local directory for the queue workers' checkpoint and HTTP cache, required by --worker.
+# Both are SQLite in WAL mode, which needs a local disk, while the queue usually sits on shared storage;
+# a temp dir would lose the progress a restarted worker on this host could resume from
+WORKER_STATE_DIR = os.getenv('WORKER_STATE_DIR')
+
+# Summary totals and the per-PR record fields they sum; each field also gets mean/std/percentiles
+SUMMARY_TOTALS = {
+    'total_files_changed': 'files_changed',
+    'total_files_added': 'files_added',
+    'total_files_modified': 'files_modified',
+    'total_files_deleted': 'files_deleted',
+    'total_lines_added': 'total_lines_added',
+    'total_lines_removed': 'total_lines_removed',
+    'total_code_additions': 'code_additions',
+    'total_code_deletions': 'code_deletions',
+    'total_comment_additions': 'comment_additions',
+    'total_comment_deletions': 'comment_deletions',
+    'total_imports_added': 'imports_added',
+    'total_functions_added': 'functions_added',
+    'total_classes_added': 'classes_added',
+    'total_test_changes': 'test_changes',
+}
+SUMMARY_GROUPS = {'language': 'languages_changed', 'change_type': 'change_types'}  # Group-bys over map fields
+SUMMARY_REPO_METRICS = ['files_changed', 'total_lines_added', 'total_lines_removed']  # Summed per repo
+
+def worker_path(path, worker_id):
+    """Per-worker variant of an output path, e.g. code_changes_trace.<worker>.json"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{worker_id}{ext}'
 
 class CodeChangeAnalyzer:
-    def __init__(self):
-        self.headers = {
-            'Accept': 'application/vnd.github.v3+json',
-            'Authorization': 'Bearer ' + os.getenv('GITHUB_TOKEN'),
-            'User-Agent': 'STARCODER ANALYSIS APP',
-            'X-GitHub-Api-Version': '2022-11-28',
-        }
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_concurrent_repos=MAX_CONCURRENT_REPOS,
+                 checkpoint_path=CHECKPOINT_PATH, diff_workers=DIFF_WORKERS, tokens=None, cache='default'):
         self.gh_token = os.getenv('GITHUB_TOKEN')
+        self.client = GitHubClient(tokens=tokens, pool_size=max_concurrency, cache=cache)
+        self.max_concurrency = max_concurrency
+        self.max_concurrent_repos = max_concurrent_repos
+        self.diff_workers = diff_workers
+        self.diff_pool = None
+        # Without a path, progress is only kept for the lifetime of the run
+        self.checkpoint = Checkpoint(checkpoint_path or ':memory:')
+        self.repo_sizes = {}  # KB, as reported with the PR listing; feeds the clone cost model
+        self.mirrors = {}  # Clones opened for repos in progress
+        self.summary = None  # SummaryAggregator of the current run; snapshot it any time
         
     def load_repo_datasets(self):
-        """Load V1 and V2 repository datasets"""
-        repo_v1 = {}
-        repo_v2 = {}
-        
+        """Open the V1 and V2 repository indexes (memory-mapped, see repo_index.py)"""
         print("Loading V1 and V2 repositories...")
         
-        with open('starcoder_v1_repos.csv', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                repo_v1[row['repo_name'].strip()] = row['commit_hash'].strip()
-        
-        with open('starcoder_v2_repos.csv', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                repo_v2[row['repo_name'].strip()] = row['commit_hash'].strip()
+        # The CSVs are converted once if their .idx is missing or stale
+        repo_v1 = open_repo_index('starcoder_v1_repos.csv')
+        repo_v2 = open_repo_index('starcoder_v2_repos.csv')
         
         print(f"Loaded {len(repo_v1)} V1 repos and {len(repo_v2)} V2 repos")
         return repo_v1, repo_v2
     
     def find_overlapping_repos(self, repo_v1, repo_v2):
-        """Find repositories that appear in both V1 and V2"""
-        overlapped = []
+        """Find repositories in both V1 and V2 whose commit changed between them.
         
+        Returns (repos, count): repos streams repo_data dicts from the overlap
+        artifact, and count comes from the artifact without loading them.
+        """
         print("Finding overlapping repositories...")
-        for repo_name, v1_hash in repo_v1.items():
-            if repo_name in repo_v2:
-                overlapped.append({
-                    'repo_name': repo_name,
-                    'v1_hash': v1_hash,
-                    'v2_hash': repo_v2[repo_name]
-                })
-        
-        print(f"Found {len(overlapped)} overlapping repositories")
-        return overlapped
-    
-    def get_repo_languages(self, repo_name):
-        """Get programming languages used in a repository"""
-        try:
-            url = f"https://api.github.com/repos/{repo_name}/languages"
-            response = requests.get(url, headers=self.headers)
-            time.sleep(RATE_LIMIT_DELAY)
-            
-            if response.status_code == 200:
-                return response.json()
-            return {}
-        except Exception as e:
-            print(f"Error getting languages for {repo_name}: {e}")
-            return {}
+        # Sort-merge join of the two indexes; repos with the same SHA in both
+        # versions cannot have PRs merged in between and are left out
+        overlapped = overlapping_repos(repo_v1, repo_v2)
+        count = count_overlap(OVERLAP_PATH)
+        
+        print(f"Found {count} overlapping repositories with a changed commit")
+        return overlapped, count
     
+    @timed('dates')
     def get_commit_date(self, repo_name, commit_hash):
         """Get the date of a specific commit"""
         try:
-            url = f"https://api.github.com/repos/{repo_name}/commits/{commit_hash}"
-            response = requests.get(url, headers=self.headers)
-            time.sleep(RATE_LIMIT_DELAY)
+            response = self.client.get(f"/repos/{repo_name}/commits/{commit_hash}")
             
             if response.status_code == 200:
                 commit_data = response.json()
@@ -92,113 +142,92 @@ class CodeChangeAnalyzer:
             print(f"Error getting commit date for {repo_name}/{commit_hash}: {e}")
             return None
     
+    @timed('pr_list')
     def get_merged_prs(self, repo_name, v1_date, v2_date):
-        """Get all merged PRs between v1_date and v2_date"""
-        prs = []
-        url = f"https://api.github.com/repos/{repo_name}/pulls"
-        
-        params = {
-            'state': 'closed',
-            'sort': 'updated',
-            'direction': 'desc',
-            'per_page': 100
-        }
+        """Get all merged PRs between v1_date and v2_date.
         
-        page_count = 0
-        max_pages = 10  # Limit to avoid excessive API calls
+        Request errors propagate: a truncated list must not be checkpointed
+        as the repo's PRs, or a rerun would never fetch the rest.
+        """
+        prs = []
         
-        while url and page_count < max_pages:
-            try:
-                response = requests.get(url, headers=self.headers, params=params)
-                time.sleep(RATE_LIMIT_DELAY)
-                response.raise_for_status()
-                
-                pull_requests = response.json()
-                
-                for pr in pull_requests:
-                    if pr['merged_at']:  # Only merged PRs
-                        merge_date = datetime.fromisoformat(pr['merged_at'].replace('Z', '+00:00'))
-                        
-                        # Skip bots
-                        if "bot" in pr['user']['login'].lower() or pr['user']['type'].lower() == "bot":
-                            continue
-                        
-                        # Check if PR is within date range
-                        if v1_date < merge_date < v2_date:
-                            prs.append({
-                                'number': pr['number'],
-                                'title': pr['title'],
-                                'url': pr['html_url'],
-                                'merge_date': merge_date,
-                                'author': pr['user']['login'],
-                                'additions': pr.get('additions', 0),
-                                'deletions': pr.get('deletions', 0),
-                                'changed_files': pr.get('changed_files', 0)
-                            })
-                
-                # Check for next page
-                if 'next' in response.links:
-                    url = response.links['next']['url']
-                    params = {}
-                    page_count += 1
-                else:
-                    url = None
-                    
-            except requests.exceptions.HTTPError as e:
-                print(f"Error getting PRs for {repo_name}: {e}")
-                break
+        for pr in iter_merged_prs(self.client, repo_name, v1_date, v2_date, PR_ENUMERATION_MODE):
+            # Skip bots
+            if "bot" in pr['user']['login'].lower() or pr['user']['type'].lower() == "bot":
+                continue
+            
+            size = (pr.get('base') or {}).get('repo', {}).get('size')
+            if size is not None:
+                self.repo_sizes[repo_name] = size
+            prs.append({
+                'number': pr['number'],
+                'title': pr['title'],
+                'url': pr['html_url'],
+                'merge_date': datetime.fromisoformat(pr['merged_at'].replace('Z', '+00:00')),
+                'author': pr['user']['login'],
+                'additions': pr.get('additions', 0),
+                'deletions': pr.get('deletions', 0),
+                'changed_files': pr.get('changed_files', 0),
+                'merge_commit_sha': pr.get('merge_commit_sha'),
+            })
         
         return prs
     
+    @timed('file_fetch')
     def get_pr_files(self, repo_name, pr_number):
-        """Get list of files changed in a PR"""
-        files = []
-        url = f"https://api.github.com/repos/{repo_name}/pulls/{pr_number}/files"
-        
-        params = {'per_page': 300}
-        
+        """Get list of files changed in a PR; request errors propagate so the PR stays pending"""
+        return fetch_pr_files(self.client, repo_name, pr_number, PR_FILES_MODE, self.get_file_language)
+    
+    @timed('file_fetch', backend='git')
+    def get_local_pr_files(self, mirror, merge_sha):
+        """Diff a PR's merge commit in a local clone"""
+        return mirror.pr_files(merge_sha, self.get_file_language)
+    
+    @timed('clone')
+    def get_local_commit_dates(self, repo_data):
+        """Clone a repo and read its V1/V2 commit dates with git log"""
+        repo_name = repo_data['repo_name']
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-            time.sleep(RATE_LIMIT_DELAY)
-            response.raise_for_status()
-            
-            files = response.json()
-            return files
-        except Exception as e:
-            print(f"Error getting files for PR #{pr_number} in {repo_name}: {e}")
-            return []
+            mirror = self.mirrors.get(repo_name) or GitMirror(repo_name, MIRROR_DIR).ensure()
+            self.mirrors[repo_name] = mirror
+            dates = mirror.commit_dates([repo_data['v1_hash'], repo_data['v2_hash']])
+        except GitMirrorError as e:
+            print(f"Error getting commit dates for {repo_name} from a clone: {e}")
+            return None, None
+        return dates.get(repo_data['v1_hash']), dates.get(repo_data['v2_hash'])
     
-    def analyze_diff(self, diff_text):
-        """Analyze a diff to extract metrics"""
-        analysis = {
-            'code_additions': 0,
-            'code_deletions': 0,
-            'comment_additions': 0,
-            'comment_deletions': 0,
-            'lines_added': 0,
-            'lines_removed': 0
-        }
-        
-        if not diff_text:
-            return analysis
-        
-        lines = diff_text.split('\n')
-        for line in lines:
-            if line.startswith('+') and not line.startswith('+++'):
-                analysis['lines_added'] += 1
-                # Simple heuristic: lines with # or // or /* are comments
-                if '#' in line or '//' in line or '/*' in line:
-                    analysis['comment_additions'] += 1
-                else:
-                    analysis['code_additions'] += 1
-            elif line.startswith('-') and not line.startswith('---'):
-                analysis['lines_removed'] += 1
-                if '#' in line or '//' in line or '/*' in line:
-                    analysis['comment_deletions'] += 1
-                else:
-                    analysis['code_deletions'] += 1
-        
-        return analysis
+    def open_mirror(self, repo_name, prs, v1_date, v2_date):
+        """A clone to diff the PRs in, if the cost model prefers one to the API; None otherwise"""
+        backend = GIT_MIRROR_MODE
+        if backend == 'auto':
+            # PR diffs timed so far, from the API and from clones, replace the model's default latencies
+            backend = choose_backend(len(prs), self.repo_sizes.get(repo_name), len(self.client.limiter.tokens),
+                                     self.max_concurrency,
+                                     METRICS.mean_stage_seconds('file_fetch') or API_REQUEST_SECONDS,
+                                     METRICS.mean_stage_seconds('file_fetch', backend='git') or LOCAL_DIFF_SECONDS)
+        METRICS.count('pipeline_repo_backends', backend=backend)
+        if backend != 'git' or not prs:
+            return None
+        try:
+            with stage('clone'):
+                mirror = self.mirrors.get(repo_name) or GitMirror(repo_name, MIRROR_DIR).ensure()
+                self.mirrors[repo_name] = mirror
+                mirror.load_window(v1_date, v2_date)
+        except GitMirrorError as e:
+            print(f"  {repo_name}: {e}; fetching PR diffs from the API")
+            return None
+        covered = sum(1 for pr in prs if mirror.covers(pr.get('merge_commit_sha')))
+        print(f"  {repo_name}: diffing {covered} of {len(prs)} PRs in a local clone")
+        return mirror
+    
+    def close_mirror(self, repo_name):
+        mirror = self.mirrors.pop(repo_name, None)
+        if mirror is not None and not KEEP_MIRRORS:
+            mirror.remove()
+    
+    def analyze_diff(self, diff_text, language='Other'):
+        """Analyze a diff to extract line, comment and declaration metrics in one pass"""
+        return scan_patch(diff_text, language)
     
     def get_file_language(self, filename):
         """Determine programming language from file extension"""
@@ -246,8 +275,24 @@ class CodeChangeAnalyzer:
                 return 'modification'
         return 'modification'
     
+    def diff_batch(self, files):
+        """(patch, language) pairs to hand to the diff scanner, for the files not scanned while streaming"""
+        return [(file_info.get('patch') or '', self.get_file_language(file_info['filename']))
+                for file_info in files if 'scan' not in file_info]
+    
+    def file_scans(self, files, scans):
+        """Diff scans in file order: streamed ones from the records, the rest in order from scans"""
+        scans = iter(scans)
+        return [file_info['scan'] if 'scan' in file_info else next(scans) for file_info in files]
+    
     def analyze_pr_files(self, repo_name, pr_number, pr):
         """Analyze all files in a PR"""
+        files = self.get_pr_files(repo_name, pr_number)
+        scans = self.file_scans(files, scan_file_batch(self.diff_batch(files)))
+        return self.summarize_pr_files(files, scans), len(files)
+    
+    def summarize_pr_files(self, files, scans):
+        """Fold the files of a PR and their diff scans (in file order) into the PR analysis"""
         pr_analysis = {
             'files_added': 0,
             'files_modified': 0,
@@ -268,9 +313,7 @@ class CodeChangeAnalyzer:
             }
         }
         
-        files = self.get_pr_files(repo_name, pr_number)
-        
-        for file_info in files:
+        for file_info, diff_analysis in zip(files, scans):
             filename = file_info['filename']
             language = self.get_file_language(filename)
             additions = file_info.get('additions', 0)
@@ -280,7 +323,7 @@ class CodeChangeAnalyzer:
             # Update file counts
             if status == 'added':
                 pr_analysis['files_added'] += 1
-            elif status == 'deleted':
+            elif status in ('removed', 'deleted'):  # The API reports deletions as 'removed'
                 pr_analysis['files_deleted'] += 1
             elif status == 'modified':
                 pr_analysis['files_modified'] += 1
@@ -292,10 +335,8 @@ class CodeChangeAnalyzer:
             # Track language changes
             pr_analysis['languages_changed'][language] += 1
             
-            # Get patch/diff
+            # Patch/diff metrics come from the diff scan
             patch = file_info.get('patch', '')
-            diff_analysis = self.analyze_diff(patch)
-            
             pr_analysis['code_additions'] += diff_analysis['code_additions']
             pr_analysis['code_deletions'] += diff_analysis['code_deletions']
             pr_analysis['comment_additions'] += diff_analysis['comment_additions']
@@ -305,202 +346,533 @@ class CodeChangeAnalyzer:
             change_type = self.categorize_change_type(filename, additions, deletions)
             pr_analysis['change_types'][change_type] += 1
             
-            # Pattern detection
+            # Pattern detection (computed by the same diff scan)
             if patch:
-                if re.search(r'^\+.*import\s|^\+.*require\(', patch, re.MULTILINE):
-                    pr_analysis['patterns']['imports_added'] += 1
-                if re.search(r'^\+\s*(def|function|const.*=.*\(|async.*\()', patch, re.MULTILINE):
-                    pr_analysis['patterns']['functions_added'] += 1
-                if re.search(r'^\+\s*class\s+', patch, re.MULTILINE):
-                    pr_analysis['patterns']['classes_added'] += 1
+                pr_analysis['patterns']['imports_added'] += diff_analysis['imports_added']
+                pr_analysis['patterns']['functions_added'] += diff_analysis['functions_added']
+                pr_analysis['patterns']['classes_added'] += diff_analysis['classes_added']
                 if 'test' in filename.lower():
                     pr_analysis['patterns']['test_changes'] += 1
         
-        return pr_analysis, len(files)
+        return pr_analysis
     
-    def run_analysis(self):
-        """Run the complete code change analysis"""
-        print("=" * 80)
-        print("STARCODER V1 TO V2 CODE CHANGE ANALYSIS")
-        print("=" * 80)
-        
-        # Load datasets
-        repo_v1, repo_v2 = self.load_repo_datasets()
-        
-        # Find overlapping repos
-        overlapped = self.find_overlapping_repos(repo_v1, repo_v2)
-        
-        all_pr_analysis = []
-        processed_repos = 0
-        skipped_repos = 0
+    def build_analysis_record(self, repo_data, v1_date, v2_date, pr, pr_files_analysis, file_count):
+        """Combine PR metadata with the file analysis into one output record"""
+        return {
+            'repo_name': repo_data['repo_name'],
+            'v1_commit': repo_data['v1_hash'][:7],
+            'v2_commit': repo_data['v2_hash'][:7],
+            'v1_date': v1_date.isoformat(),
+            'v2_date': v2_date.isoformat(),
+            'pr_number': pr['number'],
+            'pr_title': pr['title'],
+            'pr_url': pr['url'],
+            'merge_date': pr['merge_date'].isoformat(),
+            'author': pr['author'],
+            'files_changed': file_count,
+            'api_additions': pr['additions'],
+            'api_deletions': pr['deletions'],
+            'files_added': pr_files_analysis['files_added'],
+            'files_modified': pr_files_analysis['files_modified'],
+            'files_deleted': pr_files_analysis['files_deleted'],
+            'total_lines_added': pr_files_analysis['total_lines_added'],
+            'total_lines_removed': pr_files_analysis['total_lines_removed'],
+            'code_additions': pr_files_analysis['code_additions'],
+            'code_deletions': pr_files_analysis['code_deletions'],
+            'comment_additions': pr_files_analysis['comment_additions'],
+            'comment_deletions': pr_files_analysis['comment_deletions'],
+            # Kept as maps; the CSV writer JSON-encodes them, Parquet stores map columns
+            'languages_changed': dict(pr_files_analysis['languages_changed']),
+            'change_types': dict(pr_files_analysis['change_types']),
+            'imports_added': pr_files_analysis['patterns']['imports_added'],
+            'functions_added': pr_files_analysis['patterns']['functions_added'],
+            'classes_added': pr_files_analysis['patterns']['classes_added'],
+            'test_changes': pr_files_analysis['patterns']['test_changes']
+        }
+    
+    async def analyze_pr(self, api, repo_data, v1_date, v2_date, pr, mirror=None):
+        """Fetch (from the API or a local clone) and analyze the files of one PR"""
+        repo_name = repo_data['repo_name']
+        pr_number = pr['number']
+        print(f"    Analyzing {repo_name} PR #{pr_number}...")
         
-        # Process each overlapping repo
-        for repo_data in overlapped:
-            repo_name = repo_data['repo_name']
-            v1_hash = repo_data['v1_hash']
-            v2_hash = repo_data['v2_hash']
-            
+        try:
+            if mirror is not None and mirror.covers(pr.get('merge_commit_sha')):
+                files = await api.run(self.get_local_pr_files, mirror, pr['merge_commit_sha'])
+            else:
+                files = await api.run(self.get_pr_files, repo_name, pr_number)
+            scans = await self.scan_files(api, files)
+            pr_files_analysis = self.summarize_pr_files(files, scans)
+            file_count = len(files)
+            record = self.build_analysis_record(
+                repo_data, v1_date, v2_date, pr, pr_files_analysis, file_count
+            )
+            self.checkpoint.add_record(repo_name, pr_number, record)
+            return record
+        except Exception as e:
+            print(f"    Error analyzing {repo_name} PR #{pr_number}: {e}")
+            return None
+    
+    @timed('diff_analysis')
+    async def scan_files(self, api, files):
+        """Scan the patches of a PR on the diff worker pool, in batches of DIFF_BATCH_FILES"""
+        batch = self.diff_batch(files)
+        if not batch:
+            return self.file_scans(files, [])
+        if self.diff_pool is None:
+            return self.file_scans(files, await api.run(scan_file_batch, batch))
+        
+        loop = asyncio.get_running_loop()
+        starts = range(0, len(batch), DIFF_BATCH_FILES)
+        METRICS.add_gauge('pipeline_queue_depth', len(starts), queue='diff_pool')
+        try:
+            chunks = await asyncio.gather(*(
+                loop.run_in_executor(self.diff_pool, scan_file_batch, batch[start:start + DIFF_BATCH_FILES])
+                for start in starts
+            ))
+        finally:
+            METRICS.add_gauge('pipeline_queue_depth', -len(starts), queue='diff_pool')
+        # gather keeps submission order, so results line up with files whatever the worker count
+        return self.file_scans(files, [scan for chunk in chunks for scan in chunk])
+    
+    @timed('dates')
+    def get_commit_dates(self, repos):
+        """Resolve V1/V2 commit dates for many repos with batched GraphQL queries"""
+        pairs = []
+        for repo_data in repos:
+            pairs.append((repo_data['repo_name'], repo_data['v1_hash']))
+            pairs.append((repo_data['repo_name'], repo_data['v2_hash']))
+        
+        dates, errors = resolve_commit_dates(self.client, pairs, DATE_BATCH_SIZE)
+        for (repo_name, sha), error in errors.items():
+            print(f"Error getting commit date for {repo_name}/{sha}: {error}")
+        
+        return {
+            repo_data['repo_name']: (
+                dates.get((repo_data['repo_name'], repo_data['v1_hash'])),
+                dates.get((repo_data['repo_name'], repo_data['v2_hash'])),
+            )
+            for repo_data in repos
+        }
+    
+    async def analyze_repo(self, api, repo_data, dates=None):
+        """Run dates -> PRs -> files for one repo; returns None if the repo is skipped"""
+        repo_name = repo_data['repo_name']
+        stage, state = self.checkpoint.get(repo_name)
+        if stage == 'done':
+            return self.checkpoint.records(repo_name)
+        
+        if stage == 'prs':
+            # Resume from the PR list saved by an earlier run
+            print(f"\nResuming {repo_name}...")
+            v1_date = datetime.fromisoformat(state['v1_date'])
+            v2_date = datetime.fromisoformat(state['v2_date'])
+            prs = [dict(pr, merge_date=datetime.fromisoformat(pr['merge_date'])) for pr in state['prs']]
+        else:
             print(f"\nProcessing {repo_name}...")
             
-            # Get commit dates
-            v1_date = self.get_commit_date(repo_name, v1_hash)
-            v2_date = self.get_commit_date(repo_name, v2_hash)
+            # Get commit dates (already resolved in batch unless GraphQL is off)
+            if dates is None and GIT_MIRROR_MODE == 'git':
+                dates = await api.run(self.get_local_commit_dates, repo_data)
+            elif dates is None:
+                dates = await asyncio.gather(
+                    api.run(self.get_commit_date, repo_name, repo_data['v1_hash']),
+                    api.run(self.get_commit_date, repo_name, repo_data['v2_hash']),
+                )
+            v1_date, v2_date = dates
             
             if not v1_date or not v2_date:
-                print(f"  Skipping: Could not get commit dates")
-                skipped_repos += 1
-                continue
-            
-            # Get merged PRs
-            prs = self.get_merged_prs(repo_name, v1_date, v2_date)
-            print(f"  Found {len(prs)} merged PRs between {v1_date.date()} and {v2_date.date()}")
+                print(f"  Skipping {repo_name}: Could not get commit dates")
+                self.close_mirror(repo_name)
+                return None
             
-            # Analyze each PR
-            for pr in prs:
-                pr_number = pr['number']
-                print(f"    Analyzing PR #{pr_number}...")
-                
+            # Get merged PRs; on a request error nothing is saved and a rerun starts the repo over
+            try:
+                prs = await api.run(self.get_merged_prs, repo_name, v1_date, v2_date)
+            except Exception:
+                self.close_mirror(repo_name)
+                raise
+            self.checkpoint.set_stage(repo_name, 'prs', {
+                'v1_date': v1_date.isoformat(),
+                'v2_date': v2_date.isoformat(),
+                'prs': [dict(pr, merge_date=pr['merge_date'].isoformat()) for pr in prs],
+            })
+        print(f"  {repo_name}: found {len(prs)} merged PRs between {v1_date.date()} and {v2_date.date()}")
+        
+        completed = self.checkpoint.completed_prs(repo_name)
+        if completed:
+            print(f"  {repo_name}: {len(completed)} PRs already analyzed")
+        
+        # Analyze PRs concurrently; the client bounds the requests in flight
+        pending = [pr for pr in prs if pr['number'] not in completed]
+        mirror = await api.run(self.open_mirror, repo_name, pending, v1_date, v2_date)
+        try:
+            records = await asyncio.gather(*(
+                self.analyze_pr(api, repo_data, v1_date, v2_date, pr, mirror)
+                for pr in pending
+            ))
+        finally:
+            self.close_mirror(repo_name)
+        # PRs that failed stay pending so that a rerun retries them
+        if all(record is not None for record in records):
+            self.checkpoint.finish_repo(repo_name)
+        return self.checkpoint.records(repo_name)
+    
+    async def feed_repos(self, api, overlapped, queue, results):
+        """Queue repos for the workers, resolving their commit dates in batches ahead of them.
+        
+        overlapped is consumed lazily, a chunk at a time; each queued repo gets a slot in results.
+        """
+        stages = self.checkpoint.stages()
+        chunk_size = max(DATE_BATCH_SIZE // 2, 1)
+        repos = iter(overlapped)
+        while True:
+            chunk = list(islice(repos, chunk_size))
+            if not chunk:
+                break
+            unresolved = [repo_data for repo_data in chunk if repo_data['repo_name'] not in stages]
+            dates = {}
+            if USE_GRAPHQL_DATES and unresolved and GIT_MIRROR_MODE != 'git':
+                dates = await api.run(self.get_commit_dates, unresolved)
+            for repo_data in chunk:
+                results.append(None)
+                await queue.put((len(results) - 1, repo_data, dates.get(repo_data['repo_name'])))
+                METRICS.gauge('pipeline_queue_depth', queue.qsize(), queue='repos')
+    
+    async def analyze_repos(self, overlapped, on_records, abort=None):
+        """Process overlapping repos with a fixed number of concurrent repo workers.
+        
+        Each finished repo's records are handed to on_records as soon as it
+        completes; the return value only says which repos were processed, in
+        input order. overlapped may be any iterable, e.g. a stream of the overlap CSV.
+        Once the abort event is set, repos that have not started are left unprocessed.
+        """
+        owns_pool = self.diff_pool is None
+        if owns_pool:
+            self.start_diff_pool()
+        api = AsyncGitHubClient(self.client, max_concurrency=self.max_concurrency)
+        results = []
+        queue = asyncio.Queue(maxsize=self.max_concurrent_repos * 2)
+        
+        async def worker():
+            while True:
+                item = await queue.get()
+                METRICS.gauge('pipeline_queue_depth', queue.qsize(), queue='repos')
+                if item is None:
+                    return
+                index, repo_data, dates = item
+                if abort is not None and abort.is_set():
+                    continue
                 try:
-                    pr_files_analysis, file_count = self.analyze_pr_files(
-                        repo_name, pr_number, pr
-                    )
-                    
-                    # Combine PR metadata with analysis
-                    analysis_record = {
-                        'repo_name': repo_name,
-                        'v1_commit': v1_hash[:7],
-                        'v2_commit': v2_hash[:7],
-                        'v1_date': v1_date.isoformat(),
-                        'v2_date': v2_date.isoformat(),
-                        'pr_number': pr_number,
-                        'pr_title': pr['title'],
-                        'pr_url': pr['url'],
-                        'merge_date': pr['merge_date'].isoformat(),
-                        'author': pr['author'],
-                        'files_changed': file_count,
-                        'api_additions': pr['additions'],
-                        'api_deletions': pr['deletions'],
-                        'files_added': pr_files_analysis['files_added'],
-                        'files_modified': pr_files_analysis['files_modified'],
-                        'files_deleted': pr_files_analysis['files_deleted'],
-                        'total_lines_added': pr_files_analysis['total_lines_added'],
-                        'total_lines_removed': pr_files_analysis['total_lines_removed'],
-                        'code_additions': pr_files_analysis['code_additions'],
-                        'code_deletions': pr_files_analysis['code_deletions'],
-                        'comment_additions': pr_files_analysis['comment_additions'],
-                        'comment_deletions': pr_files_analysis['comment_deletions'],
-                        'languages_changed': json.dumps(dict(pr_files_analysis['languages_changed'])),
-                        'change_types': json.dumps(dict(pr_files_analysis['change_types'])),
-                        'imports_added': pr_files_analysis['patterns']['imports_added'],
-                        'functions_added': pr_files_analysis['patterns']['functions_added'],
-                        'classes_added': pr_files_analysis['patterns']['classes_added'],
-                        'test_changes': pr_files_analysis['patterns']['test_changes']
-                    }
-                    
-                    all_pr_analysis.append(analysis_record)
-                    
+                    records = await self.analyze_repo(api, repo_data, dates)
+                    if records is not None:
+                        on_records(records)
+                    results[index] = records is not None
                 except Exception as e:
-                    print(f"    Error analyzing PR #{pr_number}: {e}")
-            
-            processed_repos += 1
-        
-        print(f"\n" + "=" * 80)
-        print(f"ANALYSIS COMPLETE")
-        print(f"Processed {processed_repos} repos, skipped {skipped_repos}")
-        print(f"Total PRs analyzed: {len(all_pr_analysis)}")
-        print("=" * 80)
+                    print(f"  Skipping {repo_data['repo_name']}: {e}")
         
-        return all_pr_analysis
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrent_repos)]
+        try:
+            await self.feed_repos(api, overlapped, queue, results)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            api.close()
+            if owns_pool:
+                self.stop_diff_pool()
+        return results
     
-    def save_results(self, analysis_data):
-        """Save analysis results to CSV"""
-        if not analysis_data:
-            print("No analysis data to save")
-            return
+    def start_diff_pool(self):
+        # Spawned (not forked) workers: the parent already runs HTTP threads and SQLite
+        self.diff_pool = ProcessPoolExecutor(
+            max_workers=self.diff_workers, mp_context=multiprocessing.get_context('spawn')
+        ) if self.diff_workers > 0 else None
+    
+    def stop_diff_pool(self):
+        if self.diff_pool is not None:
+            self.diff_pool.shutdown()
+            self.diff_pool = None
+    
+    def run_analysis(self, output_stem=OUTPUT_STEM, output_formats=OUTPUT_FORMATS):
+        """Run the complete code change analysis, streaming records to the outputs.
         
-        output_file = 'code_changes_analysis.csv'
+        Returns the SummaryAggregator; the records themselves are not kept.
+        """
+        print("=" * 80)
+        print("STARCODER V1 TO V2 CODE CHANGE ANALYSIS")
+        print("=" * 80)
         
-        print(f"\nSaving detailed analysis to {output_file}...")
+        # Load datasets
+        with stage('load'):
+            repo_v1, repo_v2 = self.load_repo_datasets()
         
-        fieldnames = [
-            'repo_name', 'v1_commit', 'v2_commit', 'v1_date', 'v2_date',
-            'pr_number', 'pr_title', 'pr_url', 'merge_date', 'author',
-            'files_changed', 'api_additions', 'api_deletions',
-            'files_added', 'files_modified', 'files_deleted',
-            'total_lines_added', 'total_lines_removed',
-            'code_additions', 'code_deletions',
-            'comment_additions', 'comment_deletions',
-            'languages_changed', 'change_types',
-            'imports_added', 'functions_added', 'classes_added', 'test_changes'
-        ]
+        # Find overlapping repos
+        with stage('overlap'):
+            overlapped, overlap_count = self.find_overlapping_repos(repo_v1, repo_v2)
+        
+        self.summary = SummaryAggregator(SUMMARY_TOTALS.values(), SUMMARY_GROUPS, SUMMARY_REPO_METRICS)
+        finished_repos = 0
+        
+        def on_records(records):
+            nonlocal finished_repos
+            # Finished repos replay their checkpointed records, so a resumed run rewrites full outputs
+            with stage('write'):
+                writers.write_many(records)
+                self.summary.add_many(records)
+            METRICS.count('pipeline_repos')
+            METRICS.count('pipeline_prs', len(records))
+            finished_repos += 1
+            if SUMMARY_INTERVAL and finished_repos % SUMMARY_INTERVAL == 0:
+                self.write_summary(self.generate_summary_statistics(self.summary))
+        
+        print(f"Writing detailed analysis to {', '.join(f'{output_stem}.{fmt}' for fmt in output_formats)}")
+        with ResultWriters(output_stem, output_formats) as writers, \
+                ProgressReporter(overlap_count, PROGRESS_INTERVAL, METRICS_PATH):
+            repo_results = asyncio.run(self.analyze_repos(overlapped, on_records))
+        
+        processed_repos = sum(1 for processed in repo_results if processed)
+        skipped_repos = len(repo_results) - processed_repos
         
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(analysis_data)
+        print(f"\n" + "=" * 80)
+        print(f"ANALYSIS COMPLETE")
+        print(f"Processed {processed_repos} repos, skipped {skipped_repos}")
+        print(f"Total PRs analyzed: {self.summary.count}")
+        print(self.client.cache_report())
+        print(METRICS.stage_report())
+        METRICS.write_trace(TRACE_PATH)
+        METRICS.write_prometheus(METRICS_PATH)
+        print(f"Wrote the stage trace to {TRACE_PATH} and metrics to {METRICS_PATH}")
+        print("=" * 80)
         
-        print(f"Saved {len(analysis_data)} PR analyses")
+        return self.summary
+    
+    def fill_queue(self, work_queue):
+        """Queue the overlapping repos for workers; repos already in the queue keep their state"""
+        with stage('load'):
+            repo_v1, repo_v2 = self.load_repo_datasets()
+        with stage('overlap'):
+            overlapped, overlap_count = self.find_overlapping_repos(repo_v1, repo_v2)
+        added = work_queue.enqueue((repo_data['repo_name'], repo_data) for repo_data in overlapped)
+        print(f"Queued {added} repos in {work_queue.path} ({overlap_count - added} were already queued)")
+        return added
+    
+    def run_worker(self, work_queue, worker_id, batch_size=QUEUE_BATCH_SIZE):
+        """Lease batches of repos from a WorkQueue and analyze them until no repo is left.
+        
+        Each finished repo's records are stored in the queue; merge_queue_results
+        writes the outputs. A heartbeat thread keeps the leases alive while a batch runs.
+        If it cannot renew them for HEARTBEAT_GIVE_UP of a lease, the worker abandons
+        its batch and stops, so the repos go to other workers once the leases expire.
+        """
+        print(f"Worker {worker_id} taking batches of {batch_size} repos from {work_queue.path}")
+        stop = threading.Event()  # Set by the worker when it is done, or by the heartbeat when it gives up
+        
+        def heartbeat():
+            renewed = time.time()
+            wait = work_queue.lease_seconds / 3
+            try:
+                while not stop.wait(wait):
+                    try:
+                        work_queue.heartbeat(worker_id)
+                    except sqlite3.Error as e:
+                        failing = time.time() - renewed
+                        if failing > work_queue.lease_seconds * HEARTBEAT_GIVE_UP:
+                            print(f"Worker {worker_id}: leases not renewed for {failing:.0f}s ({e}); giving up")
+                            return
+                        print(f"Worker {worker_id}: heartbeat failed ({e}); retrying")
+                        wait = work_queue.lease_seconds / 20
+                        continue
+                    renewed = time.time()
+                    wait = work_queue.lease_seconds / 3
+            finally:
+                stop.set()
+        
+        threading.Thread(target=heartbeat, name='heartbeat', daemon=True).start()
+        completed = 0
+        self.start_diff_pool()
+        try:
+            with ProgressReporter(None, PROGRESS_INTERVAL, worker_path(METRICS_PATH, worker_id)):
+                while not stop.is_set():
+                    leased = work_queue.lease(worker_id, batch_size)
+                    if not leased:
+                        expiry = work_queue.next_expiry()
+                        if expiry is None:
+                            break
+                        # Other workers hold the rest; leases of crashed workers expire and come back
+                        time.sleep(min(QUEUE_POLL_SECONDS, max(expiry - time.time(), 1)))
+                        continue
+                    batch = [repo_data for _, repo_data in leased]
+                    results = asyncio.run(self.analyze_repos(batch, lambda records: None, abort=stop))
+                    if stop.is_set():
+                        # The leases may already be gone; the repos come back when they expire
+                        print(f"Worker {worker_id} abandoned a batch of {len(batch)} repos")
+                        break
+                    completed += self.complete_batch(work_queue, worker_id, batch, results)
+        finally:
+            stop.set()
+            self.stop_diff_pool()
+            work_queue.release(worker_id)
+        
+        print(f"Worker {worker_id} finished {completed} repos")
+        print(self.client.cache_report())
+        print(METRICS.stage_report())
+        METRICS.write_trace(worker_path(TRACE_PATH, worker_id))
+        METRICS.write_prometheus(worker_path(METRICS_PATH, worker_id))
+        return completed
+    
+    def complete_batch(self, work_queue, worker_id, batch, results):
+        """Hand a batch's outcomes to the queue; repos with failed PRs are retried"""
+        completed = 0
+        for repo_data, processed in zip(batch, results):
+            repo_name = repo_data['repo_name']
+            if processed is None:
+                work_queue.fail(worker_id, repo_name, 'analysis raised an error (see the worker output)')
+            elif not processed:
+                completed += work_queue.complete(worker_id, repo_name, state='skipped')
+            elif self.checkpoint.get(repo_name)[0] != 'done':
+                work_queue.fail(worker_id, repo_name, 'some PRs could not be analyzed')
+            else:
+                records = self.checkpoint.records(repo_name)
+                if work_queue.complete(worker_id, repo_name, records):
+                    completed += 1
+                    METRICS.count('pipeline_repos')
+                    METRICS.count('pipeline_prs', len(records))
+                else:
+                    print(f"  {repo_name}: lease expired and was taken by another worker; result dropped")
+        return completed
+    
+    def merge_queue_results(self, work_queue, output_stem=OUTPUT_STEM, output_formats=OUTPUT_FORMATS):
+        """Write the records stored by the queue workers, in repo order, and aggregate the summary"""
+        counts = work_queue.counts()
+        unfinished = counts.get('pending', 0) + counts.get('leased', 0)
+        if unfinished:
+            print(f"Warning: {unfinished} repos are not finished yet; merging the {counts.get('done', 0)} done")
+        
+        self.summary = SummaryAggregator(SUMMARY_TOTALS.values(), SUMMARY_GROUPS, SUMMARY_REPO_METRICS)
+        print(f"Writing detailed analysis to {', '.join(f'{output_stem}.{fmt}' for fmt in output_formats)}")
+        with stage('write'), ResultWriters(output_stem, output_formats) as writers:
+            for _, _, records in work_queue.results():
+                writers.write_many(records)
+                self.summary.add_many(records)
+        
+        print(f"Merged {counts.get('done', 0)} repos ({self.summary.count} PRs), "
+              f"{counts.get('skipped', 0)} skipped, {counts.get('failed', 0)} failed")
+        for worker in work_queue.workers():
+            print(f"  {worker['worker_id']}: {worker['completed']} repos, token slot {worker['token_slot']}")
+        for repo_name, error in work_queue.failures().items():
+            print(f"  Failed {repo_name}: {error}")
+        return self.summary
     
-    def generate_summary_statistics(self, analysis_data):
-        """Generate summary statistics from analysis"""
-        if not analysis_data:
+    def generate_summary_statistics(self, aggregator):
+        """Summary statistics from a SummaryAggregator; works mid-run and on merged aggregators"""
+        if aggregator is None or not aggregator.count:
             return None
         
-        summary = {
-            'total_prs_analyzed': len(analysis_data),
-            'total_repos': len(set(pr['repo_name'] for pr in analysis_data)),
-            'total_files_changed': sum(pr['files_changed'] for pr in analysis_data),
-            'total_files_added': sum(pr['files_added'] for pr in analysis_data),
-            'total_files_modified': sum(pr['files_modified'] for pr in analysis_data),
-            'total_files_deleted': sum(pr['files_deleted'] for pr in analysis_data),
-            'total_lines_added': sum(pr['total_lines_added'] for pr in analysis_data),
-            'total_lines_removed': sum(pr['total_lines_removed'] for pr in analysis_data),
-            'total_code_additions': sum(pr['code_additions'] for pr in analysis_data),
-            'total_code_deletions': sum(pr['code_deletions'] for pr in analysis_data),
-            'total_comment_additions': sum(pr['comment_additions'] for pr in analysis_data),
-            'total_comment_deletions': sum(pr['comment_deletions'] for pr in analysis_data),
-            'total_imports_added': sum(pr['imports_added'] for pr in analysis_data),
-            'total_functions_added': sum(pr['functions_added'] for pr in analysis_data),
-            'total_classes_added': sum(pr['classes_added'] for pr in analysis_data),
-            'total_test_changes': sum(pr['test_changes'] for pr in analysis_data),
-        }
+        snapshot = aggregator.to_dict()
+        summary = {'total_prs_analyzed': snapshot['prs'], 'total_repos': snapshot['repos']}
+        summary.update((key, snapshot['metrics'][field]['sum']) for key, field in SUMMARY_TOTALS.items())
         
         # Calculate averages
-        summary['avg_files_per_pr'] = summary['total_files_changed'] / len(analysis_data)
-        summary['avg_lines_added_per_pr'] = summary['total_lines_added'] / len(analysis_data)
-        summary['avg_lines_removed_per_pr'] = summary['total_lines_removed'] / len(analysis_data)
+        summary['avg_files_per_pr'] = snapshot['metrics']['files_changed']['mean']
+        summary['avg_lines_added_per_pr'] = snapshot['metrics']['total_lines_added']['mean']
+        summary['avg_lines_removed_per_pr'] = snapshot['metrics']['total_lines_removed']['mean']
+        
+        # Per-PR distributions (t-digest percentiles) and group-bys
+        summary['per_pr'] = snapshot['metrics']
+        for group in SUMMARY_GROUPS:
+            summary[f'by_{group}'] = snapshot[f'by_{group}']
+        summary['top_repos'] = snapshot['top_repos']
         
         return summary
     
+    def write_summary(self, summary_stats):
+        """Write the summary JSON under a temporary name and move it into place"""
+        if not summary_stats:
+            return
+        with open(SUMMARY_PATH + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(summary_stats, f, indent=2)
+        os.replace(SUMMARY_PATH + '.tmp', SUMMARY_PATH)
+    
     def save_summary(self, summary_stats):
         """Save summary statistics"""
         if not summary_stats:
             return
         
-        output_file = 'code_changes_summary.json'
-        
-        print(f"\nSaving summary statistics to {output_file}...")
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(summary_stats, f, indent=2)
+        print(f"\nSaving summary statistics to {SUMMARY_PATH}...")
+        self.write_summary(summary_stats)
         
         print("\nSummary Statistics:")
         print("=" * 80)
         for key, value in summary_stats.items():
             if isinstance(value, float):
                 print(f"{key}: {value:.2f}")
-            else:
+            elif not isinstance(value, dict):
                 print(f"{key}: {value}")
+        for field, stats in summary_stats['per_pr'].items():
+            print(f"{field}: mean {stats['mean']:.2f}, std {stats['std']:.2f}, "
+                  f"p50 {stats['p50']:.1f}, p90 {stats['p90']:.1f}, p99 {stats['p99']:.1f}")
         print("=" * 80)
 
 
+def run_queue_worker(queue_path, worker_id=None, batch_size=QUEUE_BATCH_SIZE):
+    """Register with the queue, take a token slot of its own and work until the queue is drained.
+    
+    The checkpoint and HTTP cache live in WORKER_STATE_DIR (GITHUB_CACHE_PATH still wins for
+    the cache), never next to the queue, so no WAL database ends up on shared storage. The
+    checkpoint is shared by the workers of a host, so a repo that comes back to this host after
+    a worker died resumes after its last finished PR.
+    """
+    if not WORKER_STATE_DIR:
+        raise ValueError("Queue workers need WORKER_STATE_DIR: a persistent, host-local directory "
+                         "for their checkpoint and HTTP cache")
+    work_queue = WorkQueue(queue_path)
+    worker_id = worker_id or default_worker_id()
+    tokens = load_tokens()
+    slot = work_queue.register(worker_id, len(tokens))
+    print(f"Worker {worker_id} uses token {slot + 1} of {len(tokens)}")
+    os.makedirs(WORKER_STATE_DIR, exist_ok=True)
+    checkpoint_path = os.path.join(WORKER_STATE_DIR, worker_path(CHECKPOINT_PATH, socket.gethostname()))
+    cache = open_default_cache(os.path.join(WORKER_STATE_DIR, DEFAULT_CACHE_PATH))
+    print(f"Worker {worker_id} keeps its checkpoint in {checkpoint_path}")
+    try:
+        analyzer = CodeChangeAnalyzer(checkpoint_path=checkpoint_path, tokens=[tokens[slot]], cache=cache)
+        return analyzer.run_worker(work_queue, worker_id, batch_size)
+    finally:
+        work_queue.close()
+
+
 if __name__ == "__main__":
-    analyzer = CodeChangeAnalyzer()
-    analysis_results = analyzer.run_analysis()
-    analyzer.save_results(analysis_results)
-    summary = analyzer.generate_summary_statistics(analysis_results)
-    analyzer.save_summary(summary)
-    
-    print("\nAnalysis complete! Results saved to:")
-    print("  - code_changes_analysis.csv (detailed PR analysis)")
-    print("  - code_changes_summary.json (summary statistics)")
+    parser = argparse.ArgumentParser(description='Analyze the PRs merged between StarCoder V1 and V2 commits')
+    parser.add_argument('--queue', help='SQLite work queue shared by workers; see work_queue.py')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--enqueue', action='store_true', help='fill the queue with the overlapping repos')
+    action.add_argument('--worker', action='store_true', help='analyze leased repos until the queue is drained')
+    action.add_argument('--merge', action='store_true', help='write the outputs and summary from the queue')
+    parser.add_argument('--worker-id', help='defaults to <host>-<pid>')
+    parser.add_argument('--batch-size', type=int, default=QUEUE_BATCH_SIZE)
+    args = parser.parse_args()
+    if (args.enqueue or args.worker or args.merge) != bool(args.queue):
+        parser.error('--queue needs one of --enqueue, --worker or --merge, and they need --queue')
+    if args.worker and not WORKER_STATE_DIR:
+        parser.error('--worker needs WORKER_STATE_DIR, a persistent host-local directory for its checkpoint')
+    
+    if args.enqueue:
+        CodeChangeAnalyzer().fill_queue(WorkQueue(args.queue))
+    elif args.worker:
+        run_queue_worker(args.queue, args.worker_id, args.batch_size)
+    else:
+        analyzer = CodeChangeAnalyzer()
+        if args.merge:
+            aggregator = analyzer.merge_queue_results(WorkQueue(args.queue))
+        else:
+            aggregator = analyzer.run_analysis()
+        summary = analyzer.generate_summary_statistics(aggregator)
+        analyzer.save_summary(summary)
+        
+        print("\nAnalysis complete! Results saved to:")
+        for output_format in OUTPUT_FORMATS:
+            print(f"  - {OUTPUT_STEM}.{output_format} (detailed PR analysis)")
+        print(f"  - {SUMMARY_PATH} (summary statistics)")
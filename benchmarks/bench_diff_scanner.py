@@ -0,0 +1,120 @@
+"""
+Micro-benchmark for the diff scanner.
+
+Builds large synthetic patches and reports lines per second for
+diff_scanner.scan_patch, next to the previous per-file approach
+(line heuristic plus three multiline regex scans) for reference. The
+Python and JavaScript hunks put comments or strings on most lines, which
+the scanner has to lex; the plain hunk is code without either, which takes
+its fast path.
+
+Usage: python benchmarks/bench_diff_scanner.py [lines_per_patch] [repeats]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diff_scanner import scan_patch
+
+PYTHON_HUNK = [
+    '+import os',
+    '+from collections import defaultdict',
+    '+',
+    '+class Loader:',
+    '+    """Load things # not a comment"""',
+    '+    def load(self, path):',
+    '+        # read the file',
+    "+        with open(path) as f:  # inline comment",
+    "+            return f.read().replace('#', '')",
+    ' unchanged = True',
+    '-old_value = compute(1, 2)  # legacy',
+    '-print("done")',
+]
+PLAIN_HUNK = [
+    '+import os',
+    '+',
+    '+class Loader:',
+    '+    def load(self, path):',
+    '+        with open(path) as f:',
+    '+            data = f.read()',
+    '+        return data.split()',
+    ' unchanged = True',
+    '-old_value = compute(1, 2)',
+    '-print(value)',
+]
+JAVASCRIPT_HUNK = [
+    "+import { readFile } from 'fs';",
+    "+const url = 'https://example.com/#anchor';",
+    '+/* block comment',
+    '+ * spanning lines',
+    '+ */',
+    '+export async function load(path) {',
+    '+  // read the file',
+    '+  const data = await readFile(path, `utf8 ${path}`);',
+    '+  return data.split("//");',
+    '+}',
+    ' const unchanged = true;',
+    '-var old = require("./old");',
+]
+
+
+def build_patch(hunk, total_lines):
+    lines = []
+    while len(lines) < total_lines:
+        lines.append(f'@@ -{len(lines) + 1},3 +{len(lines) + 1},10 @@')
+        lines.extend(hunk)
+    return '\n'.join(lines[:total_lines])
+
+
+def legacy_scan(patch):
+    """The previous analyze_diff heuristic plus the three pattern regexes"""
+    analysis = {'code_additions': 0, 'code_deletions': 0, 'comment_additions': 0,
+                'comment_deletions': 0, 'lines_added': 0, 'lines_removed': 0}
+    for line in patch.split('\n'):
+        if line.startswith('+') and not line.startswith('+++'):
+            analysis['lines_added'] += 1
+            if '#' in line or '//' in line or '/*' in line:
+                analysis['comment_additions'] += 1
+            else:
+                analysis['code_additions'] += 1
+        elif line.startswith('-') and not line.startswith('---'):
+            analysis['lines_removed'] += 1
+            if '#' in line or '//' in line or '/*' in line:
+                analysis['comment_deletions'] += 1
+            else:
+                analysis['code_deletions'] += 1
+    re.search(r'^\+.*import\s|^\+.*require\(', patch, re.MULTILINE)
+    re.search(r'^\+\s*(def|function|const.*=.*\(|async.*\()', patch, re.MULTILINE)
+    re.search(r'^\+\s*class\s+', patch, re.MULTILINE)
+    return analysis
+
+
+def measure(func, patch, repeats):
+    line_count = patch.count('\n') + 1
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(patch)
+        best = min(best, time.perf_counter() - start)
+    return line_count / best
+
+
+def main():
+    total_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Diff scanner benchmark: {total_lines:,} lines per patch, best of {repeats}")
+    for name, language, hunk in (('Python', 'Python', PYTHON_HUNK), ('JavaScript', 'JavaScript', JAVASCRIPT_HUNK),
+                                 ('Plain code', 'Python', PLAIN_HUNK)):
+        patch = build_patch(hunk, total_lines)
+        scanner_rate = measure(lambda p: scan_patch(p, language), patch, repeats)
+        legacy_rate = measure(legacy_scan, patch, repeats)
+        print(f"  {name:<10}  scan_patch: {scanner_rate:>12,.0f} lines/sec   "
+              f"legacy: {legacy_rate:>12,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Measures the constants of git_mirror.choose_backend's cost model.
+
+For each repo it times a blob-less clone with GitMirror, diffs the last
+--diffs first-parent commits of the default branch locally, and fetches
+the diffs of as many recently merged PRs from the API (uncached). It
+prints the per-repo numbers and, from two or more repos of different
+sizes, a least-squares fit of clone seconds = CLONE_BASE_SECONDS +
+size_kb / CLONE_KB_PER_SECOND. Run it from the network the workers use,
+on repos typical of the dataset.
+
+GIT_MIRROR_URL points the clones elsewhere. With --no-api, no API calls
+are made and the clone's size on disk stands in for the size the API
+reports.
+
+Usage: python benchmarks/bench_git_mirror.py owner/repo [owner/repo ...] [--diffs 30] [--no-api]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from git_mirror import GitMirror
+from github_client import GitHubClient
+from pr_diff import fetch_pr_files
+
+
+def disk_size_kb(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) // 1024
+
+
+def time_local_diffs(mirror, count):
+    """Mean seconds of one local diff over the last count first-parent commits of HEAD"""
+    output = mirror.git('rev-list', '--first-parent', '--parents', f'--max-count={count}', 'HEAD')
+    for line in output.decode().splitlines():
+        sha, *parents = line.split()
+        mirror.parents[sha] = parents
+    start = time.perf_counter()
+    for sha in mirror.parents:
+        mirror.pr_files(sha)
+    return (time.perf_counter() - start) / max(len(mirror.parents), 1)
+
+
+def time_api_diffs(client, repo_name, count):
+    """Mean seconds of one PR diff request over the repo's last count merged PRs"""
+    response = client.get(f'/repos/{repo_name}/pulls', params={'state': 'closed', 'per_page': 100})
+    numbers = [pr['number'] for pr in response.json() if pr.get('merged_at')][:count]
+    start = time.perf_counter()
+    for number in numbers:
+        fetch_pr_files(client, repo_name, number)
+    return (time.perf_counter() - start) / max(len(numbers), 1)
+
+
+def fit_clone_cost(samples):
+    """(base seconds, KB per second) fitted to [(size_kb, seconds)]; None without two sizes"""
+    if len({size for size, _ in samples}) < 2:
+        return None
+    mean_size = sum(size for size, _ in samples) / len(samples)
+    mean_seconds = sum(seconds for _, seconds in samples) / len(samples)
+    slope = (sum((size - mean_size) * (seconds - mean_seconds) for size, seconds in samples)
+             / sum((size - mean_size) ** 2 for size, _ in samples))
+    if slope <= 0:
+        return None
+    return mean_seconds - slope * mean_size, 1 / slope
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the constants of git_mirror's cost model")
+    parser.add_argument('repos', nargs='+', help='owner/name')
+    parser.add_argument('--diffs', type=int, default=30, help='diffs timed per repo and backend')
+    parser.add_argument('--no-api', action='store_true', help='time only the clone and local diffs')
+    args = parser.parse_args()
+
+    client = None if args.no_api else GitHubClient(cache=None)
+    samples, local_means, api_means = [], [], []
+    print(f"{'repo':<40} {'size KB':>10} {'clone s':>9} {'local diff s':>13} {'API diff s':>11}")
+    with tempfile.TemporaryDirectory() as root:
+        for repo_name in args.repos:
+            mirror = GitMirror(repo_name, root)
+            start = time.perf_counter()
+            mirror.ensure()
+            clone_seconds = time.perf_counter() - start
+            if client is None:
+                size_kb = disk_size_kb(mirror.path)
+            else:
+                size_kb = client.get(f'/repos/{repo_name}').json()['size']
+            local_seconds = time_local_diffs(mirror, args.diffs)
+            api_seconds = time_api_diffs(client, repo_name, args.diffs) if client else None
+            mirror.remove()
+            samples.append((size_kb, clone_seconds))
+            local_means.append(local_seconds)
+            if api_seconds is not None:
+                api_means.append(api_seconds)
+            api_column = f'{api_seconds:>11.3f}' if api_seconds is not None else f"{'-':>11}"
+            print(f'{repo_name:<40} {size_kb:>10} {clone_seconds:>9.2f} {local_seconds:>13.3f} {api_column}')
+
+    print(f'\nLOCAL_DIFF_SECONDS = {sum(local_means) / len(local_means):.3f}')
+    if api_means:
+        print(f'API_REQUEST_SECONDS = {sum(api_means) / len(api_means):.3f}')
+    fit = fit_clone_cost(samples)
+    if fit:
+        print(f'CLONE_BASE_SECONDS = {max(fit[0], 0):.1f}')
+        print(f'CLONE_KB_PER_SECOND = {fit[1]:.0f}')
+    else:
+        print('Clone cost: pass two or more repos of different sizes to fit CLONE_BASE_SECONDS and CLONE_KB_PER_SECOND')
+
+
+if __name__ == "__main__":
+    main()
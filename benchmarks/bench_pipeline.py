@@ -0,0 +1,163 @@
+"""
+End-to-end throughput benchmark of the analysis pipelines.
+
+Starts mock_github_server.py on synthetic fixtures and runs, each in a
+fresh working directory and its own process (so peak RSS is per flow):
+
+- analyzer:       CodeChangeAnalyzer.run_analysis (analyze_code_changes.py)
+- repo_analysis:  the github_repo_analysis.py script
+
+and reports repos/sec, API calls per repo (by endpoint), PRs/sec and peak
+RSS. Caches and checkpoints start empty, so every run is a cold run. Save
+the results with --json and pass them back with --baseline to see the
+change from an earlier run.
+
+Usage: python benchmarks/bench_pipeline.py [--repos 200] [--prs 5] [--files 3]
+                                           [--flows analyzer,repo_analysis]
+                                           [--json results.json] [--baseline old.json]
+"""
+import os
+import csv
+import sys
+import json
+import time
+import runpy
+import resource
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_github_server import MockGitHubServer, generate_fixtures
+
+FLOWS = ('analyzer', 'repo_analysis')
+# Input CSVs each flow reads from its working directory
+FLOW_INPUTS = {
+    'analyzer': ('starcoder_v1_repos.csv', 'starcoder_v2_repos.csv'),
+    'repo_analysis': ('test_v1_repos.csv', 'test_v2_repos.csv'),
+}
+
+
+def write_inputs(workdir, fixtures, flow):
+    v1_csv, v2_csv = FLOW_INPUTS[flow]
+    for filename, key in ((v1_csv, 'v1_sha'), (v2_csv, 'v2_sha')):
+        with open(os.path.join(workdir, filename), 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['repo_name', 'commit_hash'])
+            for repo_name, repo in fixtures['repos'].items():
+                writer.writerow([repo_name, repo[key]])
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest waited-for child, in MB"""
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor)
+
+
+def run_flow(flow, result_path):
+    """Child side: run one flow in the current directory and write its timings"""
+    start = time.perf_counter()
+    if flow == 'analyzer':
+        from analyze_code_changes import CodeChangeAnalyzer
+        prs = CodeChangeAnalyzer().run_analysis().count
+    else:
+        runpy.run_path(os.path.join(ROOT, 'github_repo_analysis.py'), run_name='__main__')
+        with open('filtered_merged_prs2.csv', newline='', encoding='utf-8') as csvfile:
+            prs = sum(1 for _ in csv.DictReader(csvfile))
+    elapsed = time.perf_counter() - start
+    rss, worker_rss = peak_rss_mb()
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump({'seconds': elapsed, 'prs': prs, 'peak_rss_mb': rss, 'worker_peak_rss_mb': worker_rss}, f)
+
+
+def bench_flow(server, fixtures, flow):
+    """Parent side: run a flow in a subprocess against the server and collect its numbers"""
+    workdir = tempfile.mkdtemp(prefix=f'bench_{flow}_')
+    write_inputs(workdir, fixtures, flow)
+    result_path = os.path.join(workdir, 'result.json')
+    env = dict(os.environ, GITHUB_API_URL=server.base_url, GITHUB_TOKEN='mock-token', GITHUB_TOKENS='')
+    before = server.snapshot()
+    with open(os.path.join(workdir, 'output.log'), 'w', encoding='utf-8') as log:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', flow, result_path],
+                       cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    calls = server.snapshot() - before
+    with open(result_path, encoding='utf-8') as f:
+        result = json.load(f)
+    repos = len(fixtures['repos'])
+    result.update({
+        'repos': repos,
+        'repos_per_sec': repos / result['seconds'],
+        'prs_per_sec': result['prs'] / result['seconds'],
+        'api_calls': sum(calls.values()),
+        'calls_per_repo': sum(calls.values()) / repos,
+        'calls_by_endpoint': dict(sorted(calls.items())),
+        'workdir': workdir,
+    })
+    return result
+
+
+def print_result(flow, result, baseline=None):
+    def change(key):
+        if not baseline or not baseline.get(key):
+            return ''
+        return f"  ({(result[key] - baseline[key]) / baseline[key] * 100:+.1f}%)"
+
+    print(f"{flow}:")
+    print(f"  {result['repos']} repos, {result['prs']} PRs in {result['seconds']:.2f}s")
+    print(f"  repos/sec:       {result['repos_per_sec']:10.1f}{change('repos_per_sec')}")
+    print(f"  PRs/sec:         {result['prs_per_sec']:10.1f}{change('prs_per_sec')}")
+    print(f"  API calls/repo:  {result['calls_per_repo']:10.2f}{change('calls_per_repo')}")
+    print(f"  peak RSS:        {result['peak_rss_mb']:10.1f} MB{change('peak_rss_mb')}"
+          f" (workers {result['worker_peak_rss_mb']:.1f} MB)")
+    print("  calls: " + ', '.join(f'{label} {count}' for label, count in result['calls_by_endpoint'].items()))
+    print(f"  log: {os.path.join(result['workdir'], 'output.log')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipelines against the mock GitHub API')
+    parser.add_argument('--repos', type=int, default=200)
+    parser.add_argument('--prs', type=int, default=5, help='PRs merged between V1 and V2 per repo')
+    parser.add_argument('--files', type=int, default=3, help='files per PR')
+    parser.add_argument('--lines', type=int, default=20, help='patch lines per file')
+    parser.add_argument('--flows', default=','.join(FLOWS))
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier --json run to compare against')
+    parser.add_argument('--child', nargs=2, metavar=('FLOW', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_flow(*args.child)
+        return
+
+    flows = [flow for flow in args.flows.split(',') if flow]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        sys.exit(f"Unknown flows {sorted(unknown)}; expected some of {list(FLOWS)}")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['flows']
+
+    fixtures = generate_fixtures(args.repos, args.prs, args.files, args.lines)
+    server = MockGitHubServer(fixtures).start()
+    print(f"Pipeline benchmark: {args.repos} repos x {args.prs} PRs x {args.files} files "
+          f"against {server.base_url}")
+    results = {}
+    try:
+        for flow in flows:
+            results[flow] = bench_flow(server, fixtures, flow)
+            print_result(flow, results[flow], baseline.get(flow))
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'params': {'repos': args.repos, 'prs': args.prs, 'files': args.files, 'lines': args.lines},
+                       'flows': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Bloom filter over the repo names of an index.
+
+The V2 overlap ingest checks every V2 repo against V1. Most V2 repos are
+not in V1, and the filter drops those in the workers with a few bit tests.
+The few false positives are removed by the exact merge join against the
+V1 index at the end, so they never reach the overlap output.
+
+The filter is saved next to its index (starcoder_v1_repos.idx.bloom) and
+rebuilt when the index is newer.
+"""
+import os
+import math
+import struct
+from hashlib import blake2b
+
+MAGIC = b'SCBLOOM1'
+HEADER = struct.Struct('<8s3Q')  # magic, bit count, hash count, item count
+ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """Bit array probed with k double-hashed positions per key"""
+
+    def __init__(self, capacity, error_rate=ERROR_RATE, bits=None, hashes=None, data=None):
+        capacity = max(capacity, 1)
+        self.bit_count = bits or max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = hashes or max(round(self.bit_count / capacity * math.log(2)), 1)
+        self.bits = bytearray(data) if data is not None else bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        digest = blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bit_count = self.bit_count
+        return [(h1 + i * h2) % bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.bit_count, self.hash_count, self.count))
+            f.write(self.bits)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, bit_count, hash_count, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter")
+            bloom = cls(count, bits=bit_count, hashes=hash_count, data=f.read())
+        bloom.count = count
+        return bloom
+
+
+def bloom_path_for(index_path):
+    return index_path + '.bloom'
+
+
+def open_index_bloom(index, error_rate=ERROR_RATE):
+    """Load the saved filter of a RepoIndex, building and saving it first if missing or stale"""
+    path = bloom_path_for(index.path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(index.path):
+        return BloomFilter.load(path)
+    bloom = BloomFilter(len(index), error_rate)
+    for name, _ in index.iter_raw():
+        bloom.add(bytes(name))
+    bloom.save(path)
+    return bloom
@@ -0,0 +1,95 @@
+"""
+Durable per-repo progress for the repo-processing pipelines.
+
+Each repo has a stage (for example 'dates', 'prs', 'done' or 'skipped')
+plus the JSON data needed to resume from it, and every finished PR record
+is stored as soon as it is produced. A restarted run skips finished repos
+and picks partially processed ones up after their last completed PR.
+Delete the checkpoint file to start from scratch.
+"""
+import json
+import time
+import sqlite3
+import threading
+
+
+class Checkpoint:
+    """SQLite journal of repo stages and finished PR records"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS repos (
+                repo_name TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                data TEXT,
+                updated_at REAL NOT NULL
+            )''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                repo_name TEXT NOT NULL,
+                pr_number INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (repo_name, pr_number)
+            )''')
+        self._conn.commit()
+
+    def get(self, repo_name):
+        """Return (stage, data) for a repo, or (None, None) if it was never started"""
+        with self._lock:
+            row = self._conn.execute('SELECT stage, data FROM repos WHERE repo_name = ?',
+                                     (repo_name,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def stages(self):
+        """Map of every known repo to its stage"""
+        with self._lock:
+            return dict(self._conn.execute('SELECT repo_name, stage FROM repos'))
+
+    def set_stage(self, repo_name, stage, data=None):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)',
+                               (repo_name, stage, json.dumps(data) if data is not None else None,
+                                time.time()))
+            self._conn.commit()
+
+    def add_record(self, repo_name, pr_number, record):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                               (repo_name, pr_number, json.dumps(record)))
+            self._conn.commit()
+
+    def finish_repo(self, repo_name, records=(), stage='done'):
+        """Store a repo's remaining records and mark it finished in one transaction"""
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                                   [(repo_name, record['pr_number'], json.dumps(record))
+                                    for record in records])
+            self._conn.execute('INSERT OR REPLACE INTO repos VALUES (?, ?, NULL, ?)',
+                               (repo_name, stage, time.time()))
+            self._conn.commit()
+
+    def completed_prs(self, repo_name):
+        with self._lock:
+            return {row[0] for row in self._conn.execute(
+                'SELECT pr_number FROM records WHERE repo_name = ?', (repo_name,))}
+
+    def records(self, repo_name=None):
+        """Stored records of one repo, or of every repo in insertion order"""
+        with self._lock:
+            if repo_name is None:
+                rows = self._conn.execute('SELECT record FROM records ORDER BY rowid').fetchall()
+            else:
+                rows = self._conn.execute('SELECT record FROM records WHERE repo_name = ? ORDER BY rowid',
+                                          (repo_name,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
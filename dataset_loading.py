@@ -1,9 +1,9 @@
 import os
 from dotenv import load_dotenv
 from huggingface_hub import login
-from datasets import load_dataset
 import csv
 import time
+from stack_shards import V1_DATASET, V2_DATASET, iter_repo_rows
 
 start_time = time.monotonic()
 
@@ -12,16 +12,18 @@ HF_TOKEN = os.getenv("HF_TOKEN")
 
 login(token=HF_TOKEN)
 
-Starcoder_V1 = load_dataset("bigcode/the-stack-dedup", streaming=True)
-Starcoder_V2 = load_dataset("bigcode/the-stack-v2-dedup", "default", streaming=True)
+# Only the repo name and commit hash columns are read from the Parquet shards
+# ('parquet', from the Hub or the STACK_V1_DIR / STACK_V2_DIR mirrors), or
+# streamed through datasets with select_columns ('datasets')
+INGEST_MODE = os.getenv("INGEST_MODE", "parquet")
 
 repo_v1 = {}
 repo_v2 = {}
 
 v1_start = time.monotonic()
 print("Processing V1 data...")
-for row in Starcoder_V1['train']:
-    repo_v1[row["max_stars_repo_name"]] = row["max_stars_repo_head_hexsha"]
+for batch in iter_repo_rows(V1_DATASET, mode=INGEST_MODE):
+    repo_v1.update(batch)
 print(f"Done processing V1 data...")
 
 
@@ -38,8 +40,8 @@ print(f"Done saving V1 data... \nTotal V1 execution time: {v1_exec:.2f} seconds"
 
 v2_start = time.monotonic()
 print("Processing V2 data...")
-for row in Starcoder_V2['train']:
-    repo_v2[row["repo_name"]] = row["revision_id"]
+for batch in iter_repo_rows(V2_DATASET, mode=INGEST_MODE):
+    repo_v2.update(batch)
 print("Done processing V2 data...")
 
 
@@ -0,0 +1,287 @@
+"""
+Single-pass, language-aware scanner for unified diff patches.
+
+scan_patch walks a patch once and computes every per-file metric the
+analyzer needs: added/removed lines split into code and comment lines,
+plus whether imports, functions or classes were added. Comment detection
+uses per-language lexical rules, so a '#' inside a JavaScript string is
+code, and lines inside a block comment count as comments. The old and new
+sides of the diff are lexed separately: context lines advance both, '-'
+lines only the old side and '+' lines only the new side. Lines with no
+comment opener or multi-line string delimiter are counted as code without
+lexing, which keeps plain code at the speed of a substring check.
+"""
+import re
+
+
+class LanguageRules:
+    """Comment/string syntax and declaration patterns of one language"""
+
+    def __init__(self, line_comments=(), block_comments=(), strings=('"', "'"), multiline_strings=(),
+                 imports=None, functions=None, classes=None):
+        self.block_close = {}
+        self.string_end = {}
+        self.multiline_strings = set(multiline_strings)
+        tokens = [(d, 'line') for d in line_comments] + [(o, 'block') for o, _ in block_comments] + \
+                 [(d, 'string') for d in strings]
+        # Longest delimiters first so that ''' wins over '
+        self.tokens = sorted(tokens, key=lambda t: -len(t[0]))
+        # A one-character class is much cheaper to search for than the token alternation
+        first_chars = sorted({delimiter[0] for delimiter, _ in tokens})
+        self.token_re = re.compile('[' + ''.join(re.escape(c) for c in first_chars) + ']') if tokens else None
+        for opener, closer in block_comments:
+            self.block_close[opener] = closer
+        for delimiter in strings:
+            quote = re.escape(delimiter)
+            if len(delimiter) == 1:
+                # Unrolled form: runs of ordinary characters between escapes
+                body = f'[^{quote}\\\\]*(?:\\\\.[^{quote}\\\\]*)*'
+            else:
+                body = r'(?:\\.|[^\\])*?'
+            self.string_end[delimiter] = re.compile(body + quote, re.DOTALL)
+        # A line containing none of these is code without comments and leaves the lexer in code:
+        # one-line strings cannot outlive it. Plain substring checks are much cheaper than lexing
+        self.state_markers = tuple(delimiter for delimiter, kind in self.tokens if kind != 'string') + \
+                             tuple(sorted(self.multiline_strings, key=len, reverse=True))
+        self.imports = re.compile(imports) if imports else None
+        self.functions = re.compile(functions) if functions else None
+        self.classes = re.compile(classes) if classes else None
+
+
+# Declaration patterns used when a language has no specific ones (the original heuristics)
+GENERIC_IMPORTS = r'import\s|require\('
+GENERIC_FUNCTIONS = r'^\s*(def|function|const.*=.*\(|async.*\()'
+GENERIC_CLASSES = r'^\s*class\s+'
+
+JS_RULES = LanguageRules(
+    line_comments=('//',), block_comments=(('/*', '*/'),), strings=('"', "'", '`'), multiline_strings=('`',),
+    imports=r'^\s*import[\s{*"\']|\brequire\(|^\s*export\s+.*\bfrom\s',
+    functions=r'^\s*(export\s+)?(default\s+)?(async\s+)?function\b'
+              r'|^\s*(export\s+)?(const|let|var)\s+\w+\s*=\s*(async\s*)?(function\b|\(|\w+\s*=>)',
+    classes=r'^\s*(export\s+)?(default\s+)?(abstract\s+)?class\s+',
+)
+C_LIKE_RULES = LanguageRules(
+    line_comments=('//',), block_comments=(('/*', '*/'),),
+    imports=r'^\s*(#\s*include|import|using|package)\b',
+    functions=GENERIC_FUNCTIONS, classes=r'^\s*(public\s+|private\s+|protected\s+|internal\s+)?'
+                                         r'(abstract\s+|final\s+|static\s+|sealed\s+|data\s+)*(class|struct|interface)\s+',
+)
+HASH_RULES = LanguageRules(line_comments=('#',), imports=GENERIC_IMPORTS,
+                           functions=GENERIC_FUNCTIONS, classes=GENERIC_CLASSES)
+
+RULES = {
+    'Python': LanguageRules(
+        line_comments=('#',), strings=('"""', "'''", '"', "'"), multiline_strings=('"""', "'''"),
+        imports=r'^\s*(import\s+\w|from\s+\S+\s+import\b)',
+        functions=r'^\s*(async\s+)?def\s+\w',
+        classes=r'^\s*class\s+\w',
+    ),
+    'JavaScript': JS_RULES,
+    'TypeScript': JS_RULES,
+    'Java': C_LIKE_RULES,
+    'C': C_LIKE_RULES,
+    'C++': C_LIKE_RULES,
+    'C#': C_LIKE_RULES,
+    'Kotlin': C_LIKE_RULES,
+    'Scala': C_LIKE_RULES,
+    'Swift': C_LIKE_RULES,
+    'Rust': LanguageRules(
+        line_comments=('//',), block_comments=(('/*', '*/'),), strings=('"',),
+        imports=r'^\s*(pub\s+)?(use|extern\s+crate)\s', functions=r'^\s*(pub(\(\w+\))?\s+)?(async\s+)?fn\s+\w',
+        classes=r'^\s*(pub(\(\w+\))?\s+)?(struct|enum|trait)\s+\w',
+    ),
+    'Go': LanguageRules(
+        line_comments=('//',), block_comments=(('/*', '*/'),), strings=('"', "'", '`'), multiline_strings=('`',),
+        imports=r'^\s*import\b|^\s*"[\w./-]+"\s*$', functions=r'^\s*func\s', classes=r'^\s*type\s+\w+\s+(struct|interface)\b',
+    ),
+    'PHP': LanguageRules(
+        line_comments=('//', '#'), block_comments=(('/*', '*/'),),
+        imports=r'^\s*(use\s|require(_once)?\b|include(_once)?\b)', functions=r'^\s*(public\s+|private\s+|protected\s+|static\s+)*function\b',
+        classes=r'^\s*(abstract\s+|final\s+)?(class|interface|trait)\s+',
+    ),
+    'Ruby': LanguageRules(
+        line_comments=('#',), imports=r'^\s*(require|require_relative|load)\b',
+        functions=r'^\s*def\s', classes=r'^\s*(class|module)\s+',
+    ),
+    'Shell': HASH_RULES,
+    'YAML': LanguageRules(line_comments=('#',)),
+    'SQL': LanguageRules(line_comments=('--',), block_comments=(('/*', '*/'),), strings=("'", '"')),
+    'CSS': LanguageRules(block_comments=(('/*', '*/'),)),
+    'HTML': LanguageRules(block_comments=(('<!--', '-->'),), strings=()),
+    'XML': LanguageRules(block_comments=(('<!--', '-->'),), strings=()),
+    'JSON': LanguageRules(strings=('"',)),
+}
+# Unknown file types keep the original heuristic: '#', '//' and '/*' start comments
+DEFAULT_RULES = LanguageRules(line_comments=('#', '//'), block_comments=(('/*', '*/'),),
+                              imports=GENERIC_IMPORTS, functions=GENERIC_FUNCTIONS, classes=GENERIC_CLASSES)
+
+
+def rules_for(language):
+    return RULES.get(language, DEFAULT_RULES)
+
+
+def lex_line(rules, text, state):
+    """Lex one source line; returns (state after the line, has_code, has_comment).
+
+    state is None in code, ('block', closer) inside a block comment, or
+    ('string', delimiter) inside a multi-line string.
+    """
+    has_code = has_comment = False
+    pos, end = 0, len(text)
+    while pos < end:
+        if state is not None:
+            kind, delimiter = state
+            if kind == 'block':
+                has_comment = True
+                close = text.find(delimiter, pos)
+                if close < 0:
+                    return state, has_code, has_comment
+                pos = close + len(delimiter)
+            else:
+                has_code = True
+                match = rules.string_end[delimiter].match(text, pos)
+                if match is None:
+                    # Only multi-line strings survive the end of the line
+                    return (state if delimiter in rules.multiline_strings else None), has_code, has_comment
+                pos = match.end()
+            state = None
+            continue
+
+        match = rules.token_re.search(text, pos) if rules.token_re is not None else None
+        if match is None:
+            if not has_code and text[pos:].strip():
+                has_code = True
+            return None, has_code, has_comment
+        start = match.start()
+        for token, kind in rules.tokens:
+            if text.startswith(token, start):
+                break
+        else:
+            # Only the first character matched, e.g. a lone '/'
+            has_code = True
+            pos = start + 1
+            continue
+        if not has_code and text[pos:start].strip():
+            has_code = True
+        if kind == 'line':
+            return None, has_code, True
+        if kind == 'block':
+            state = ('block', rules.block_close[token])
+        else:
+            state = ('string', token)
+        pos = start + len(token)
+    if state is not None and state[0] == 'string' and state[1] not in rules.multiline_strings:
+        return None, True, has_comment  # A one-line string opened at the very end of the line
+    return state, has_code, has_comment
+
+
+def find_declarations(declarations, found, text):
+    """Mark the import/function/class patterns text matches; returns how many are still unmatched"""
+    for i, pattern in enumerate(declarations):
+        if pattern is not None and not found[i] and pattern.search(text):
+            found[i] = True
+    return sum(not found[i] for i, pattern in enumerate(declarations) if pattern is not None)
+
+
+def empty_scan():
+    return {
+        'lines_added': 0,
+        'lines_removed': 0,
+        'code_additions': 0,
+        'code_deletions': 0,
+        'comment_additions': 0,
+        'comment_deletions': 0,
+        'imports_added': 0,
+        'functions_added': 0,
+        'classes_added': 0,
+    }
+
+
+def scan_lines(lines, language='Other'):
+    """Scan an iterable of patch lines, e.g. as they stream in (see scan_patch)"""
+    rules = rules_for(language)
+    markers = rules.state_markers
+    declarations = (rules.imports, rules.functions, rules.classes)
+    found = [False, False, False]
+    pending = sum(pattern is not None for pattern in declarations)
+    old_state = new_state = None
+    in_hunks = False  # ---/+++ are file headers only before the first @@
+    code_added = comment_added = code_removed = comment_removed = 0
+
+    for line in lines:
+        if old_state is None and new_state is None:
+            # Fast path: both sides in code and the line opens no comment or multi-line string
+            for marker in markers:
+                if marker in line:
+                    break
+            else:
+                first = line[:1]
+                if first == '+':
+                    if in_hunks or not line.startswith('+++'):
+                        code_added += 1
+                        if pending:
+                            pending = find_declarations(declarations, found, line[1:])
+                elif first == '-':
+                    if in_hunks or not line.startswith('---'):
+                        code_removed += 1
+                elif first == '@':
+                    in_hunks = True
+                continue
+
+        marker = line[:1]
+        if marker == '+':
+            if not in_hunks and line.startswith('+++'):
+                continue
+            starts_in_code = new_state is None
+            new_state, has_code, has_comment = lex_line(rules, line[1:], new_state)
+            if has_comment:
+                comment_added += 1
+            else:
+                code_added += 1
+            if pending and starts_in_code and has_code:
+                # Declarations only count in code, not in comments or strings
+                pending = find_declarations(declarations, found, line[1:])
+        elif marker == '-':
+            if not in_hunks and line.startswith('---'):
+                continue
+            old_state, has_code, has_comment = lex_line(rules, line[1:], old_state)
+            if has_comment:
+                comment_removed += 1
+            else:
+                code_removed += 1
+        elif marker == ' ':
+            text = line[1:]
+            old_state = lex_line(rules, text, old_state)[0]
+            new_state = lex_line(rules, text, new_state)[0]
+        elif marker == '@':
+            # A hunk can start anywhere in the file; assume code
+            old_state = new_state = None
+            in_hunks = True
+
+    return {
+        'lines_added': code_added + comment_added,
+        'lines_removed': code_removed + comment_removed,
+        'code_additions': code_added,
+        'code_deletions': code_removed,
+        'comment_additions': comment_added,
+        'comment_deletions': comment_removed,
+        'imports_added': int(found[0]),
+        'functions_added': int(found[1]),
+        'classes_added': int(found[2]),
+    }
+
+
+def scan_patch(patch, language='Other'):
+    """Compute all line and declaration metrics of a patch in one pass.
+
+    Declaration metrics are 1 if the patch adds at least one import,
+    function or class in code, else 0.
+    """
+    if not patch:
+        return empty_scan()
+    return scan_lines(patch.split('\n'), language)
+
+
+def scan_file_batch(batch):
+    """Scan a batch of (patch, language) pairs; runs in worker processes"""
+    return [scan_patch(patch, language) for patch, language in batch]
@@ -5,63 +5,270 @@ Key optimizations:
 - Memory-efficient streaming
 - Parallel processing where possible
 - Reduced I/O operations
+- Column projection: only the repo name and commit hash columns are read
+  from the Parquet shards, never the file contents
+- Shard-parallel ingestion: each Parquet shard is deduped in its own worker
+  process and written as a sorted run file
+- One record per repo: the runs are merged on disk (external sort) into the
+  CSV and a compact sorted index with 20-byte SHAs (see repo_index.py)
+- Language histograms: per-repo bytes by language are summed while reading
+  the shards into starcoder_v*_languages.parquet (see language_index.py)
+- Overlap-only V2 (INGEST_V2=overlap): V2 repos are probed against the V1
+  index through a Bloom filter while streaming, and only the overlap is kept
 """
 import os
 from dotenv import load_dotenv
 from huggingface_hub import login
-from datasets import load_dataset
 import csv
 import time
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import threading
+from stack_shards import (V1_DATASET, V2_DATASET, iter_repo_rows, list_shard_infos, local_dir_for,
+                          write_shard_run, write_shard_overlap_run, filter_overlap)
+from shard_manifest import ShardManifest
+from repo_index import RepoIndex, RepoIndexWriter, merge_runs, write_run, sha_to_hex, RUN_FORMAT
+from bloom_filter import open_index_bloom
+from overlap_join import OVERLAP_PATH, write_overlap
+from language_index import languages_path_for, merge_language_files
+from instrumentation import METRICS, stage, timed
 
 load_dotenv()
 HF_TOKEN = os.getenv("HF_TOKEN")
 
-def process_dataset_streaming(dataset_name, output_file, repo_key, hash_key, dataset_version=None):
-    """Process dataset with streaming and batch writing for speed."""
-    print(f"Loading {dataset_name}...")
+# 'parquet' reads projected columns straight from the shards (from the Hub, or from the
+# local mirrors in STACK_V1_DIR / STACK_V2_DIR); 'datasets' streams with select_columns
+INGEST_MODE = os.getenv("INGEST_MODE", "parquet")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 2))  # Processes reading shards
+RUN_DIR = os.getenv("INGEST_RUN_DIR")  # Where sorted runs are spilled; defaults to the system temp dir
+# Shard manifest and per-shard runs kept between runs, so a refresh only reprocesses changed shards
+STATE_DIR = os.getenv("INGEST_STATE_DIR", "ingest_state")
+LANGUAGES_SUFFIX = '.languages.parquet'  # Per-shard language histogram next to each run
+RUN_ROWS = 5_000_000  # Rows deduped in memory per run when streaming
+# 'full' writes every V2 repo; 'overlap' probes the V1 index while streaming V2 and keeps
+# only repos that pass its Bloom filter, writing a V2 index of just those and overlapping_repos.csv
+INGEST_V2 = os.getenv("INGEST_V2", "full")
+TRACE_PATH = 'ingest_trace.json'  # Per-shard and merge stage spans (chrome://tracing / Perfetto)
+METRICS_PATH = 'ingest_metrics.prom'  # Stage totals and row counts as Prometheus text
+
+@timed('write')
+def write_outputs(run_paths, output_file, index_file):
+    """Merge sorted runs into the repo index and the CSV (if output_file is set), one row per repo.
+
+    When a repo appears with several SHAs the one from the latest run, i.e.
+    the last row in dataset order, wins.
+    """
+    with RepoIndexWriter(index_file) as index:
+        if output_file is None:
+            for name, raw_sha, stats in merge_runs(run_paths, temp_dir=RUN_DIR):
+                index.add(name, raw_sha, stats)
+            return index.count
+        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["repo_name", "commit_hash"])
+            for name, raw_sha, stats in merge_runs(run_paths, temp_dir=RUN_DIR):
+                index.add(name, raw_sha, stats)
+                writer.writerow([name.decode('utf-8'), sha_to_hex(raw_sha)])
+    return index.count
+
+def load_overlap_bloom(overlap_index):
+    """The Bloom filter of the V1 index, built and saved on first use"""
+    with RepoIndex(overlap_index) as index:
+        return open_index_bloom(index)
+
+@timed('overlap')
+def write_v2_overlap(index_file, overlap_index):
+    """Join the filtered V2 index with V1 into overlapping_repos.csv; the join is exact"""
+    with RepoIndex(overlap_index) as repo_v1, RepoIndex(index_file) as repo_v2:
+        overlapping, changed = write_overlap(repo_v1, repo_v2, OVERLAP_PATH)
+    print(f"Wrote {overlapping:,} overlapping repos to {OVERLAP_PATH} ({changed:,} with a changed SHA)")
+
+def process_dataset_streaming(dataset, output_file, index_file, local_dir=None, mode=INGEST_MODE,
+                              overlap_index=None):
+    """Process dataset with streaming, spilling deduped chunks of rows to sorted runs.
     
-    # Load dataset
-    if dataset_version:
-        dataset = load_dataset(dataset_name, dataset_version, streaming=True)
-    else:
-        dataset = load_dataset(dataset_name, streaming=True)
+    With overlap_index, only repos present in that index are kept, and the
+    overlap with it is written to overlapping_repos.csv.
+    """
+    dataset_name = dataset['name']
+    print(f"Loading {dataset_name}...")
     
-    batch_size = 1000  # Process in batches for memory efficiency
-    batch_data = []
+    bloom = load_overlap_bloom(overlap_index) if overlap_index else None
     total_processed = 0
+    next_report = 10000
+    run_dir = tempfile.mkdtemp(prefix='ingest_runs_', dir=RUN_DIR)
+    run_paths = []
+    chunk = {}
+    chunk_stats = {}  # Popularity columns (V1) for the index's stats section, as in the sharded path
+    chunk_rows = 0
+    has_stats = bool(dataset.get('stats_keys'))
     
     start_time = time.monotonic()
     
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["repo_name", "commit_hash"])
-        
-        for row in dataset['train']:
-            batch_data.append([row[repo_key], row[hash_key]])
-            total_processed += 1
+    try:
+        # Rows arrive in record batches holding only the two projected columns
+        for batch_data in iter_repo_rows(dataset, local_dir, mode, stats=has_stats):
+            if has_stats:
+                for repo_name, commit_hash, repo_stats in batch_data:
+                    chunk[repo_name] = commit_hash
+                    chunk_stats[repo_name] = repo_stats
+            else:
+                chunk.update(batch_data)
+            chunk_rows += len(batch_data)
+            total_processed += len(batch_data)
+            
+            # Memory stays bounded by the chunk size; the runs are merged on disk
+            if chunk_rows >= RUN_ROWS:
+                run_paths.append(os.path.join(run_dir, f'{len(run_paths):06d}.run'))
+                write_run(run_paths[-1], filter_overlap(chunk, bloom) if bloom else chunk, chunk_stats)
+                chunk = {}
+                chunk_stats = {}
+                chunk_rows = 0
             
-            # Write in batches for speed
-            if len(batch_data) >= batch_size:
-                writer.writerows(batch_data)
-                batch_data = []
-                
-                # Progress update
-                if total_processed % 10000 == 0:
-                    elapsed = time.monotonic() - start_time
-                    rate = total_processed / elapsed
-                    print(f"  Processed {total_processed:,} items at {rate:.0f} items/sec")
+            # Progress update
+            if total_processed >= next_report:
+                elapsed = time.monotonic() - start_time
+                rate = total_processed / elapsed
+                print(f"  Processed {total_processed:,} items at {rate:.0f} items/sec")
+                next_report = total_processed + 10000
         
-        # Write remaining data
-        if batch_data:
-            writer.writerows(batch_data)
+        if chunk:
+            run_paths.append(os.path.join(run_dir, f'{len(run_paths):06d}.run'))
+            write_run(run_paths[-1], filter_overlap(chunk, bloom) if bloom else chunk, chunk_stats)
+            chunk = {}
+            chunk_stats = {}
+        
+        METRICS.record_stage('load', time.monotonic() - start_time, dataset=dataset_name)
+        repo_count = write_outputs(run_paths, output_file, index_file)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    if overlap_index:
+        write_v2_overlap(index_file, overlap_index)
     
     elapsed = time.monotonic() - start_time
     rate = total_processed / elapsed
-    print(f"Completed {dataset_name}: {total_processed:,} items in {elapsed:.2f}s ({rate:.0f} items/sec)")
+    METRICS.count('ingest_rows', total_processed, dataset=dataset_name)
+    print(f"Completed {dataset_name}: {total_processed:,} items, {repo_count:,} repos "
+          f"in {elapsed:.2f}s ({rate:.0f} items/sec)")
+    return total_processed
+
+def process_dataset_sharded(dataset, output_file, index_file, executor, local_dir=None, overlap_index=None,
+                            manifest=None, languages_file=None):
+    """Dedupe every shard into a sorted run in the process pool, then merge the runs.
+
+    Runs are merged in shard order, so the last SHA seen for a repo wins,
+    as in dataset_loading.py. With overlap_index, workers only keep repos
+    present in that index, and the overlap is written to overlapping_repos.csv.
+    With a ShardManifest, runs are kept between invocations and only new or
+    changed shards are processed again. With languages_file, per-repo
+    language byte counts are aggregated into that Parquet sidecar.
+    """
+    dataset_name = dataset['name']
+    local_dir = local_dir or local_dir_for(dataset)
+    shards = list_shard_infos(dataset_name, local_dir)
+    print(f"Loading {dataset_name}: {len(shards)} shards...")
+    
+    if overlap_index:
+        # Workers load the saved filter, so make sure it exists before they start
+        load_overlap_bloom(overlap_index)
+        # Overlap runs depend on the V1 index they were filtered with
+        stat = os.stat(overlap_index)
+        variant = f'overlap:{RUN_FORMAT}:{stat.st_size}:{stat.st_mtime_ns}'
+    else:
+        variant = f'full:{RUN_FORMAT}'
+    
+    start_time = time.monotonic()
+    if manifest is not None:
+        run_dir = None
+        run_paths = [manifest.run_path(dataset_name, variant, shard['path']) for shard in shards]
+        pending = [index for index, shard in enumerate(shards)
+                   if not manifest.is_current(dataset_name, variant, shard)
+                   or (languages_file and not os.path.exists(run_paths[index] + LANGUAGES_SUFFIX))]
+        pruned = manifest.prune(dataset_name, variant, [shard['path'] for shard in shards])
+        print(f"  {len(shards) - len(pending)} shards unchanged, {len(pending)} to process, {pruned} removed")
+    else:
+        run_dir = tempfile.mkdtemp(prefix='ingest_runs_', dir=RUN_DIR)
+        run_paths = [os.path.join(run_dir, f'{index:06d}.run') for index in range(len(shards))]
+        pending = list(range(len(shards)))
+        pruned = 0
+    language_paths = [run_path + LANGUAGES_SUFFIX for run_path in run_paths] if languages_file else None
+    total_processed = 0
+    try:
+        if overlap_index:
+            futures = {
+                executor.submit(write_shard_overlap_run, shards[index]['path'], dataset, local_dir, run_paths[index],
+                                overlap_index, language_paths[index] if language_paths else None): index
+                for index in pending
+            }
+        else:
+            futures = {
+                executor.submit(write_shard_run, shards[index]['path'], dataset, local_dir, run_paths[index],
+                                language_paths[index] if language_paths else None): index
+                for index in pending
+            }
+        for future in as_completed(futures):
+            path, rows, repos, elapsed = future.result()
+            total_processed += rows
+            # Timed in the worker; recorded here so the parent's registry has every shard
+            METRICS.record_stage('load', elapsed, dataset=dataset_name)
+            METRICS.count('ingest_rows', rows, dataset=dataset_name)
+            rate = rows / elapsed if elapsed else 0
+            print(f"  Shard {futures[future] + 1}/{len(shards)} {os.path.basename(path)}: "
+                  f"{rows:,} rows, {repos:,} repos in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+            if manifest is not None:
+                # Recorded as each shard finishes, so an interrupted run resumes from here
+                manifest.record(dataset_name, variant, shards[futures[future]], run_paths[futures[future]],
+                                rows, repos)
+        
+        if not pending and not pruned and os.path.exists(index_file) and \
+                (output_file is None or os.path.exists(output_file)) and \
+                (languages_file is None or os.path.exists(languages_file)):
+            # Leaving the outputs untouched also keeps runs filtered against this index valid
+            print(f"  {index_file} is up to date")
+            with RepoIndex(index_file) as index:
+                repo_count = len(index)
+        else:
+            repo_count = write_outputs(run_paths, output_file, index_file)
+            if languages_file:
+                with stage('write', output='languages'):
+                    language_repos = merge_language_files(language_paths, languages_file)
+                print(f"  Wrote language histograms of {language_repos:,} repos to {languages_file}")
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
+    if overlap_index:
+        write_v2_overlap(index_file, overlap_index)
+    
+    elapsed = time.monotonic() - start_time
+    rate = total_processed / elapsed if elapsed else 0
+    print(f"Completed {dataset_name}: {total_processed:,} items, {repo_count:,} repos "
+          f"in {elapsed:.2f}s ({rate:.0f} items/sec)")
     return total_processed
 
+def ingest_v2_overlap(manifest):
+    """Ingest V1 (or refresh it from the manifest), then only the V2 repos that are also in V1."""
+    v1_count = 0
+    if INGEST_MODE == 'parquet':
+        with ProcessPoolExecutor(max_workers=INGEST_WORKERS,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            v1_count = process_dataset_sharded(V1_DATASET, 'starcoder_v1_repos.csv',
+                                               'starcoder_v1_repos.idx', executor, manifest=manifest,
+                                               languages_file=languages_path_for('starcoder_v1_repos.idx'))
+            v2_count = process_dataset_sharded(V2_DATASET, None, 'starcoder_v2_repos.idx', executor,
+                                               overlap_index='starcoder_v1_repos.idx', manifest=manifest,
+                                               languages_file=languages_path_for('starcoder_v2_repos.idx'))
+        return v1_count, v2_count
+    
+    if os.path.exists('starcoder_v1_repos.idx'):
+        print("Using existing starcoder_v1_repos.idx")
+    else:
+        v1_count = process_dataset_streaming(V1_DATASET, 'starcoder_v1_repos.csv', 'starcoder_v1_repos.idx')
+    v2_count = process_dataset_streaming(V2_DATASET, None, 'starcoder_v2_repos.idx',
+                                         overlap_index='starcoder_v1_repos.idx')
+    return v1_count, v2_count
+
 def main():
     """Optimized main function with parallel processing."""
     start_time = time.monotonic()
@@ -70,36 +277,68 @@ def main():
     
     print("Starting optimized dataset processing...")
     
+    # Only shard-based ingestion can be refreshed incrementally
+    manifest = ShardManifest(STATE_DIR) if INGEST_MODE == 'parquet' else None
+    
+    if INGEST_V2 == 'overlap':
+        # V2 depends on the V1 index here, so the two run one after the other
+        v1_count, v2_count = ingest_v2_overlap(manifest)
+        if manifest is not None:
+            manifest.close()
+        report(start_time, v1_count, v2_count)
+        return
+    
+    if INGEST_MODE == 'parquet':
+        # Shards of both datasets share one pool, so cores never idle between V1 and V2
+        with ProcessPoolExecutor(max_workers=INGEST_WORKERS,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            with ThreadPoolExecutor(max_workers=2) as drivers:
+                v1_future = drivers.submit(process_dataset_sharded, V1_DATASET, 'starcoder_v1_repos.csv',
+                                           'starcoder_v1_repos.idx', executor, manifest=manifest,
+                                           languages_file=languages_path_for('starcoder_v1_repos.idx'))
+                v2_future = drivers.submit(process_dataset_sharded, V2_DATASET, 'starcoder_v2_repos.csv',
+                                           'starcoder_v2_repos.idx', executor, manifest=manifest,
+                                           languages_file=languages_path_for('starcoder_v2_repos.idx'))
+                v1_count = v1_future.result()
+                v2_count = v2_future.result()
+        manifest.close()
+        report(start_time, v1_count, v2_count)
+        return
+    
     # Process both datasets in parallel for maximum speed
     with ThreadPoolExecutor(max_workers=2) as executor:
         # Submit both tasks
         v1_future = executor.submit(
             process_dataset_streaming,
-            "bigcode/the-stack-dedup",
+            V1_DATASET,
             'starcoder_v1_repos.csv',
-            "max_stars_repo_name",
-            "max_stars_repo_head_hexsha"
+            'starcoder_v1_repos.idx'
         )
         
         v2_future = executor.submit(
             process_dataset_streaming,
-            "bigcode/the-stack-v2-dedup",
+            V2_DATASET,
             'starcoder_v2_repos.csv',
-            "repo_name",
-            "revision_id",
-            "default"
+            'starcoder_v2_repos.idx'
         )
         
         # Wait for both to complete
         v1_count = v1_future.result()
         v2_count = v2_future.result()
     
+    report(start_time, v1_count, v2_count)
+
+def report(start_time, v1_count, v2_count):
+    """Print the combined results of both datasets."""
     total_time = time.monotonic() - start_time
     print(f"\n=== OPTIMIZATION RESULTS ===")
     print(f"V1 repos processed: {v1_count:,}")
     print(f"V2 repos processed: {v2_count:,}")
     print(f"Total time: {total_time:.2f} seconds")
     print(f"Combined processing rate: {(v1_count + v2_count) / total_time:.0f} items/sec")
+    print(METRICS.stage_report())
+    METRICS.write_trace(TRACE_PATH)
+    METRICS.write_prometheus(METRICS_PATH)
 
 if __name__ == "__main__":
     main()
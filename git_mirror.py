@@ -0,0 +1,196 @@
+"""
+Local git mirrors as an alternative source of commit dates and PR diffs.
+
+The API costs at least one request per PR for its diff. For a repo with
+thousands of PRs between V1 and V2, one clone is cheaper. GitMirror makes
+a bare clone of the repo (by default a partial, blob-less one, so blobs
+are only fetched for the commits that are diffed). It then answers the
+same questions as the API locally:
+
+- commit_dates: committer dates of the V1/V2 SHAs (git log)
+- window_commits / load_window: the commits in a merge-date window, with
+  their parents
+- pr_files: the diff a merged PR brought in, as per-file records shaped
+  like the /pulls/{n}/files API, ready for the diff scanner
+
+The API is still used to list the merged PRs, which maps each merge
+commit (merge_commit_sha) to its PR number, title and author. A PR is
+diffed as its merge commit against the merge commit's first parent. For
+merge and squash merges this is the change the PR brought to the base
+branch. For a rebase merge of several commits it only covers the last
+commit, so it can undercount.
+
+choose_backend is the cost model that picks 'api' or 'git' per repo from
+its PR count and size, comparing the wall-clock time of both.
+"""
+import io
+import os
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone
+from pr_diff import split_unified_diff
+
+MIRROR_DIR = 'git_mirrors'  # One bare clone per repo, named owner__repo.git
+GIT_URL = os.getenv('GIT_MIRROR_URL', 'https://github.com/{repo}.git')  # {repo} is owner/name
+CLONE_FILTER = 'blob:none'  # Partial clone filter; None clones every blob up front
+GIT_TIMEOUT = 1800  # Seconds before a clone or fetch is abandoned
+BRANCH_REFSPEC = '+refs/heads/*:refs/heads/*'  # Fetches keep every branch in step with the repo
+WINDOW_SLACK = timedelta(days=1)  # Merge commits may carry a committer date slightly off merged_at
+
+# Cost model: both backends are costed in wall-clock seconds to get one repo's PR diffs.
+# API_REQUESTS_PER_HOUR is GitHub's documented primary rate limit. The other defaults are
+# estimates for github.com; measure them from the workers' network with
+# benchmarks/bench_git_mirror.py. A run replaces the two latencies with its own measured
+# means once it has diffed PRs each way (see analyze_code_changes.py)
+API_REQUESTS_PER_HOUR = 5000  # Core requests per token per hour
+API_REQUEST_SECONDS = 0.5  # Latency of one PR diff request
+CLONE_BASE_SECONDS = 3  # Fixed cost of a clone: connection, ref advertisement, pack negotiation
+CLONE_KB_PER_SECOND = 5 * 1024  # Clone speed, in KB of the repo size the API reports per second
+LOCAL_DIFF_SECONDS = 0.3  # One diff in a blob-less clone, mostly fetching its blobs on demand
+DEFAULT_REPO_SIZE_KB = 50 * 1024  # Assumed size when the API did not report one
+
+LOG_FORMAT = '%H%x00%P%x00%cI'
+
+
+class GitMirrorError(Exception):
+    """A git command failed or timed out"""
+
+
+def mirror_path(repo_name, root=MIRROR_DIR):
+    return os.path.join(root, repo_name.replace('/', '__') + '.git')
+
+
+def choose_backend(pr_count, size_kb=None, token_count=1, concurrency=1,
+                   request_seconds=API_REQUEST_SECONDS, local_diff_seconds=LOCAL_DIFF_SECONDS):
+    """'git' when a clone plus local diffs is expected to finish before one API call per PR, else 'api'.
+
+    The API side runs at the lower of two rates: what the tokens' rate limit
+    allows, and concurrency requests in flight at request_seconds each. The
+    clone grows with the repo size (the API reports it in KB).
+    """
+    api_rate = min(max(token_count, 1) * API_REQUESTS_PER_HOUR / 3600, max(concurrency, 1) / request_seconds)
+    api_seconds = pr_count / api_rate
+    size_kb = size_kb if size_kb is not None else DEFAULT_REPO_SIZE_KB
+    git_seconds = CLONE_BASE_SECONDS + size_kb / CLONE_KB_PER_SECOND + pr_count * local_diff_seconds
+    return 'git' if git_seconds < api_seconds else 'api'
+
+
+def parse_git_date(date_string):
+    """git's strict ISO date in UTC, as the API reports dates"""
+    return datetime.fromisoformat(date_string).astimezone(timezone.utc)
+
+
+class GitMirror:
+    """Bare (partial) clone of one GitHub repo, queried with plain git commands"""
+
+    def __init__(self, repo_name, root=MIRROR_DIR, url=None, clone_filter=CLONE_FILTER):
+        self.repo_name = repo_name
+        self.path = mirror_path(repo_name, root)
+        self.url = url or GIT_URL.format(repo=repo_name)
+        self.clone_filter = clone_filter
+        self.parents = {}  # sha -> parent shas of the commits loaded by load_window
+
+    def git(self, *args, check=True, timeout=GIT_TIMEOUT, input=None):
+        """Run a git command in the mirror, with input (bytes) on stdin; returns stdout as bytes"""
+        try:
+            result = subprocess.run(['git', '--git-dir', self.path, *args], input=input, capture_output=True,
+                                    timeout=timeout, env=dict(os.environ, GIT_TERMINAL_PROMPT='0'))
+        except subprocess.TimeoutExpired as e:
+            raise GitMirrorError(f"git {args[0]} timed out for {self.repo_name}") from e
+        if check and result.returncode != 0:
+            raise GitMirrorError(f"git {args[0]} failed for {self.repo_name}: "
+                                 f"{result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+
+    def ensure(self):
+        """Clone the repo, or fetch new commits into an existing mirror"""
+        if os.path.isdir(self.path):
+            # The refspec is explicit so mirrors cloned without remote.origin.fetch update too
+            self.git('fetch', '--quiet', '--prune', 'origin', BRANCH_REFSPEC)
+            return self
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        command = ['git', 'clone', '--bare', '--quiet', '--no-tags']
+        if self.clone_filter:
+            command.append(f'--filter={self.clone_filter}')
+        try:
+            result = subprocess.run(command + [self.url, self.path + '.tmp'], capture_output=True,
+                                    timeout=GIT_TIMEOUT, env=dict(os.environ, GIT_TERMINAL_PROMPT='0'))
+        except subprocess.TimeoutExpired as e:
+            shutil.rmtree(self.path + '.tmp', ignore_errors=True)
+            raise GitMirrorError(f"git clone timed out for {self.repo_name}") from e
+        if result.returncode != 0:
+            shutil.rmtree(self.path + '.tmp', ignore_errors=True)
+            raise GitMirrorError(f"git clone failed for {self.repo_name}: "
+                                 f"{result.stderr.decode('utf-8', 'replace').strip()}")
+        # A half-finished clone never takes the final name
+        os.replace(self.path + '.tmp', self.path)
+        # A bare clone has no fetch refspec, so a plain fetch would not move its branches.
+        # --mirror would set one, but it also fetches GitHub's refs/pull/* of every PR ever opened
+        self.git('config', 'remote.origin.fetch', BRANCH_REFSPEC)
+        return self
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def has_commits(self, shas):
+        """The subset of shas present in the mirror, checked with one git cat-file"""
+        shas = [sha for sha in shas if sha]
+        if not shas:
+            return set()
+        output = self.git('cat-file', '--batch-check', input='\n'.join(shas).encode() + b'\n')
+        present = set()
+        for line in output.decode().splitlines():
+            parts = line.split()
+            if len(parts) >= 2 and parts[1] == 'commit':
+                present.add(parts[0])
+        return present
+
+    def fetch_commits(self, shas):
+        """Fetch commits no branch points to any more (e.g. a force-pushed V1 SHA)"""
+        present = self.has_commits(shas)
+        missing = [sha for sha in shas if sha and sha not in present]
+        if missing:
+            self.git('fetch', '--quiet', 'origin', *missing, check=False)
+
+    def commit_dates(self, shas):
+        """{sha: committer date} for the shas in the mirror; the API's commit.committer.date"""
+        self.fetch_commits(shas)
+        present = self.has_commits(shas)
+        if not present:
+            return {}
+        output = self.git('log', '--no-walk=unsorted', f'--format={LOG_FORMAT}', *present)
+        dates = {}
+        for line in output.decode().splitlines():
+            sha, _, date = line.split('\x00')
+            dates[sha] = parse_git_date(date)
+        return dates
+
+    def window_commits(self, start, end):
+        """{sha: [parent shas]} of every commit on any branch committed between start and end"""
+        output = self.git('log', '--all', f'--format={LOG_FORMAT}',
+                          f'--since={(start - WINDOW_SLACK).isoformat()}',
+                          f'--until={(end + WINDOW_SLACK).isoformat()}')
+        commits = {}
+        for line in output.decode().splitlines():
+            sha, parents, _ = line.split('\x00')
+            commits[sha] = parents.split()
+        return commits
+
+    def load_window(self, start, end):
+        """Remember the commits of a merge-date window for pr_files; returns how many there are"""
+        self.parents.update(self.window_commits(start, end))
+        return len(self.parents)
+
+    def covers(self, merge_sha):
+        return merge_sha in self.parents
+
+    def pr_files(self, merge_sha, language_of=None):
+        """Per-file records of a merge commit against its first parent, shaped like /pulls/{n}/files"""
+        parents = self.parents[merge_sha]
+        if parents:
+            args = ['diff', '--no-color', '--no-ext-diff', '-M', parents[0], merge_sha]
+        else:
+            args = ['show', '--no-color', '--no-ext-diff', '-M', '--format=', merge_sha]
+        output = self.git(*args)
+        lines = (line.rstrip(b'\n').decode('utf-8', 'replace') for line in io.BytesIO(output))
+        return list(split_unified_diff(lines, language_of))
@@ -0,0 +1,188 @@
+"""
+Shared GitHub API client for the analysis scripts.
+
+GitHubClient is a blocking client built on a pooled requests.Session.
+Every request goes through a RateLimiter that spreads calls over the
+token pool and waits on GitHub's rate-limit headers, and GET requests are
+answered or revalidated from the shared on-disk ResponseCache. Responses,
+cache results and the reported rate-limit budget are counted per endpoint
+in instrumentation.METRICS.
+
+AsyncGitHubClient runs blocking calls on a bounded thread pool so that
+asyncio code can keep many requests in flight at once.
+"""
+import os
+import re
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from rate_limiter import RateLimiter, load_tokens, request_resource
+from http_cache import cache_key, open_default_cache
+from instrumentation import METRICS
+
+DEFAULT_API_URL = 'https://api.github.com'
+DEFAULT_MAX_CONCURRENCY = 16
+REQUEST_TIMEOUT = 30  # seconds
+MAX_RETRIES = 5  # retries of requests rejected by a rate limit
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/vnd.github.v3+json',
+    'User-Agent': 'STARCODER ANALYSIS APP',
+    'X-GitHub-Api-Version': '2022-11-28',
+}
+
+
+ENDPOINT_PARTS = [
+    (re.compile(r'^/repos/[^/]+/[^/]+'), '/repos/:repo'),
+    (re.compile(r'/[0-9a-f]{40}(?=/|$)'), '/:sha'),
+    (re.compile(r'/\d+(?=/|$)'), '/:n'),
+]
+
+
+def endpoint_name(url):
+    """API path with the repo, SHAs and numbers replaced, e.g. /repos/:repo/pulls/:n/files"""
+    path = urlsplit(url).path
+    for pattern, replacement in ENDPOINT_PARTS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def record_response(endpoint, resource, response, seconds):
+    """Count a response per endpoint and track the rate-limit budget it reports"""
+    METRICS.count('github_api_requests', endpoint=endpoint, status=response.status_code)
+    METRICS.count('github_api_request_seconds', seconds, endpoint=endpoint)
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    if remaining is not None:
+        resource = response.headers.get('X-RateLimit-Resource', resource)
+        METRICS.gauge('github_rate_limit_remaining', int(remaining), resource=resource)
+        if response.status_code != 304:  # GitHub does not charge conditional hits
+            METRICS.count('github_rate_limit_consumed', resource=resource)
+
+
+def api_url():
+    """Base URL of the GitHub API (overridable with GITHUB_API_URL)"""
+    return os.getenv('GITHUB_API_URL', DEFAULT_API_URL).rstrip('/')
+
+
+class GitHubClient:
+    """Blocking GitHub REST client with connection pooling"""
+
+    def __init__(self, tokens=None, pool_size=DEFAULT_MAX_CONCURRENCY, limiter=None, cache='default'):
+        self.limiter = limiter or RateLimiter(tokens or load_tokens())
+        self.cache = open_default_cache() if cache == 'default' else cache
+        self.base_url = api_url()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(DEFAULT_HEADERS)
+
+    def url(self, path):
+        """Expand an API path such as /repos/{repo}/languages to a full URL"""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return self.base_url + path
+
+    def request(self, method, path, params=None, headers=None, json=None, stream=False):
+        """Send a request under the rate limiter, retrying rate-limited responses.
+
+        With stream=True the body is left unread for the caller to iterate
+        (and close) as it arrives.
+        """
+        resource = request_resource(path)
+        for attempt in range(MAX_RETRIES + 1):
+            token = self.limiter.acquire(resource)
+            request_headers = dict(headers or {})
+            if token:
+                request_headers['Authorization'] = 'Bearer ' + token
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url(path), params=params,
+                                                headers=request_headers, json=json,
+                                                timeout=REQUEST_TIMEOUT, stream=stream)
+            except requests.exceptions.RequestException:
+                self.limiter.release(token, resource)
+                METRICS.count('github_api_errors', endpoint=endpoint_name(path))
+                raise
+            record_response(endpoint_name(path), resource, response, time.perf_counter() - start)
+            if self.limiter.update(token, resource, response) is None:
+                break
+            response.close()
+        return response
+
+    def get(self, path, params=None, headers=None, stream=False):
+        """Issue a GET request, answering it from the cache when possible.
+
+        Streamed responses bypass the cache: their body may be too large to
+        hold in memory or to store.
+        """
+        if self.cache is None or stream:
+            return self.request('GET', path, params=params, headers=headers, stream=stream)
+
+        url = self.url(path)
+        accept = (headers or {}).get('Accept', DEFAULT_HEADERS['Accept'])
+        key = cache_key('GET', url, params, accept)
+        entry = self.cache.lookup(key)
+        if entry is not None and entry.is_fresh(self.cache.max_age):
+            self.cache.hits += 1
+            METRICS.count('github_cache_requests', result='hit')
+            return entry.to_response()
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            request_headers.update(entry.validators())
+        response = self.request('GET', url, params=params, headers=request_headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated += 1
+            METRICS.count('github_cache_requests', result='revalidated')
+            self.cache.refresh(entry)
+            return entry.to_response()
+        self.cache.misses += 1
+        METRICS.count('github_cache_requests', result='miss')
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def graphql(self, query, variables=None):
+        """Run a GraphQL query and return the decoded payload (data and errors)"""
+        response = self.request('POST', '/graphql', json={'query': query, 'variables': variables or {}})
+        response.raise_for_status()
+        return response.json()
+
+    def cache_report(self):
+        return self.cache.report() if self.cache is not None else "HTTP cache: disabled"
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class AsyncGitHubClient:
+    """Runs blocking GitHub calls on a bounded thread pool for asyncio callers"""
+
+    def __init__(self, client=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.client = client or GitHubClient(pool_size=max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='github')
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking call in the pool; at most max_concurrency run at once"""
+        loop = asyncio.get_running_loop()
+        # Submitted but unfinished calls: running ones plus those waiting for a thread
+        METRICS.add_gauge('pipeline_queue_depth', 1, queue='api_pool')
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            METRICS.add_gauge('pipeline_queue_depth', -1, queue='api_pool')
+
+    async def get(self, path, params=None, headers=None, stream=False):
+        return await self.run(self.client.get, path, params=params, headers=headers, stream=stream)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,187 @@
+"""
+Batched GitHub GraphQL lookups.
+
+Each query packs many repositories under aliases (r0, r1, ...) so that one
+request replaces dozens of REST calls. Failures are reported per alias: a
+missing repository or commit only affects its own entries, never the rest
+of the batch.
+"""
+import json
+from datetime import datetime
+import requests
+
+GRAPHQL_BATCH_SIZE = 50  # objects resolved per query
+
+
+def parse_github_date(date_string):
+    return datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+
+
+def repository_field(alias, repo_name, selection):
+    owner, _, name = repo_name.partition('/')
+    return f'{alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {selection} }}'
+
+
+def alias_errors(payload):
+    """Map top-level aliases to the first error message reported under them"""
+    errors = {}
+    for error in payload.get('errors') or []:
+        path = error.get('path') or []
+        if path and path[0] not in errors:
+            errors[path[0]] = error.get('message', 'unknown error')
+    return errors
+
+
+def run_batched(client, query, label):
+    """Run one aliased query; returns (data, alias errors, request error)"""
+    try:
+        payload = client.graphql(query)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {}, {}, f"{label} query failed: {e}"
+    if payload.get('data') is None:
+        message = '; '.join(e.get('message', '') for e in payload.get('errors') or [])
+        return {}, {}, f"{label} query failed: {message or 'no data returned'}"
+    return payload['data'], alias_errors(payload), None
+
+
+def group_by_repo(pairs):
+    """Group (repo_name, sha) pairs by repo, keeping first-seen order"""
+    grouped = {}
+    for repo_name, sha in pairs:
+        shas = grouped.setdefault(repo_name, [])
+        if sha not in shas:
+            shas.append(sha)
+    return list(grouped.items())
+
+
+def commit_date_batches(pairs, batch_size=GRAPHQL_BATCH_SIZE):
+    """Split grouped pairs into batches of at most batch_size commits"""
+    batch, size = [], 0
+    for repo_name, shas in group_by_repo(pairs):
+        if batch and size + len(shas) > batch_size:
+            yield batch
+            batch, size = [], 0
+        batch.append((repo_name, shas))
+        size += len(shas)
+    if batch:
+        yield batch
+
+
+def build_commit_dates_query(batch):
+    fields = []
+    for i, (repo_name, shas) in enumerate(batch):
+        objects = ' '.join(
+            f'c{j}: object(expression: {json.dumps(sha)}) {{ ... on Commit {{ committedDate }} }}'
+            for j, sha in enumerate(shas)
+        )
+        fields.append(repository_field(f'r{i}', repo_name, objects))
+    return 'query { ' + ' '.join(fields) + ' }'
+
+
+def resolve_commit_date_batch(client, batch):
+    """Resolve one batch; returns (dates, errors) keyed by (repo_name, sha)"""
+    dates, errors = {}, {}
+    data, repo_errors, failure = run_batched(client, build_commit_dates_query(batch), 'commit date')
+    if failure and len(batch) > 1:
+        # A malformed name can sink the whole query; retry the halves separately
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            half_dates, half_errors = resolve_commit_date_batch(client, half)
+            dates.update(half_dates)
+            errors.update(half_errors)
+        return dates, errors
+
+    for i, (repo_name, shas) in enumerate(batch):
+        alias = f'r{i}'
+        repository = data.get(alias)
+        for j, sha in enumerate(shas):
+            if failure:
+                errors[(repo_name, sha)] = failure
+            elif repository is None:
+                errors[(repo_name, sha)] = repo_errors.get(alias, 'repository not found')
+            elif not repository.get(f'c{j}'):
+                errors[(repo_name, sha)] = 'commit not found'
+            else:
+                dates[(repo_name, sha)] = parse_github_date(repository[f'c{j}']['committedDate'])
+    return dates, errors
+
+
+def resolve_commit_dates(client, pairs, batch_size=GRAPHQL_BATCH_SIZE):
+    """Resolve committer dates of (repo_name, sha) pairs with aliased GraphQL queries.
+
+    Returns (dates, errors): dates maps each resolved pair to its committer
+    datetime, errors maps each unresolved pair to the reason.
+    """
+    dates, errors = {}, {}
+    for batch in commit_date_batches(pairs, batch_size):
+        batch_dates, batch_errors = resolve_commit_date_batch(client, batch)
+        dates.update(batch_dates)
+        errors.update(batch_errors)
+    return dates, errors
+
+
+REPO_METADATA_FIELDS = (
+    'stargazerCount isArchived isFork '
+    'defaultBranchRef { name } '
+    'mentionableUsers { totalCount } '
+    'languages(first: 25, orderBy: {field: SIZE, direction: DESC}) '
+    '{ totalSize edges { size node { name } } }'
+)
+
+
+def parse_repo_metadata(repo_name, repository):
+    languages = repository.get('languages') or {}
+    return {
+        'repo_name': repo_name,
+        'stars': repository['stargazerCount'],
+        'archived': repository['isArchived'],
+        'fork': repository['isFork'],
+        'default_branch': (repository.get('defaultBranchRef') or {}).get('name'),
+        # Listing collaborators needs push access; mentionable users (collaborators
+        # plus anyone who took part in issues or PRs) is only a proxy for them
+        'mentionable_users': (repository.get('mentionableUsers') or {}).get('totalCount', 0),
+        'languages_total': languages.get('totalSize', 0),
+        'languages': {edge['node']['name']: edge['size'] for edge in languages.get('edges') or []},
+    }
+
+
+def fetch_repo_metadata_batch(client, repo_names):
+    """Fetch metadata for one batch; returns (metadata, errors) keyed by repo name"""
+    metadata, errors = {}, {}
+    query = 'query { ' + ' '.join(
+        repository_field(f'r{i}', repo_name, REPO_METADATA_FIELDS)
+        for i, repo_name in enumerate(repo_names)
+    ) + ' }'
+    data, repo_errors, failure = run_batched(client, query, 'repository metadata')
+    if failure and len(repo_names) > 1:
+        middle = len(repo_names) // 2
+        for half in (repo_names[:middle], repo_names[middle:]):
+            half_metadata, half_errors = fetch_repo_metadata_batch(client, half)
+            metadata.update(half_metadata)
+            errors.update(half_errors)
+        return metadata, errors
+
+    for i, repo_name in enumerate(repo_names):
+        alias = f'r{i}'
+        if failure:
+            errors[repo_name] = failure
+        elif data.get(alias) is None:
+            errors[repo_name] = repo_errors.get(alias, 'repository not found')
+        else:
+            metadata[repo_name] = parse_repo_metadata(repo_name, data[alias])
+    return metadata, errors
+
+
+def fetch_repo_metadata(client, repo_names, batch_size=GRAPHQL_BATCH_SIZE):
+    """Fetch stars, archived/fork status, default branch, mentionable user count
+    and language breakdown for many repos, batch_size repos per GraphQL query.
+
+    Returns (metadata, errors) keyed by repo name.
+    """
+    metadata, errors = {}, {}
+    repo_names = list(dict.fromkeys(repo_names))
+    for start in range(0, len(repo_names), batch_size):
+        batch_metadata, batch_errors = fetch_repo_metadata_batch(client, repo_names[start:start + batch_size])
+        metadata.update(batch_metadata)
+        errors.update(batch_errors)
+    return metadata, errors
@@ -3,7 +3,14 @@ import csv
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-import time
+from github_client import GitHubClient
+from github_graphql import fetch_repo_metadata, resolve_commit_dates
+from pr_enumeration import iter_merged_prs
+from checkpoint import Checkpoint
+from repo_index import open_repo_index
+from overlap_join import count_overlap, overlapping_repos, read_overlap
+from language_index import target_language_repos
+from instrumentation import METRICS, ProgressReporter, timed
 
 load_dotenv()
 
@@ -13,50 +20,80 @@ TITLE_KEYWORDS = ["fix", "bug", "feature", "update", "refactor"]  # Only PRs wit
 BODY_KEYWORDS = ["performance", "optimization", "security", "test"]  # Only PRs with these words in body
 LANGUAGE_THRESHOLD = 10  # Minimum percentage of code in target language (10%)
 STARS_THRESHOLD = 25  # Minimum stars a repo must have
-COLLABORATOR_THRESHOLD = 5  # Minimum collaborators a repo must have
-
-def get_repo_languages(repo_name):
-    headers = {
-        'Accept': 'application/vnd.github.v3+json',
-        'Authorization': 'Bearer ' + os.getenv('GITHUB_TOKEN'),
-        'User-Agent': 'STARCODER ANALYSIS APP',
-        'X-GitHub-Api-Version': '2022-11-28',
-    }
-    
-    url = f"https://api.github.com/repos/{repo_name}/languages"
-    response = requests.get(url, headers=headers)
-    time.sleep(1)  # Rate limiting
-    
-    if response.status_code == 200:
-        return response.json()
-    return {}
-
-def get_repo_stars(repo_name):
-    headers = {
-        'Accept': 'application/vnd.github.v3+json',
-        'Authorization': 'Bearer ' + os.getenv('GITHUB_TOKEN'),
-        'User-Agent': 'STARCODER ANALYSIS APP',
-        'X-GitHub-Api-Version': '2022-11-28',
-    }
-    
-    url = f"https://api.github.com/repos/{repo_name}/stargazers"
-    response = requests.get(url, headers=headers)
-    time.sleep(1)  # Rate limiting
-    
-    if response.status_code == 200:
-        return response.json()
-    return {}
-
-def has_target_language(repo_name):
+STARS_PRESCREEN_RATIO = 0.2  # V1 stars below STARS_THRESHOLD * this drop a repo before any API call
+COLLABORATOR_THRESHOLD = None  # Minimum mentionable users (a proxy for collaborators), None = no filter
+EXCLUDE_ARCHIVED = False  # Skip archived repos
+EXCLUDE_FORKS = False  # Skip forks
+DATE_BATCH_SIZE = 50  # Commits resolved per GraphQL query
+METADATA_BATCH_SIZE = 50  # Repos whose metadata is fetched per GraphQL query
+PR_ENUMERATION_MODE = 'list'  # 'list' (/pulls with early cutoff) or 'search' (merged:v1..v2 queries)
+LANGUAGE_INDEX_PATH = 'starcoder_v2_languages.parquet'  # Per-repo language bytes from ingest; others use the API
+TRACE_PATH = 'repo_analysis_trace.json'  # Stage spans and all metrics (chrome://tracing / Perfetto)
+METRICS_PATH = 'repo_analysis_metrics.prom'  # Prometheus text, rewritten with every progress line
+PROGRESS_INTERVAL = 60  # Seconds between progress lines (0 = none)
+
+# Shared client: paces requests from GitHub's rate-limit headers, spreads
+# them over the tokens in GITHUB_TOKENS (or GITHUB_TOKEN) and revalidates
+# responses from the on-disk cache shared with analyze_code_changes.py
+client = GitHubClient()
+
+# Per-repo progress (dates, finished PR lists) so an interrupted run can resume.
+# Delete the file to start over, e.g. after changing the filters above.
+CHECKPOINT_PATH = 'repo_analysis_checkpoint.sqlite'
+checkpoint = Checkpoint(CHECKPOINT_PATH)
+
+# Repo metadata (stars, archived/fork, default branch, mentionable users, languages)
+# fetched in GraphQL batches; all repo filters are evaluated against these records
+REPO_METADATA = {}
+
+@timed('filter')
+def load_repo_metadata(repo_names):
+    missing = [name for name in repo_names if name not in REPO_METADATA]
+    metadata, errors = fetch_repo_metadata(client, missing, METADATA_BATCH_SIZE)
+    REPO_METADATA.update(metadata)
+    for repo_name, error in errors.items():
+        print(f"Could not get metadata for {repo_name}: {error}")
+
+# Star pre-screen from the popularity columns kept in the V1 index (max_stars_count):
+# clearly small repos are dropped before their metadata is fetched. Clearly popular
+# ones pass the star filter, but their metadata is still fetched for the other filters
+STARS_DROPPED = set()
+STARS_PASSED = set()
+
+@timed('filter')
+def prescreen_stars(repo_names):
+    for repo_name in repo_names:
+        stats = repo_v1.get_stats(repo_name)
+        stars = stats[0] if stats else None
+        if stars is None:
+            continue  # Not in the index, or no V1 star count = live check
+        if stars < STARS_THRESHOLD * STARS_PRESCREEN_RATIO:
+            STARS_DROPPED.add(repo_name)
+        elif stars >= STARS_THRESHOLD:
+            STARS_PASSED.add(repo_name)
+    print(f"Star pre-screen: {len(STARS_DROPPED)} dropped, {len(STARS_PASSED)} passed, "
+          f"{len(repo_names) - len(STARS_DROPPED) - len(STARS_PASSED)} checked against current stars")
+
+# Language filter results computed locally from the ingest histograms, for all repos at once
+LANGUAGE_KNOWN = set()
+LANGUAGE_PASS = set()
+
+@timed('filter')
+def load_local_languages(repo_names):
+    passing, known = target_language_repos(LANGUAGE_INDEX_PATH, repo_names, TARGET_LANGUAGES, LANGUAGE_THRESHOLD)
+    LANGUAGE_PASS.update(passing)
+    LANGUAGE_KNOWN.update(known)
+    print(f"Language filter answered locally for {len(known)} of {len(repo_names)} repos")
+
+def has_target_language(metadata):
     if not TARGET_LANGUAGES:
         return True  # No filter = include all repos
     
-    languages = get_repo_languages(repo_name)
-    if not languages:
+    languages = metadata['languages']
+    total_bytes = metadata['languages_total']
+    if not languages or not total_bytes:
         return False  # Can't get language info = skip
     
-    total_bytes = sum(languages.values())
-    
     # Check each target language
     for target_lang in TARGET_LANGUAGES:
         lang_bytes = languages.get(target_lang, 0)
@@ -67,17 +104,30 @@ def has_target_language(repo_name):
     
     return False  # Not enough of any target language  
 
-def has_target_stars(repo_name):
-    stars = get_repo_stars(repo_name)
-    if not stars:
-        return False  # Can't get star info = skip
-    
-    star_count = len(stars)
-    
-    return star_count >= STARS_THRESHOLD
+def has_target_stars(metadata):
+    return metadata['stars'] >= STARS_THRESHOLD
+
+def has_target_collaborators(metadata):
+    if COLLABORATOR_THRESHOLD is None:
+        return True
+    return metadata['mentionable_users'] >= COLLABORATOR_THRESHOLD
 
 def has_targets(repo_name):
-    return has_target_language(repo_name) and has_target_stars(repo_name) 
+    if repo_name in STARS_DROPPED:
+        return False  # Far below the star threshold in V1; no metadata was fetched
+    if TARGET_LANGUAGES and repo_name in LANGUAGE_KNOWN and repo_name not in LANGUAGE_PASS:
+        return False  # Fails the local language check; no metadata was fetched
+    metadata = REPO_METADATA.get(repo_name)
+    if metadata is None:
+        return False  # Can't get repo info = skip
+    if EXCLUDE_ARCHIVED and metadata['archived']:
+        return False
+    if EXCLUDE_FORKS and metadata['fork']:
+        return False
+    # The API language split is only needed for repos the histograms don't cover
+    language_ok = not TARGET_LANGUAGES or repo_name in LANGUAGE_PASS or has_target_language(metadata)
+    stars_ok = repo_name in STARS_PASSED or has_target_stars(metadata)
+    return language_ok and stars_ok and has_target_collaborators(metadata)
 
 def has_keywords(text, keywords):
     if not keywords:
@@ -89,165 +139,165 @@ def has_keywords(text, keywords):
             return True
     return False
 
-repo_v1 = {}
-repo_v2 = {}
-
-with open('test_v1_repos.csv', newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        print("row1:", row)
-        repo_v1[row['repo_name'].strip()] = row['commit_hash'].strip()
+# Memory-mapped repo -> sha indexes (see repo_index.py); each CSV is converted once
+with METRICS.stage('load'):
+    repo_v1 = open_repo_index('test_v1_repos.csv')
+    print(f"Loaded {len(repo_v1)} repos from v1 dataset.")
 
-print(f"Loaded {len(repo_v1)} repos from v1 dataset.")
-print(repo_v1)
+    repo_v2 = open_repo_index('test_v2_repos.csv')
+    print(f"Loaded {len(repo_v2)} repos from v2 dataset.")
 
-with open('test_v2_repos.csv', newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        print("row2:", row)
-        repo_v2[row['repo_name'].strip()] = row['commit_hash'].strip()
-
-print(f"Loaded {len(repo_v2)} repos from v2 dataset.")
-print(repo_v2)
-
-overlapped_repos = []
 print("Finding overlapped repos...")
-for repo_name, v1_hash in repo_v1.items():
-    print(f"Checking repo: {repo_name}", repo_name in repo_v2)
-    if repo_name in repo_v2:
-        v2_hash = repo_v2[repo_name]
-
-        repo_data = {
-            'repo_name': repo_name,
-            'v1_hash': v1_hash,
-            'v2_hash': v2_hash
-        }
-        overlapped_repos.append(repo_data)
-        print(f"Found overlapped repo: {repo_name}")
+# Sort-merge join of the two indexes, written to test_overlapping_repos.csv; repos with
+# the same SHA in both versions cannot have PRs merged in between and are left out.
+# The passes below stream the CSV again instead of keeping its rows as dicts.
+OVERLAP_CSV = 'test_overlapping_repos.csv'
+with METRICS.stage('overlap'):
+    overlapped_repos = overlapping_repos(repo_v1, repo_v2, OVERLAP_CSV)
+    overlap_count = count_overlap(OVERLAP_CSV)
+print(f"Found {overlap_count} overlapped repos with a changed commit.")
 
 repo_dates = []
 
-headers = {
-    'Accept': 'application/vnd.github.v3+json',
-    'Authorization': 'Bearer ' + os.getenv('GITHUB_TOKEN'),
-    'User-Agent': 'STARCODER ANALYSIS APP',
-    'X-GitHub-Api-Version': '2022-11-28',
-}
-print(f"Processing {len(overlapped_repos)} overlapped repos for commit dates...", overlapped_repos)
-for repo_data in overlapped_repos:
+print(f"Processing {overlap_count} overlapped repos for commit dates...")
+# Repos finished by an earlier run are not fetched again; their PRs come from the checkpoint
+checkpoint_stages = checkpoint.stages()
+pending_repos = [repo_data['repo_name'] for repo_data in overlapped_repos
+                 if checkpoint_stages.get(repo_data['repo_name']) != 'done']
+if repo_v1.has_stats:
+    prescreen_stars(pending_repos)
+    pending_repos = [repo_name for repo_name in pending_repos if repo_name not in STARS_DROPPED]
+else:
+    print("Star pre-screen skipped: the V1 index has no popularity stats; "
+          "re-run fast_dataset_loading.py to rebuild it with them")
+if TARGET_LANGUAGES:
+    load_local_languages(pending_repos)
+# Repos already ruled out by their language histogram need no metadata
+load_repo_metadata([repo_name for repo_name in pending_repos
+                    if repo_name not in LANGUAGE_KNOWN or repo_name in LANGUAGE_PASS])
+filtered_repos = []
+for repo_data in read_overlap(OVERLAP_CSV):
     repo_name = repo_data['repo_name']
-    v1_hash = repo_data['v1_hash']
-    v2_hash = repo_data['v2_hash']
     # print(repo_data)
+    if checkpoint_stages.get(repo_name) == 'done':
+        filtered_repos.append(repo_data)
+        continue
     # Check repo filters first
     if not has_targets(repo_name):
         print(f"Skipping {repo_name} - doesn't meet filters")
         continue
+    filtered_repos.append(repo_data)
+
+# Resolve V1 and V2 commit dates for many repos per GraphQL query
+commit_pairs = []
+for repo_data in filtered_repos:
+    if repo_data['repo_name'] in checkpoint_stages:
+        continue  # Dates already saved by an earlier run
+    commit_pairs.append((repo_data['repo_name'], repo_data['v1_hash']))
+    commit_pairs.append((repo_data['repo_name'], repo_data['v2_hash']))
+with METRICS.stage('dates'):
+    commit_dates, commit_errors = resolve_commit_dates(client, commit_pairs, DATE_BATCH_SIZE)
+
+for repo_data in filtered_repos:
+    repo_name = repo_data['repo_name']
+    v1_hash = repo_data['v1_hash']
+    v2_hash = repo_data['v2_hash']
 
     repo_meta_data = {"repo_name": repo_name,
                       "v1_hash": v1_hash,
                       "v2_hash": v2_hash
                       }
 
-    try:
-        v1_repo_url = f"https://api.github.com/repos/{repo_name}/commits/{v1_hash}"
-        response_v1 = requests.get(v1_repo_url, headers=headers)
-        time.sleep(1)  # Rate limiting for GitHub API
-
-        response_v1.raise_for_status()
-
-        commit_data_v1 = response_v1.json()
-        date_string_v1 = commit_data_v1['commit']['committer']['date']
-        # Format date for better usage
-        v1_date = datetime.fromisoformat(date_string_v1.replace('Z', '+00:00'))
-
-        repo_meta_data["v1_date"] = v1_date
-
-    #v2 data
-        v2_repo_url = f"https://api.github.com/repos/{repo_name}/commits/{v2_hash}"
-        response_v2 = requests.get(v2_repo_url, headers=headers)
-        time.sleep(1)  # pausing to avoid hitting rate limits from GitHub REST API
-
-        response_v2.raise_for_status()
-
-        commit_data_v2 = response_v2.json()
-        date_string_v2 = commit_data_v2['commit']['committer']['date']
-        # Format date for better usage
-        v2_date = datetime.fromisoformat(date_string_v2.replace('Z', '+00:00'))
+    stage, saved = checkpoint.get(repo_name)
+    if stage == 'done':
+        repo_dates.append(repo_meta_data)
+        continue
+    if stage == 'dates':
+        repo_meta_data["v1_date"] = datetime.fromisoformat(saved['v1_date'])
+        repo_meta_data["v2_date"] = datetime.fromisoformat(saved['v2_date'])
+        repo_dates.append(repo_meta_data)
+        continue
 
-        repo_meta_data["v2_date"] = v2_date
+    missing = [(repo_name, sha) for sha in (v1_hash, v2_hash) if (repo_name, sha) not in commit_dates]
+    if missing:
+        for pair in missing:
+            print(f"{repo_name} commit {pair[1]} could not be resolved... Skipping due to error: {commit_errors[pair]}")
+        continue
 
-        repo_dates.append(repo_meta_data)
-        print(f"Processed dates for {repo_name}.")
-    except requests.exceptions.HTTPError as err:
-        print(f"{repo_name} did not respond successfully... Skipping due to error: {err}")
-    except KeyError as err:
-        print(f"Skipping due to missing key: {err}")
+    repo_meta_data["v1_date"] = commit_dates[(repo_name, v1_hash)]
+    repo_meta_data["v2_date"] = commit_dates[(repo_name, v2_hash)]
+    checkpoint.set_stage(repo_name, 'dates', {'v1_date': repo_meta_data["v1_date"].isoformat(),
+                                              'v2_date': repo_meta_data["v2_date"].isoformat()})
+    repo_dates.append(repo_meta_data)
+    print(f"Processed dates for {repo_name}.")
 
 
 all_merged_prs = []
+failed_repos = []
+progress = ProgressReporter(len(repo_dates), PROGRESS_INTERVAL, METRICS_PATH).start()
 
 for repo_meta_data in repo_dates:
     repo_name = repo_meta_data['repo_name']
+
+    if checkpoint_stages.get(repo_name) == 'done':
+        for pr in checkpoint.records(repo_name):
+            pr['merge_date'] = datetime.fromisoformat(pr['merge_date'])
+            all_merged_prs.append(pr)
+        METRICS.count('pipeline_repos')
+        print(f"Loaded PRs for {repo_name} from checkpoint.")
+        continue
+
     v1_date = repo_meta_data['v1_date']
     v2_date = repo_meta_data['v2_date']
+    repo_prs = []
+
+    # Only PRs merged inside the window are fetched (see pr_enumeration.py)
+    try:
+        with METRICS.stage('pr_list'):
+            for pull_request in iter_merged_prs(client, repo_name, v1_date, v2_date, PR_ENUMERATION_MODE):
+                merge_date = datetime.fromisoformat(pull_request['merged_at'].replace('Z', '+00:00'))
+                print(pull_request)
+                if "bot" in pull_request['user']['login'].lower() or pull_request['user']['type'].lower() == "bot":
+                    print(f"Skipping bots: {pull_request['user']['login']}; {pull_request['html_url']}")
+                    continue 
+                # Check keyword filters
+                title_ok = True # has_keywords(pull_request['title'], TITLE_KEYWORDS)
+                body_ok = True # has_keywords(pull_request.get('body', ''), BODY_KEYWORDS)
+            
+                if title_ok or body_ok:  # Include if matches title or body keywords
+                    repo_prs.append({
+                        'repo_name': repo_name,
+                        'pr_number': pull_request['number'],
+                        'pr_title': pull_request['title'],
+                        'pr_url': pull_request['html_url'],
+                        'merge_date': merge_date
+                    })
+        checkpoint.finish_repo(repo_name, [dict(pr, merge_date=pr['merge_date'].isoformat()) for pr in repo_prs])
+    except requests.exceptions.HTTPError as err:
+        # The partial list is dropped and the repo is not checkpointed, so a re-run retries it
+        print(f"{repo_name} did not respond successfully... Skipping due to error: {err}")
+        failed_repos.append(repo_name)
+        METRICS.count('pipeline_failed_repos')
+    else:
+        all_merged_prs.extend(repo_prs)
+        METRICS.count('pipeline_prs', len(repo_prs))
+    METRICS.count('pipeline_repos')
 
-    url = f"https://api.github.com/repos/{repo_name}/pulls"
-
-    params = {
-        'state': 'closed',
-        'sort': 'updated',
-        'direction': 'desc',
-        'per_page': 100
-    }
-    next_page_available = True
-    while next_page_available:
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            time.sleep(1)  # Rate limiting
-
-            response.raise_for_status()
-
-            pull_requests = response.json()
-
-            for pull_request in pull_requests:
-                if pull_request['merged_at']:  # Only include merged pull requests
-                    merge_date = datetime.fromisoformat(pull_request['merged_at'].replace('Z', '+00:00'))
-                    print(pull_request)
-                    if "bot" in pull_request['user']['login'].lower() or pull_request['user']['type'].lower() == "bot":
-                        print(f"Skipping bots: {pull_request['user']['login']}; {pull_request['html_url']}")
-                        continue 
-                    if v1_date < merge_date < v2_date:  # Check if PR is within date range
-                        # Check keyword filters
-                        title_ok = True # has_keywords(pull_request['title'], TITLE_KEYWORDS)
-                        body_ok = True # has_keywords(pull_request.get('body', ''), BODY_KEYWORDS)
-                        
-                        if title_ok or body_ok:  # Include if matches title or body keywords
-                            all_merged_prs.append({
-                                'repo_name': repo_name,
-                                'pr_number': pull_request['number'],
-                                'pr_title': pull_request['title'],
-                                'pr_url': pull_request['html_url'],
-                                'merge_date': merge_date
-                            })
-            if 'next' in response.links:
-                url = response.links['next']['url']
-                params = {}  # Reset params to avoid errors
-            else:
-                next_page_available = False
-        except requests.exceptions.HTTPError as err:
-            print(f"{repo_name} did not respond successfully... Skipping due to error: {err}")
-            next_page_available = False
+progress.stop()
 
 print(f"Found {len(all_merged_prs)} filtered merged PRs.")
+if failed_repos:
+    print(f"{len(failed_repos)} repos failed and are missing from the results (re-run to retry): {failed_repos}")
 print(f"Filters applied:")
 print(f"  Languages: {TARGET_LANGUAGES}")
 print(f"  Language threshold: {LANGUAGE_THRESHOLD}%")
+print(f"  Stars threshold: {STARS_THRESHOLD}")
+print(f"  Collaborator threshold (mentionable users): {COLLABORATOR_THRESHOLD}")
 print(f"  Title keywords: {TITLE_KEYWORDS}")
 print(f"  Body keywords: {BODY_KEYWORDS}")
 print(f"Saving results to filtered_merged_prs2.csv")
 
-with open('filtered_merged_prs2.csv', 'w', newline='') as csvfile:
+with METRICS.stage('write'), open('filtered_merged_prs2.csv', 'w', newline='') as csvfile:
     writer = csv.writer(csvfile)
     writer.writerow(['repo_name', 'pr_number', 'pr_title', 'pr_url', 'merge_date'])
     for pr in all_merged_prs:
@@ -255,3 +305,8 @@ with open('filtered_merged_prs2.csv', 'w', newline='') as csvfile:
 
 
 print(f"Finished saving results to filtered_merged_prs2.csv")
+print(client.cache_report())
+print(METRICS.stage_report())
+METRICS.write_trace(TRACE_PATH)
+METRICS.write_prometheus(METRICS_PATH)
+print(f"Wrote the stage trace to {TRACE_PATH} and metrics to {METRICS_PATH}")
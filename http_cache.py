@@ -0,0 +1,184 @@
+"""
+Persistent conditional-request cache for GitHub API responses.
+
+Response bodies are stored in SQLite together with their ETag and
+Last-Modified validators. Stale entries are revalidated with
+If-None-Match / If-Modified-Since; GitHub does not charge a 304 against
+the rate limit. Responses for immutable resources (commits addressed by a
+full SHA) never expire. The cache is shared by every process that points
+at the same file and is trimmed least-recently-used first once it grows
+past max_bytes.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_PATH = 'github_cache.sqlite'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+DEFAULT_MAX_AGE = 0  # seconds a mutable entry is served without revalidation
+EVICT_TARGET = 0.9  # evict down to this fraction of max_bytes
+
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Link']
+IMMUTABLE_PATTERNS = [
+    re.compile(r'/repos/[^/]+/[^/]+/commits/[0-9a-fA-F]{40}$'),
+]
+
+
+def cache_key(method, url, params=None, accept=None):
+    """Key a request by method, URL, sorted query parameters and media type"""
+    if params:
+        url = url + ('&' if '?' in url else '?') + urlencode(sorted(params.items()))
+    return f"{method} {url} {accept or ''}"
+
+
+def is_immutable(url):
+    path = url.split('?', 1)[0]
+    return any(pattern.search(path) for pattern in IMMUTABLE_PATTERNS)
+
+
+class CacheEntry:
+    def __init__(self, key, url, headers, body, etag, last_modified, immutable, stored_at):
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.immutable = immutable
+        self.stored_at = stored_at
+
+    def is_fresh(self, max_age):
+        return self.immutable or time.time() - self.stored_at < max_age
+
+    def validators(self):
+        """Conditional request headers for revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_response(self):
+        """Rebuild a requests.Response from the stored body"""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = 'utf-8'
+        response._content = self.body
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    """SQLite-backed HTTP response cache with LRU size-based eviction"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0  # served from cache without a request
+        self.revalidated = 0  # served from cache after a 304
+        self.misses = 0  # fetched in full
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                immutable INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT url, headers, body, etag, last_modified, immutable, stored_at '
+                'FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        url, headers, body, etag, last_modified, immutable, stored_at = row
+        return CacheEntry(key, url, json.loads(headers), body, etag, last_modified,
+                          bool(immutable), stored_at)
+
+    def store(self, key, response):
+        """Store a 200 response that carries a validator or is immutable"""
+        immutable = is_immutable(response.url)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (immutable or etag or last_modified):
+            return
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        body = response.content
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.url, json.dumps(headers), body, etag, last_modified,
+                 int(immutable), now, now, len(body)))
+            self._size += len(body) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def refresh(self, entry):
+        """Mark an entry as just revalidated"""
+        with self._lock:
+            self._conn.execute('UPDATE responses SET stored_at = ? WHERE key = ?', (time.time(), entry.key))
+            self._conn.commit()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TARGET
+        rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        doomed = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            doomed.append((key,))
+            self._size -= size
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+
+    def report(self):
+        total = self.hits + self.revalidated + self.misses
+        rate = (self.hits + self.revalidated) / total * 100 if total else 0.0
+        return (f"HTTP cache: {self.hits} hits, {self.revalidated} revalidated (304), "
+                f"{self.misses} misses ({rate:.1f}% served from cache)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_default_cache(default_path=DEFAULT_CACHE_PATH):
+    """Open the cache configured by GITHUB_CACHE_PATH (else default_path), or None if GITHUB_CACHE=0"""
+    if os.getenv('GITHUB_CACHE', '1') == '0':
+        return None
+    max_mb = os.getenv('GITHUB_CACHE_MAX_MB')
+    max_age = os.getenv('GITHUB_CACHE_MAX_AGE')
+    return ResponseCache(
+        path=os.getenv('GITHUB_CACHE_PATH', default_path),
+        max_bytes=int(max_mb) * 1024 ** 2 if max_mb else DEFAULT_MAX_BYTES,
+        max_age=float(max_age) if max_age else DEFAULT_MAX_AGE,
+    )
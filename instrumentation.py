@@ -0,0 +1,291 @@
+"""
+Stage timers, counters and gauges for the pipelines.
+
+Code records into the process-wide METRICS registry:
+
+    with stage('dates'):
+        ...
+
+    @timed('file_fetch')
+    def get_pr_files(...):
+    METRICS.count('github_api_requests', endpoint='/repos/:repo/pulls', status=200)
+    METRICS.gauge('github_rate_limit_remaining', 4200, resource='core')
+    METRICS.add_gauge('pipeline_queue_depth', 1, queue='diff_pool')
+
+and exports it as:
+
+- a JSON trace (write_trace): Chrome trace events of the most recent
+  MAX_TRACE_EVENTS stage spans, viewable in chrome://tracing or Perfetto,
+  plus a snapshot of every aggregate under "metrics"
+- Prometheus text (write_prometheus), e.g. for the node exporter's
+  textfile collector
+- a progress line printed every few seconds by ProgressReporter
+
+Stage seconds are summed over all calls, including concurrent ones, so on
+an async run they can add up to more than the wall time. Compare stages
+with each other, not with the clock.
+"""
+import os
+import json
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+MAX_TRACE_EVENTS = 100000  # Most recent stage spans kept for the trace; aggregates cover everything
+PROGRESS_INTERVAL = 60  # seconds between progress lines
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in key) + '}'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    return f'{seconds // 60}m{seconds % 60:02d}s'
+
+
+class Metrics:
+    """Thread-safe registry of stage timings, counters and gauges"""
+
+    def __init__(self, max_trace_events=MAX_TRACE_EVENTS):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.stages = {}  # (stage, labels) -> [runs, seconds, max seconds]
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.trace = deque(maxlen=max_trace_events)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Time a block as one run of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start, start, **labels)
+
+    def record_stage(self, name, seconds, start=None, **labels):
+        """Add a run measured elsewhere (e.g. in a worker process) to a stage"""
+        key = (name, label_key(labels))
+        event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.current_thread().name,
+                 'ts': round(((start if start is not None else time.perf_counter() - seconds)
+                              - self._origin) * 1e6),
+                 'dur': round(seconds * 1e6)}
+        if labels:
+            event['args'] = {label: str(value) for label, value in labels.items()}
+        with self._lock:
+            totals = self.stages.get(key)
+            if totals is None:
+                totals = self.stages[key] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            self.trace.append(event)
+
+    def count(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def add_gauge(self, name, delta, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def total(self, name, **labels):
+        """Sum of a counter over every label set matching labels"""
+        wanted = set(label_key(labels))
+        with self._lock:
+            return sum(value for (counter, key), value in self.counters.items()
+                       if counter == name and wanted <= set(key))
+
+    def mean_stage_seconds(self, name, **labels):
+        """Mean seconds of one run of a stage with exactly these labels; None before its first run"""
+        with self._lock:
+            totals = self.stages.get((name, label_key(labels)))
+        return totals[1] / totals[0] if totals else None
+
+    def gauge_values(self, name):
+        """{labels: value} of a gauge"""
+        with self._lock:
+            return {key: value for (gauge, key), value in self.gauges.items() if gauge == name}
+
+    def snapshot(self):
+        """All aggregates as plain JSON-serializable data"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self._origin,
+                'stages': [{'stage': name, 'labels': dict(key), 'runs': runs, 'seconds': seconds,
+                            'max_seconds': longest}
+                           for (name, key), (runs, seconds, longest) in sorted(self.stages.items())],
+                'counters': [{'name': name, 'labels': dict(key), 'value': value}
+                             for (name, key), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(key), 'value': value}
+                           for (name, key), value in sorted(self.gauges.items())],
+            }
+
+    def write_trace(self, path):
+        with self._lock:
+            events = list(self.trace)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'metrics': self.snapshot()}, f)
+        os.replace(path + '.tmp', path)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        for metric, column in (('pipeline_stage_runs_total', 0), ('pipeline_stage_seconds_total', 1),
+                               ('pipeline_stage_seconds_max', 2)):
+            lines.append(f'# TYPE {metric} {"gauge" if metric.endswith("_max") else "counter"}')
+            for (name, key), totals in stages:
+                lines.append(f'{metric}{format_labels((("stage", name),) + key)} {totals[column]}')
+        for kind, items, suffix in (('counter', counters, '_total'), ('gauge', gauges, '')):
+            declared = set()
+            for (name, key), value in items:
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f'# TYPE {name}{suffix} {kind}')
+                lines.append(f'{name}{suffix}{format_labels(key)} {value}')
+        lines.append('# TYPE pipeline_uptime_seconds gauge')
+        lines.append(f'pipeline_uptime_seconds {time.perf_counter() - self._origin:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(path + '.tmp', path)
+
+    def stage_report(self):
+        """Stage totals, largest first, as printable lines"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+        total = sum(totals[1] for _, totals in stages) or 1
+        lines = ['Stage                 runs      seconds   share      max']
+        for (name, key), (runs, seconds, longest) in stages:
+            label = name + (format_labels(key) if key else '')
+            lines.append(f'{label:<20} {runs:>6} {seconds:>12.2f} {seconds / total:>7.1%} {longest:>8.2f}')
+        return '\n'.join(lines)
+
+    def progress_line(self, total_repos=None):
+        elapsed = time.perf_counter() - self._origin
+        repos = self.total('pipeline_repos')
+        parts = [f'[{format_duration(elapsed)}]']
+        if total_repos:
+            rate = repos / elapsed if elapsed else 0
+            eta = f', ETA {format_duration((total_repos - repos) / rate)}' if rate and repos < total_repos else ''
+            parts.append(f'repos {repos:,}/{total_repos:,} ({repos / total_repos:.1%}{eta})')
+        else:
+            parts.append(f'repos {repos:,}')
+        parts.append(f'PRs {self.total("pipeline_prs"):,}')
+        calls = self.total('github_api_requests')
+        parts.append(f'API {calls:,} ({calls / elapsed * 60 if elapsed else 0:.0f}/min)')
+        hits = self.total('github_cache_requests', result='hit') + self.total('github_cache_requests',
+                                                                              result='revalidated')
+        lookups = self.total('github_cache_requests')
+        if lookups:
+            parts.append(f'cache {hits / lookups:.0%} hit')
+        remaining = self.gauge_values('github_rate_limit_remaining')
+        if remaining:
+            parts.append('budget ' + ' '.join(f'{dict(key).get("resource", "?")}={value:,}'
+                                              for key, value in sorted(remaining.items())))
+        depths = self.gauge_values('pipeline_queue_depth')
+        if depths:
+            parts.append('queues ' + ' '.join(f'{dict(key).get("queue", "?")}={value}'
+                                              for key, value in sorted(depths.items())))
+        with self._lock:
+            busiest = max(self.stages.items(), key=lambda item: item[1][1], default=None)
+        if busiest:
+            parts.append(f'top stage {busiest[0][0]}')
+        return ' | '.join(parts)
+
+
+METRICS = Metrics()
+
+
+def stage(name, **labels):
+    """Time a block as a stage of the process-wide registry"""
+    return METRICS.stage(name, **labels)
+
+
+def timed(name, **labels):
+    """Decorator timing every call of a function (or coroutine function) as a stage"""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with METRICS.stage(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.stage(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class ProgressReporter:
+    """Print METRICS.progress_line() every interval seconds from a background thread.
+
+    With prometheus_path, the Prometheus text is rewritten on every tick too.
+    """
+
+    def __init__(self, total_repos=None, interval=PROGRESS_INTERVAL, prometheus_path=None, metrics=None):
+        self.total_repos = total_repos
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.metrics = metrics or METRICS
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self):
+        print(self.metrics.progress_line(self.total_repos), flush=True)
+        if self.prometheus_path:
+            self.metrics.write_prometheus(self.prometheus_path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,175 @@
+"""
+Per-repo language histograms aggregated from The Stack at ingest.
+
+Every file row in The Stack carries its language and size, so the ingest
+sums bytes per (repo, language) while it reads the shards and writes a
+Parquet sidecar next to the repo index (starcoder_v2_languages.parquet)
+with columns repo_name, language, bytes. The language filters then run
+locally and in bulk, as pyarrow group-bys over all overlapping repos, and
+only repos missing from the sidecar need the GitHub languages API.
+
+The histogram covers the files The Stack kept for a repo (after
+deduplication and license filtering), not necessarily the whole repo.
+"""
+import os
+import heapq
+import shutil
+import tempfile
+from itertools import groupby
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from repo_index import MERGE_FAN_IN
+
+MERGE_READ_ROWS = 4096  # Rows buffered per input file while merging sidecars
+MERGE_WRITE_ROWS = 65536  # Rows per batch written to the merged sidecar
+LANGUAGE_SCHEMA = pa.schema([('repo_name', pa.string()), ('language', pa.string()), ('bytes', pa.int64())])
+
+
+def languages_path_for(index_path):
+    """starcoder_v1_repos.idx -> starcoder_v1_languages.parquet"""
+    stem = os.path.splitext(index_path)[0]
+    if stem.endswith('_repos'):
+        stem = stem[:-len('_repos')]
+    return stem + '_languages.parquet'
+
+
+def aggregate_languages(table):
+    """Sum bytes per (repo_name, language) of a table in LANGUAGE_SCHEMA"""
+    if table.num_rows == 0:
+        return LANGUAGE_SCHEMA.empty_table()
+    grouped = table.group_by(['repo_name', 'language']).aggregate([('bytes', 'sum')])
+    return pa.table({
+        'repo_name': grouped['repo_name'],
+        'language': grouped['language'],
+        'bytes': pc.cast(grouped['bytes_sum'], pa.int64()),
+    })
+
+
+def batch_languages(batch, repo_key, lang_key, size_key):
+    """Per-(repo, language) byte sums of one RecordBatch of The Stack"""
+    table = pa.table({
+        'repo_name': batch.column(repo_key),
+        'language': pc.cast(batch.column(lang_key), pa.string()),
+        'bytes': pc.cast(batch.column(size_key), pa.int64()),
+    })
+    return aggregate_languages(table.filter(pc.is_valid(table['repo_name'])))
+
+
+def write_languages(path, tables):
+    """Aggregate partial histograms and write them sorted by repo"""
+    table = aggregate_languages(pa.concat_tables(tables)) if tables else LANGUAGE_SCHEMA.empty_table()
+    table = table.sort_by([('repo_name', 'ascending'), ('language', 'ascending')])
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return table.num_rows
+
+
+def iter_language_rows(path):
+    """(sort key, language, bytes) rows of a sorted sidecar, read MERGE_READ_ROWS at a time.
+
+    The key orders a null language after every name, as sort_by does.
+    """
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=MERGE_READ_ROWS):
+        for repo_name, language, size in zip(*(column.to_pylist() for column in batch.columns)):
+            yield (repo_name, language is None, language or ''), language, size
+
+
+def merge_sorted_languages(paths):
+    """Merge sorted sidecars into one (repo_name, language, bytes) stream, summing equal keys"""
+    merged = heapq.merge(*(iter_language_rows(path) for path in paths), key=lambda row: row[0])
+    for (repo_name, _, _), group in groupby(merged, key=lambda row: row[0]):
+        language, size = None, 0
+        for _, language, row_bytes in group:
+            size += row_bytes
+        yield repo_name, language, size
+
+
+def write_language_rows(path, rows):
+    """Stream sorted rows into a sidecar through a ParquetWriter; returns the number of repos"""
+    writer = pq.ParquetWriter(path + '.tmp', LANGUAGE_SCHEMA)
+    repos = 0
+    last_repo = None
+    columns = ([], [], [])
+    try:
+        for row in rows:
+            if row[0] != last_repo:
+                repos += 1
+                last_repo = row[0]
+            for column, value in zip(columns, row):
+                column.append(value)
+            if len(columns[0]) >= MERGE_WRITE_ROWS:
+                writer.write_table(pa.table(dict(zip(LANGUAGE_SCHEMA.names, columns)), schema=LANGUAGE_SCHEMA))
+                columns = ([], [], [])
+        if columns[0]:
+            writer.write_table(pa.table(dict(zip(LANGUAGE_SCHEMA.names, columns)), schema=LANGUAGE_SCHEMA))
+    finally:
+        writer.close()
+    os.replace(path + '.tmp', path)
+    return repos
+
+
+def merge_language_files(paths, output_path, fan_in=MERGE_FAN_IN, temp_dir=None):
+    """Merge sorted per-shard histograms into one sidecar; returns the number of repos.
+
+    Like repo_index.merge_runs, this is a streaming k-way merge in passes of
+    at most fan_in open files, so memory does not grow with the row count.
+    """
+    paths = list(paths)
+    work_dir = None
+    merge_pass = 0
+    try:
+        while len(paths) > fan_in:
+            if work_dir is None:
+                work_dir = tempfile.mkdtemp(prefix='language_merge_', dir=temp_dir)
+            merge_pass += 1
+            merged_paths = []
+            for start in range(0, len(paths), fan_in):
+                path = os.path.join(work_dir, f'pass{merge_pass}_{len(merged_paths):06d}.parquet')
+                write_language_rows(path, merge_sorted_languages(paths[start:start + fan_in]))
+                merged_paths.append(path)
+            if merge_pass > 1:
+                for path in paths:
+                    os.remove(path)  # Intermediate files of the previous pass
+            paths = merged_paths
+        return write_language_rows(output_path, merge_sorted_languages(paths))
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def read_languages(path, repo_names):
+    """Rows of the sidecar for the given repos only"""
+    return pq.read_table(path, filters=[('repo_name', 'in', list(repo_names))])
+
+
+def target_language_repos(path, repo_names, target_languages, threshold):
+    """Check the language filter for many repos at once.
+
+    Returns (passing, known): the repos with at least `threshold` percent of
+    their bytes in one of target_languages, and all repos the sidecar covers.
+    Repos not in `known` need another source, such as the API.
+    """
+    if not repo_names or not os.path.exists(path):
+        return set(), set()
+    table = read_languages(path, repo_names)
+    totals = table.group_by('repo_name').aggregate([('bytes', 'sum')])
+    known = set(totals['repo_name'].to_pylist())
+    targets = table.filter(pc.is_in(table['language'], value_set=pa.array(target_languages, pa.string())))
+    if targets.num_rows == 0:
+        return set(), known
+    joined = targets.join(totals, 'repo_name')
+    percentage = pc.multiply(pc.divide(pc.cast(joined['bytes'], pa.float64()),
+                                       pc.cast(joined['bytes_sum'], pa.float64())), 100)
+    passing = joined.filter(pc.greater_equal(percentage, threshold))
+    return set(passing['repo_name'].to_pylist()), known
+
+
+def load_languages(path, repo_names):
+    """{repo: {language: bytes}} for the given repos, shaped like the /languages API"""
+    if not repo_names or not os.path.exists(path):
+        return {}
+    histograms = {}
+    for row in read_languages(path, repo_names).to_pylist():
+        histograms.setdefault(row['repo_name'], {})[row['language']] = row['bytes']
+    return histograms
@@ -0,0 +1,469 @@
+"""
+Local stand-in for the GitHub REST and GraphQL APIs.
+
+Point the analysis scripts at it with GITHUB_API_URL to run them without
+a token or any rate-limit cost, e.g. for the pipeline benchmark
+(benchmarks/bench_pipeline.py). Two sources of responses:
+
+- fixtures: a JSON description of repos (commit dates, languages,
+  metadata, pull requests and their files) that the server renders as
+  /repos/{r}/languages, /repos/{r}/commits/{sha}, /repos/{r}/pulls (sorted
+  and Link-paginated), /repos/{r}/pulls/{n} (JSON or unified diff),
+  /repos/{r}/pulls/{n}/files and the aliased GraphQL queries for commit
+  dates and repo metadata. generate_fixtures() builds synthetic ones.
+- cassettes: responses recorded from the real API (--record, proxied with
+  GITHUB_TOKEN) and replayed byte for byte later (--replay).
+
+Every response carries X-RateLimit-* headers drawn from a per-resource
+budget and an ETag; If-None-Match is answered with 304. Requests are
+counted per endpoint in MockGitHubServer.calls.
+
+    python mock_github_server.py --fixtures fixtures.json [--port 8765]
+    python mock_github_server.py --record cassette.json [--upstream https://api.github.com]
+    python mock_github_server.py --replay cassette.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import requests
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+DEFAULT_PORT = 8765
+RATE_LIMITS = {'core': 1_000_000, 'graphql': 1_000_000, 'search': 30_000}  # Generous, so benchmarks never wait
+RATE_WINDOW = 3600  # seconds until a budget resets
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+BASE_PLACEHOLDER = '{base_url}'  # Upstream URL in recorded Link headers, swapped for the mock's on replay
+
+REPO_PATH = re.compile(r'^/repos/([^/]+/[^/]+)(/.*)?$')
+GRAPHQL_REPOSITORY = re.compile(r'(r\d+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)')
+GRAPHQL_OBJECT = re.compile(r'(c\d+): object\(expression: ("(?:[^"\\]|\\.)*")\)')
+
+
+def github_date(date):
+    return date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def generate_fixtures(repos=100, prs_per_repo=5, files_per_pr=3, lines_per_file=20, seed=0):
+    """Synthetic repos whose commit changed between V1 and V2, with PRs merged in between.
+
+    Every repo also has a few PRs from before V1, so the /pulls walk has to
+    stop at the cutoff, and one bot PR that the pipelines skip.
+    """
+    rng = random.Random(seed)
+    v1_date = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    v2_date = datetime(2023, 6, 1, tzinfo=timezone.utc)
+    fixtures = {'repos': {}}
+    for i in range(repos):
+        name = f'bench-org/repo{i:05d}'
+        v1_sha = hashlib.sha1(f'{name} v1'.encode()).hexdigest()
+        v2_sha = hashlib.sha1(f'{name} v2'.encode()).hexdigest()
+        pulls, files = [], {}
+        window = (v2_date - v1_date).total_seconds()
+        merged = sorted((v1_date + timedelta(seconds=rng.uniform(0, window)) for _ in range(prs_per_repo)),
+                        reverse=True)
+        old = [v1_date - timedelta(days=rng.uniform(1, 300)) for _ in range(3)]
+        for number, merged_at in enumerate(merged + old, start=1):
+            bot = number == 2 and prs_per_repo > 1
+            pulls.append({
+                'number': number,
+                'title': f'Fix bug {number} in module {rng.randint(1, 50)}',
+                'html_url': f'https://github.com/{name}/pull/{number}',
+                'body': 'Improves performance and adds a test',
+                'merged_at': github_date(merged_at),
+                'updated_at': github_date(merged_at + timedelta(hours=1)),
+                'user': {'login': 'dependabot[bot]' if bot else f'dev{rng.randint(1, 20)}',
+                         'type': 'Bot' if bot else 'User'},
+            })
+            files[str(number)] = [synthetic_file(rng, number, j, lines_per_file) for j in range(files_per_pr)]
+        fixtures['repos'][name] = {
+            'commits': {v1_sha: github_date(v1_date), v2_sha: github_date(v2_date)},
+            'v1_sha': v1_sha,
+            'v2_sha': v2_sha,
+            'languages': {'JavaScript': rng.randint(10_000, 90_000), 'Python': rng.randint(10_000, 90_000)},
+            'metadata': {'stargazerCount': rng.randint(30, 5000), 'isArchived': False, 'isFork': False,
+                         'defaultBranch': 'main', 'mentionableUsers': rng.randint(5, 200)},
+            'pulls': pulls,
+            'files': files,
+        }
+    return fixtures
+
+
+def synthetic_file(rng, number, index, lines):
+    extension, comment = rng.choice([('py', '#'), ('js', '//'), ('ts', '//')])
+    filename = f'src/module{number}_{index}.{extension}' if index else f'tests/test_{number}.{extension}'
+    body = []
+    for line in range(lines):
+        kind = rng.random()
+        if kind < 0.15:
+            body.append(f'+{comment} note {line}')
+        elif kind < 0.25:
+            body.append(f'+import mod{line}' if extension == 'py' else f"+import x{line} from 'x{line}';")
+        elif kind < 0.35:
+            body.append(f'+def f{line}(a):' if extension == 'py' else f'+function f{line}(a) {{')
+        elif kind < 0.55:
+            body.append(f'-value_{line} = old({line})')
+        else:
+            body.append(f'+value_{line} = compute({line})')
+    status = 'added' if index == 1 and number % 4 == 0 else 'modified'
+    if status == 'added':
+        body = [line for line in body if line.startswith('+')]
+    additions = sum(line.startswith('+') for line in body)
+    deletions = sum(line.startswith('-') for line in body)
+    patch = f'@@ -1,{deletions + 1} +1,{additions + 1} @@\n' + '\n'.join(body + [' unchanged'])
+    return {'filename': filename, 'status': status, 'additions': additions, 'deletions': deletions,
+            'changes': additions + deletions, 'patch': patch}
+
+
+def render_diff(files):
+    """A unified diff of /files records, as the v3.diff media type returns it"""
+    lines = []
+    for file_info in files:
+        name = file_info['filename']
+        lines.append(f'diff --git a/{name} b/{name}')
+        if file_info['status'] == 'added':
+            lines += ['new file mode 100644', 'index 0000000..1111111', '--- /dev/null', f'+++ b/{name}']
+        else:
+            lines += ['index 1111111..2222222 100644', f'--- a/{name}', f'+++ b/{name}']
+        lines.append(file_info['patch'])
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class RateBudget:
+    """Per-resource X-RateLimit-* bookkeeping"""
+
+    def __init__(self, limits=None, window=RATE_WINDOW):
+        self.limits = dict(RATE_LIMITS, **(limits or {}))
+        self.window = window
+        self._lock = threading.Lock()
+        self._used = Counter()
+        self._reset = {}
+
+    def charge(self, resource):
+        """Count one request; returns (headers, allowed)"""
+        now = time.time()
+        with self._lock:
+            if self._reset.get(resource, 0) <= now:
+                self._reset[resource] = now + self.window
+                self._used[resource] = 0
+            limit = self.limits.get(resource, self.limits['core'])
+            allowed = self._used[resource] < limit
+            if allowed:
+                self._used[resource] += 1
+            headers = {
+                'X-RateLimit-Limit': str(limit),
+                'X-RateLimit-Remaining': str(limit - self._used[resource]),
+                'X-RateLimit-Used': str(self._used[resource]),
+                'X-RateLimit-Reset': str(int(self._reset[resource])),
+                'X-RateLimit-Resource': resource,
+            }
+        return headers, allowed
+
+
+def request_resource(path):
+    if path.startswith('/graphql'):
+        return 'graphql'
+    if path.startswith('/search/'):
+        return 'search'
+    return 'core'
+
+
+class FixtureBackend:
+    """Render API responses from a fixtures dict (see generate_fixtures)"""
+
+    def __init__(self, fixtures):
+        self.repos = fixtures['repos']
+
+    def get(self, path, query, headers, base_url):
+        """(endpoint label, status, headers, body) for a GET request"""
+        match = REPO_PATH.match(path)
+        repo = self.repos.get(match.group(1)) if match else None
+        if repo is None:
+            return 'not_found', 404, {}, {'message': 'Not Found'}
+        repo_name, rest = match.group(1), match.group(2) or ''
+        if rest == '/languages':
+            return 'languages', 200, {}, repo['languages']
+        commit = re.fullmatch(r'/commits/(\w+)', rest)
+        if commit:
+            date = repo['commits'].get(commit.group(1))
+            if date is None:
+                return 'commit', 422, {}, {'message': 'No commit found for SHA'}
+            return 'commit', 200, {}, {'sha': commit.group(1), 'commit': {'committer': {'date': date},
+                                                                           'author': {'date': date}}}
+        if rest == '/pulls':
+            pulls = [pr for pr in repo['pulls'] if query.get('state', 'open') in ('closed', 'all')]
+            pulls.sort(key=lambda pr: pr['updated_at'], reverse=query.get('direction', 'desc') == 'desc')
+            return ('pulls',) + self.page(pulls, path, query, base_url)
+        pull = re.fullmatch(r'/pulls/(\d+)(/files)?', rest)
+        if pull:
+            files = repo['files'].get(pull.group(1))
+            if files is None:
+                return 'pull', 404, {}, {'message': 'Not Found'}
+            if pull.group(2):
+                return ('files',) + self.page(files, path, query, base_url)
+            if 'diff' in headers.get('Accept', ''):
+                return 'pull_diff', 200, {'Content-Type': 'text/plain; charset=utf-8'}, render_diff(files)
+            pr = next(pr for pr in repo['pulls'] if str(pr['number']) == pull.group(1))
+            return 'pull', 200, {}, dict(pr, changed_files=len(files),
+                                         additions=sum(f['additions'] for f in files),
+                                         deletions=sum(f['deletions'] for f in files))
+        return 'not_found', 404, {}, {'message': f'Not Found: {repo_name}{rest}'}
+
+    def page(self, items, path, query, base_url):
+        """One page of a listing plus its Link header"""
+        per_page = min(int(query.get('per_page', DEFAULT_PER_PAGE)), MAX_PER_PAGE)
+        page = max(int(query.get('page', 1)), 1)
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        links = []
+        for rel, number in (('next', page + 1), ('last', last)) if page < last else ():
+            links.append(f'<{base_url}{path}?{urlencode(dict(query, page=number))}>; rel="{rel}"')
+        return 200, {'Link': ', '.join(links)} if links else {}, items[(page - 1) * per_page:page * per_page]
+
+    def graphql(self, query):
+        """Answer the aliased commit-date and metadata queries of github_graphql.py"""
+        data, errors = {}, []
+        matches = list(GRAPHQL_REPOSITORY.finditer(query))
+        for i, match in enumerate(matches):
+            alias = match.group(1)
+            repo_name = f'{json.loads(match.group(2))}/{json.loads(match.group(3))}'
+            repo = self.repos.get(repo_name)
+            if repo is None:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                               'message': f"Could not resolve to a Repository with the name '{repo_name}'."})
+                continue
+            selection = query[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(query)]
+            result = {}
+            for object_match in GRAPHQL_OBJECT.finditer(selection):
+                date = repo['commits'].get(json.loads(object_match.group(2)))
+                result[object_match.group(1)] = {'committedDate': date} if date else None
+            if 'stargazerCount' in selection:
+                metadata = repo['metadata']
+                languages = sorted(repo['languages'].items(), key=lambda item: -item[1])
+                result.update({
+                    'stargazerCount': metadata['stargazerCount'],
+                    'isArchived': metadata['isArchived'],
+                    'isFork': metadata['isFork'],
+                    'defaultBranchRef': {'name': metadata['defaultBranch']},
+                    'mentionableUsers': {'totalCount': metadata['mentionableUsers']},
+                    'languages': {'totalSize': sum(size for _, size in languages),
+                                  'edges': [{'size': size, 'node': {'name': name}} for name, size in languages]},
+                })
+            data[alias] = result
+        payload = {'data': data}
+        if errors:
+            payload['errors'] = errors
+        return payload
+
+
+class Cassette:
+    """Recorded responses keyed by method, path, query, Accept and GraphQL body"""
+
+    def __init__(self, path, upstream=None, token=None):
+        self.path = path
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.token = token
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(method, path, query, accept, body=b''):
+        digest = hashlib.sha1(body).hexdigest()[:16] if body else ''
+        return f'{method} {path}?{urlencode(sorted(query.items()))} {accept} {digest}'
+
+    def lookup(self, key, base_url):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        headers = {name: value.replace(BASE_PLACEHOLDER, base_url) for name, value in entry['headers'].items()}
+        return entry['status'], headers, entry['body'].encode('utf-8')
+
+    def record(self, key, method, path, query, headers, body):
+        """Forward a request upstream and store the response"""
+        request_headers = {name: value for name, value in headers.items()
+                           if name in ('Accept', 'Content-Type', 'X-GitHub-Api-Version')}
+        if self.token:
+            request_headers['Authorization'] = 'Bearer ' + self.token
+        response = requests.request(method, self.upstream + path, params=query, headers=request_headers,
+                                    data=body or None, timeout=60)
+        kept = {name: response.headers[name].replace(self.upstream, BASE_PLACEHOLDER)
+                for name in ('Content-Type', 'Link') if name in response.headers}
+        with self._lock:
+            self.entries[key] = {'status': response.status_code, 'headers': kept,
+                                 'body': response.content.decode('utf-8', 'replace')}
+
+    def save(self):
+        with self._lock:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + '.tmp', self.path)
+
+
+def endpoint_label(path):
+    """Coarse endpoint name for the call counters of cassette requests"""
+    if path.startswith('/graphql'):
+        return 'graphql'
+    match = REPO_PATH.match(path)
+    rest = (match.group(2) or '') if match else path
+    for pattern, label in ((r'/languages', 'languages'), (r'/commits/\w+', 'commit'), (r'/pulls', 'pulls'),
+                           (r'/pulls/\d+', 'pull'), (r'/pulls/\d+/files', 'files')):
+        if re.fullmatch(pattern, rest):
+            return label
+    return 'other'
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API; the client pools connections
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def handle_api(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        rate_headers, allowed = server.budget.charge(request_resource(url.path))
+        if not allowed:
+            return self.respond(403, rate_headers, {'message': 'API rate limit exceeded'}, 'rate_limited')
+
+        if server.cassette is not None:
+            key = Cassette.key(method, url.path, query, self.headers.get('Accept', ''), body)
+            label = endpoint_label(url.path)
+            recorded = server.cassette.lookup(key, server.base_url)
+            if recorded is None and server.cassette.upstream:
+                server.cassette.record(key, method, url.path, query, self.headers, body)
+                recorded = server.cassette.lookup(key, server.base_url)
+            if recorded is None:
+                return self.respond(404, rate_headers, {'message': f'Not recorded: {key}'}, 'not_recorded')
+            status, headers, payload = recorded
+        elif method == 'POST' and url.path == '/graphql':
+            label, status, headers = 'graphql', 200, {}
+            payload = server.backend.graphql(json.loads(body)['query'])
+        elif method == 'GET':
+            label, status, headers, payload = server.backend.get(url.path, query, self.headers, server.base_url)
+        else:
+            label, status, headers, payload = 'not_found', 404, {}, {'message': 'Not Found'}
+        self.respond(status, dict(rate_headers, **headers), payload, label)
+
+    def respond(self, status, headers, payload, label):
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+        etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, payload, label = 304, b'', label + '_304'
+        if status == 200:
+            headers['ETag'] = etag
+        self.server.count(label)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockGitHubServer(ThreadingHTTPServer):
+    """Threaded mock API; serve it in the background with start()"""
+
+    daemon_threads = True
+
+    def __init__(self, fixtures=None, cassette=None, port=0, rate_limits=None):
+        super().__init__(('127.0.0.1', port), MockGitHubHandler)
+        self.backend = FixtureBackend(fixtures) if fixtures is not None else None
+        self.cassette = cassette
+        self.budget = RateBudget(rate_limits)
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, label):
+        with self._calls_lock:
+            self.calls[label] += 1
+
+    def snapshot(self):
+        """Copy of the per-endpoint call counters"""
+        with self._calls_lock:
+            return Counter(self.calls)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-github', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.cassette is not None and self.cassette.upstream:
+            self.cassette.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a mock GitHub API for the analysis scripts')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--fixtures', help='fixtures JSON to serve (default: synthetic repos)')
+    source.add_argument('--record', metavar='CASSETTE', help='proxy to --upstream and record responses')
+    source.add_argument('--replay', metavar='CASSETTE', help='serve responses recorded with --record')
+    parser.add_argument('--upstream', default='https://api.github.com')
+    parser.add_argument('--repos', type=int, default=100, help='synthetic repos without --fixtures')
+    parser.add_argument('--write-fixtures', metavar='PATH', help='save the synthetic fixtures and exit')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.write_fixtures:
+        with open(args.write_fixtures, 'w', encoding='utf-8') as f:
+            json.dump(generate_fixtures(args.repos), f)
+        return
+    fixtures = cassette = None
+    if args.record:
+        token = os.getenv('GITHUB_TOKEN')
+        if not token:
+            sys.exit('Recording needs GITHUB_TOKEN for the upstream API')
+        cassette = Cassette(args.record, args.upstream, token)
+    elif args.replay:
+        cassette = Cassette(args.replay)
+    elif args.fixtures:
+        with open(args.fixtures, encoding='utf-8') as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = generate_fixtures(args.repos)
+
+    server = MockGitHubServer(fixtures, cassette, args.port)
+    print(f"Mock GitHub API on {server.base_url} (set GITHUB_API_URL={server.base_url}); Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cassette is not None and cassette.upstream:
+            cassette.save()
+            print(f"Recorded {len(cassette.entries)} responses to {cassette.path}")
+        print(', '.join(f'{label}: {count}' for label, count in sorted(server.calls.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Online aggregates of the per-PR analysis records.
+
+The summary is updated as each record is produced, so no records need to
+be kept. Snapshots can be taken at any point of a run, and aggregators
+built by separate workers merge into one. Each metric keeps:
+
+- RunningStats: count, sum, min, max and Welford's running mean/variance,
+  merged with Chan et al.'s pairwise update
+- TDigest: a merging t-digest for approximate percentiles; the error is
+  smallest near the tails, and memory is bounded by the compression
+  setting rather than the record count. While a metric has at most
+  EXACT_VALUES distinct values (typical for small integer counts), the
+  digest also counts each value and its percentiles are exact
+
+SummaryAggregator adds group-bys by repo and by the keys of map fields
+(language, change type). state()/from_state() give a JSON-serializable form
+for handing partial summaries between processes.
+"""
+import math
+from result_writers import record_map
+
+COMPRESSION = 200  # t-digest compression; at most about compression / 2 centroids
+BUFFER_FACTOR = 5  # Values buffered per compression unit before a t-digest merge pass
+EXACT_VALUES = 1000  # Distinct values counted exactly before percentiles fall back to the centroids
+QUANTILES = (0.5, 0.9, 0.99)
+TOP_REPOS = 100  # Repos listed in to_dict(), by PR count
+
+
+class RunningStats:
+    """Count, sum, min, max, mean and variance in one pass"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def state(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.count, stats.total, stats.mean, stats.m2 = state['count'], state['total'], state['mean'], state['m2']
+        if stats.count:
+            stats.min, stats.max = state['min'], state['max']
+        return stats
+
+
+class TDigest:
+    """Merging t-digest: sorted centroids whose size shrinks towards the tails"""
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._centroids = []  # (mean, weight), sorted by mean
+        self._buffer = []
+        self._exact = {}  # value -> weight; None once there are more than EXACT_VALUES values
+
+    def add(self, value, weight=1):
+        self._buffer.append((value, weight))
+        if self._exact is not None:
+            self._exact[value] = self._exact.get(value, 0) + weight
+            if len(self._exact) > EXACT_VALUES:
+                self._exact = None
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(other._centroids)
+        if self._exact is not None and other._exact is not None:
+            for value, weight in other._exact.items():
+                self._exact[value] = self._exact.get(value, 0) + weight
+            if len(self._exact) > EXACT_VALUES:
+                self._exact = None
+        else:
+            self._exact = None
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        """Merge the buffer into the centroids; the k1 scale function bounds each centroid's quantile span"""
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        total = self.count
+        centroids = []
+        before = 0  # Weight of the finished centroids
+        mean, weight = points[0]
+        limit = self._weight_limit(before, total)
+        for point_mean, point_weight in points[1:]:
+            if before + weight + point_weight <= limit:
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+            else:
+                centroids.append((mean, weight))
+                before += weight
+                limit = self._weight_limit(before, total)
+                mean, weight = point_mean, point_weight
+        centroids.append((mean, weight))
+        self._centroids = centroids
+
+    def _weight_limit(self, before, total):
+        """Cumulative weight a centroid starting at `before` may grow to: one unit of k1 further"""
+        scale = self.compression / (2 * math.pi)
+        k = scale * math.asin(2 * before / total - 1) + 1
+        if k >= self.compression / 4:
+            return total
+        return (math.sin(k / scale) + 1) / 2 * total
+
+    def quantile(self, q):
+        """Value at quantile q (0..1); exact while values are counted, else interpolated between centroids"""
+        if self._exact is not None:
+            return self._exact_quantile(q)
+        self._compress()
+        if not self._centroids:
+            return None
+        target = q * self.count
+        previous_center, previous_mean = 0, self.min
+        before = 0
+        for mean, weight in self._centroids:
+            center = before + weight / 2
+            if target < center:
+                span = center - previous_center
+                return previous_mean + (mean - previous_mean) * ((target - previous_center) / span if span else 0)
+            previous_center, previous_mean = center, mean
+            before += weight
+        span = self.count - previous_center
+        return previous_mean + (self.max - previous_mean) * ((target - previous_center) / span if span else 0)
+
+    def _exact_quantile(self, q):
+        """Smallest counted value with at least q of the weight at or below it"""
+        if not self._exact:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for value in sorted(self._exact):
+            cumulative += self._exact[value]
+            if cumulative >= target:
+                return value
+        return self.max
+
+    def state(self):
+        self._compress()
+        return {'compression': self.compression, 'count': self.count,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'centroids': [list(centroid) for centroid in self._centroids],
+                'exact': [list(item) for item in self._exact.items()] if self._exact is not None else None}
+
+    @classmethod
+    def from_state(cls, state):
+        digest = cls(state['compression'])
+        digest.count = state['count']
+        if digest.count:
+            digest.min, digest.max = state['min'], state['max']
+        digest._centroids = [tuple(centroid) for centroid in state['centroids']]
+        exact = state['exact']
+        digest._exact = {value: weight for value, weight in exact} if exact is not None else None
+        return digest
+
+
+class SummaryAggregator:
+    """Per-metric stats and percentiles plus group-bys, updated one record at a time.
+
+    metrics are numeric record fields. group_maps maps a group name to a
+    record field holding {key: count}, e.g. {'language': 'languages_changed'};
+    each key counts the PRs touching it and the summed counts (files).
+    """
+
+    def __init__(self, metrics, group_maps=None, repo_metrics=(), compression=COMPRESSION):
+        self.metrics = list(metrics)
+        self.group_maps = dict(group_maps or {})
+        self.repo_metrics = list(repo_metrics)
+        self.compression = compression
+        self.count = 0
+        self.stats = {metric: RunningStats() for metric in self.metrics}
+        self.digests = {metric: TDigest(compression) for metric in self.metrics}
+        self.by_repo = {}
+        self.groups = {group: {} for group in self.group_maps}
+
+    def add(self, record):
+        self.count += 1
+        for metric in self.metrics:
+            value = record.get(metric) or 0
+            self.stats[metric].add(value)
+            self.digests[metric].add(value)
+        repo = self.by_repo.get(record['repo_name'])
+        if repo is None:
+            repo = self.by_repo[record['repo_name']] = dict.fromkeys(['prs'] + self.repo_metrics, 0)
+        repo['prs'] += 1
+        for metric in self.repo_metrics:
+            repo[metric] += record.get(metric) or 0
+        for group, field in self.group_maps.items():
+            keys = self.groups[group]
+            for key, files in record_map(record.get(field)).items():
+                counts = keys.get(key)
+                if counts is None:
+                    counts = keys[key] = {'prs': 0, 'files': 0}
+                counts['prs'] += 1
+                counts['files'] += files
+
+    def add_many(self, records):
+        for record in records:
+            self.add(record)
+
+    def merge(self, other):
+        """Fold another aggregator (e.g. from a parallel worker) into this one"""
+        self.count += other.count
+        for metric in self.metrics:
+            self.stats[metric].merge(other.stats[metric])
+            self.digests[metric].merge(other.digests[metric])
+        for name, counts in other.by_repo.items():
+            repo = self.by_repo.setdefault(name, dict.fromkeys(counts, 0))
+            for key, value in counts.items():
+                repo[key] += value
+        for group, keys in other.groups.items():
+            for key, counts in keys.items():
+                merged = self.groups[group].setdefault(key, {'prs': 0, 'files': 0})
+                merged['prs'] += counts['prs']
+                merged['files'] += counts['files']
+        return self
+
+    def metric_summary(self, metric, quantiles=QUANTILES):
+        stats, digest = self.stats[metric], self.digests[metric]
+        summary = {'count': stats.count, 'sum': stats.total, 'mean': stats.mean, 'std': stats.std,
+                   'min': stats.min if stats.count else None, 'max': stats.max if stats.count else None}
+        for q in quantiles:
+            summary[f'p{q * 100:g}'] = digest.quantile(q)
+        return summary
+
+    def to_dict(self, quantiles=QUANTILES, top_repos=TOP_REPOS):
+        """Snapshot of the summary; safe to call mid-run"""
+        top = sorted(self.by_repo.items(), key=lambda item: (-item[1]['prs'], item[0]))[:top_repos]
+        summary = {
+            'prs': self.count,
+            'repos': len(self.by_repo),
+            'metrics': {metric: self.metric_summary(metric, quantiles) for metric in self.metrics},
+            'top_repos': dict(top),
+        }
+        for group, keys in self.groups.items():
+            summary[f'by_{group}'] = dict(sorted(keys.items(), key=lambda item: (-item[1]['prs'], item[0])))
+        return summary
+
+    def state(self):
+        return {
+            'metrics': self.metrics,
+            'group_maps': self.group_maps,
+            'repo_metrics': self.repo_metrics,
+            'compression': self.compression,
+            'count': self.count,
+            'stats': {metric: stats.state() for metric, stats in self.stats.items()},
+            'digests': {metric: digest.state() for metric, digest in self.digests.items()},
+            'by_repo': self.by_repo,
+            'groups': self.groups,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls(state['metrics'], state['group_maps'], state['repo_metrics'], state['compression'])
+        aggregator.count = state['count']
+        aggregator.stats = {metric: RunningStats.from_state(stats) for metric, stats in state['stats'].items()}
+        aggregator.digests = {metric: TDigest.from_state(digest) for metric, digest in state['digests'].items()}
+        aggregator.by_repo = {name: dict(counts) for name, counts in state['by_repo'].items()}
+        aggregator.groups = {group: {key: dict(counts) for key, counts in keys.items()}
+                             for group, keys in state['groups'].items()}
+        return aggregator
@@ -0,0 +1,106 @@
+"""
+V1 ∩ V2 overlap of two sorted repo indexes.
+
+Both indexes are sorted by UTF-8 repo name, so the overlap is a merge join:
+each index is streamed once and only the current record of each is held.
+The join records whether the SHA changed between V1 and V2 and writes the
+overlap to a CSV (repo_name, v1_hash, v2_hash, sha_changed) that later runs
+reuse while it is newer than both indexes. A repo whose SHA is identical in
+both versions cannot have PRs merged between the two snapshots, so
+downstream stages only take the changed ones.
+
+    python overlap_join.py starcoder_v1_repos.csv starcoder_v2_repos.csv [overlapping_repos.csv]
+"""
+import os
+import sys
+import csv
+from repo_index import open_repo_index
+
+OVERLAP_PATH = 'overlapping_repos.csv'
+OVERLAP_FIELDS = ['repo_name', 'v1_hash', 'v2_hash', 'sha_changed']
+
+
+def iter_overlap(repo_v1, repo_v2):
+    """Merge-join two RepoIndexes; yields repo_data dicts in name order"""
+    left, right = repo_v1.iter_raw(), repo_v2.iter_raw()
+    left_record, right_record = next(left, None), next(right, None)
+    # memoryviews only support ==, so compare names as bytes
+    left_name = bytes(left_record[0]) if left_record else None
+    right_name = bytes(right_record[0]) if right_record else None
+    while left_record is not None and right_record is not None:
+        if left_name < right_name:
+            left_record = next(left, None)
+            left_name = bytes(left_record[0]) if left_record else None
+        elif right_name < left_name:
+            right_record = next(right, None)
+            right_name = bytes(right_record[0]) if right_record else None
+        else:
+            v1_sha, v2_sha = left_record[1], right_record[1]
+            yield {
+                'repo_name': left_name.decode('utf-8'),
+                'v1_hash': v1_sha.hex(),
+                'v2_hash': v2_sha.hex(),
+                'sha_changed': v1_sha != v2_sha,
+            }
+            left_record, right_record = next(left, None), next(right, None)
+            left_name = bytes(left_record[0]) if left_record else None
+            right_name = bytes(right_record[0]) if right_record else None
+
+
+def write_overlap(repo_v1, repo_v2, path=OVERLAP_PATH):
+    """Join the indexes into the overlap CSV; returns (overlapping, changed) counts"""
+    overlapping = changed = 0
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(OVERLAP_FIELDS)
+        for repo_data in iter_overlap(repo_v1, repo_v2):
+            overlapping += 1
+            changed += repo_data['sha_changed']
+            writer.writerow([repo_data['repo_name'], repo_data['v1_hash'], repo_data['v2_hash'],
+                             int(repo_data['sha_changed'])])
+    os.replace(path + '.tmp', path)
+    return overlapping, changed
+
+
+def read_overlap(path=OVERLAP_PATH, changed_only=True):
+    """Stream repo_data dicts back from an overlap CSV"""
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            row['sha_changed'] = row['sha_changed'] == '1'
+            if row['sha_changed'] or not changed_only:
+                yield row
+
+
+def count_overlap(path=OVERLAP_PATH, changed_only=True):
+    """Number of repos in an overlap CSV, counted without building their dicts"""
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        rows = csv.reader(csvfile)
+        next(rows, None)
+        return sum(1 for row in rows if row[3] == '1' or not changed_only)
+
+
+def is_current(path, repo_v1, repo_v2):
+    """True if the overlap CSV was written after both indexes"""
+    return os.path.exists(path) and os.path.getmtime(path) >= max(
+        os.path.getmtime(repo_v1.path), os.path.getmtime(repo_v2.path))
+
+
+def overlapping_repos(repo_v1, repo_v2, path=OVERLAP_PATH, changed_only=True):
+    """Overlapping repos of two RepoIndexes, reusing the overlap CSV when it is current.
+
+    With changed_only, repos whose SHA is the same in V1 and V2 are left out.
+    """
+    if is_current(path, repo_v1, repo_v2):
+        print(f"Reusing {path}")
+    else:
+        overlapping, changed = write_overlap(repo_v1, repo_v2, path)
+        print(f"Wrote {overlapping} overlapping repos to {path} ({changed} with a changed SHA)")
+    return read_overlap(path, changed_only)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit("Usage: python overlap_join.py v1_repos.csv v2_repos.csv [overlapping_repos.csv]")
+    with open_repo_index(sys.argv[1]) as v1, open_repo_index(sys.argv[2]) as v2:
+        overlapping, changed = write_overlap(v1, v2, sys.argv[3] if len(sys.argv) == 4 else OVERLAP_PATH)
+    print(f"{overlapping:,} overlapping repos, {changed:,} with a changed SHA")
@@ -0,0 +1,194 @@
+"""
+Fetch the files of a pull request.
+
+The preferred path requests the whole PR once with the
+application/vnd.github.v3.diff media type and splits the unified diff
+into per-file records shaped like the /pulls/{n}/files API (filename,
+status, additions, deletions, patch). When GitHub refuses to render the
+diff because it is too large, or it exceeds MAX_DIFF_BYTES, the
+paginated /files listing is used instead. The diff is streamed and split
+as it arrives, so an oversized one is abandoned at its Content-Length or
+once MAX_DIFF_BYTES have been read, without downloading the rest. Streamed
+diffs are not stored in the HTTP cache. Given the file languages, each
+file's hunks also go through the diff scanner as they arrive, so a diff
+is read, split and scanned in one pass.
+"""
+import re
+import codecs
+import requests
+from pr_enumeration import iter_pages
+from diff_scanner import scan_lines
+
+DIFF_MEDIA_TYPE = 'application/vnd.github.v3.diff'
+MAX_DIFF_BYTES = 20 * 1024 * 1024
+DIFF_CHUNK_BYTES = 64 * 1024  # Read size while streaming a diff
+FILES_PER_PAGE = 100  # /pulls/{n}/files is capped at 100 per page (3000 files total)
+
+DIFF_HEADER = re.compile(r'^diff --git a/(.*) b/(.*)$')
+
+
+class DiffTooLarge(Exception):
+    """The diff body grew past MAX_DIFF_BYTES while it was read"""
+
+
+def unquote_path(path):
+    """Undo git's C-style quoting of unusual file names"""
+    if len(path) >= 2 and path[0] == '"' and path[-1] == '"':
+        return codecs.escape_decode(path[1:-1].encode('utf-8'))[0].decode('utf-8', 'replace')
+    return path
+
+
+def strip_prefix(path, prefix):
+    """Drop the a/ or b/ prefix of a (possibly quoted) diff path"""
+    path = unquote_path(path)
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+def new_file_record(header_line):
+    match = DIFF_HEADER.match(header_line)
+    old_name, new_name = (match.group(1), match.group(2)) if match else ('', '')
+    return {
+        'filename': new_name,
+        'previous_filename': old_name,
+        'status': 'modified',
+        'additions': 0,
+        'deletions': 0,
+        'patch_lines': [],
+    }
+
+
+def finish_file_record(record):
+    record['patch'] = '\n'.join(record.pop('patch_lines'))
+    if not record['filename']:
+        record['filename'] = record['previous_filename']  # Deleted file with a quoted name
+    if record['previous_filename'] == record['filename'] or record['status'] != 'renamed':
+        del record['previous_filename']
+    return record
+
+
+def file_hunk_lines(first, lines, patch_lines, next_header):
+    """Yield one file's hunk lines from the shared diff iterator, keeping them for 'patch'.
+
+    Stops at the next file's diff --git line, which is handed back in next_header.
+    """
+    patch_lines.append(first)
+    yield first
+    for line in lines:
+        if line.startswith('diff --git '):
+            next_header.append(line)
+            return
+        patch_lines.append(line)
+        yield line
+
+
+def split_unified_diff(lines, language_of=None):
+    """Split an iterable of unified diff lines into per-file records.
+
+    Records carry the /files field names; 'patch' holds the hunks from the
+    first @@ line on, as the files API returns it. With language_of
+    (filename -> language), the hunks are scanned while they are split and
+    each record carries the diff_scanner metrics as 'scan'.
+    """
+    lines = iter(lines)
+    record = None
+    in_hunks = False
+    for line in lines:
+        if line.startswith('diff --git '):
+            if record is not None:
+                yield finish_file_record(record)
+            record = new_file_record(line)
+            in_hunks = False
+            continue
+        if record is None:
+            continue
+        if in_hunks:
+            if line.startswith('+'):
+                record['additions'] += 1
+            elif line.startswith('-'):
+                record['deletions'] += 1
+            record['patch_lines'].append(line)
+        elif line.startswith('@@'):
+            if language_of is None:
+                in_hunks = True
+                record['patch_lines'].append(line)
+                continue
+            # Scan the rest of this file straight off the line iterator
+            next_header = []
+            scan = scan_lines(file_hunk_lines(line, lines, record['patch_lines'], next_header),
+                              language_of(record['filename']))
+            record['additions'], record['deletions'] = scan['lines_added'], scan['lines_removed']
+            record['scan'] = scan
+            yield finish_file_record(record)
+            record = new_file_record(next_header[0]) if next_header else None
+        elif line.startswith('new file mode'):
+            record['status'] = 'added'
+        elif line.startswith('deleted file mode'):
+            record['status'] = 'removed'
+        elif line.startswith('rename to '):
+            record['status'] = 'renamed'
+            record['filename'] = unquote_path(line[len('rename to '):])
+        elif line.startswith('copy to '):
+            record['status'] = 'copied'
+        elif line.startswith('--- ') and line != '--- /dev/null':
+            record['previous_filename'] = strip_prefix(line[4:], 'a/')
+        elif line.startswith('+++ ') and line != '+++ /dev/null':
+            record['filename'] = strip_prefix(line[4:], 'b/')
+        elif line.startswith('rename from '):
+            record['previous_filename'] = unquote_path(line[len('rename from '):])
+    if record is not None:
+        yield finish_file_record(record)
+
+
+def iter_response_lines(response, max_bytes=MAX_DIFF_BYTES):
+    """Decode the body line by line as it arrives; only \n ends a line, so CRLF content survives"""
+    pending = b''
+    read = 0
+    for chunk in response.iter_content(DIFF_CHUNK_BYTES):
+        read += len(chunk)
+        if read > max_bytes:
+            raise DiffTooLarge(f"diff exceeds {max_bytes} bytes")
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', 'replace')
+    if pending:
+        yield pending.decode('utf-8', 'replace')
+
+
+def fetch_pr_diff_files(client, repo_name, pr_number, language_of=None):
+    """Fetch a PR as one unified diff; returns None if the diff is unavailable or too large"""
+    response = client.get(f"/repos/{repo_name}/pulls/{pr_number}", headers={'Accept': DIFF_MEDIA_TYPE},
+                          stream=True)
+    with response:
+        # GitHub answers 406 (or 422) when the diff is too large to render
+        if response.status_code in (406, 422):
+            return None
+        response.raise_for_status()
+        if int(response.headers.get('Content-Length', 0)) > MAX_DIFF_BYTES:
+            return None
+        try:
+            return list(split_unified_diff(iter_response_lines(response, MAX_DIFF_BYTES), language_of))
+        except DiffTooLarge:
+            return None
+
+
+def fetch_pr_files_paginated(client, repo_name, pr_number):
+    """Fetch every page of /pulls/{n}/files"""
+    files = []
+    params = {'per_page': FILES_PER_PAGE}
+    for response in iter_pages(client, f"/repos/{repo_name}/pulls/{pr_number}/files", params):
+        files.extend(response.json())
+    return files
+
+
+def fetch_pr_files(client, repo_name, pr_number, mode='diff', language_of=None):
+    """Per-file records for a PR, from the unified diff (scanned with language_of) or the paginated /files listing"""
+    if mode == 'diff':
+        try:
+            files = fetch_pr_diff_files(client, repo_name, pr_number, language_of)
+        except requests.exceptions.HTTPError as e:
+            print(f"Diff unavailable for PR #{pr_number} in {repo_name} ({e}); using /files")
+            files = None
+        if files is not None:
+            return files
+    return fetch_pr_files_paginated(client, repo_name, pr_number)
@@ -0,0 +1,107 @@
+"""
+Enumerate the pull requests merged inside a date window.
+
+'list' mode walks /pulls sorted by most recently updated and stops as soon
+as a page reaches PRs last updated before the window opened: merging a PR
+updates it, so nothing further down can have been merged inside the window.
+
+'search' mode asks the search API for `is:merged merged:start..end`
+directly. Search returns at most 1000 results per query, so windows that
+hit the cap are split in half until every piece fits. Search has its own,
+much smaller rate limit, which is why 'list' is the default.
+"""
+from datetime import datetime, timezone
+
+SEARCH_RESULT_CAP = 1000
+PER_PAGE = 100
+
+
+def parse_github_date(date_string):
+    return datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+
+
+def format_search_date(date):
+    return date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def iter_pages(client, url, params):
+    """Yield the response for every page of a Link-paginated listing"""
+    while url:
+        response = client.get(url, params=params)
+        response.raise_for_status()
+        yield response
+        if 'next' in response.links:
+            url = response.links['next']['url']
+            params = None  # The next link already carries the query
+        else:
+            url = None
+
+
+def iter_merged_prs_list(client, repo_name, v1_date, v2_date):
+    params = {
+        'state': 'closed',
+        'sort': 'updated',
+        'direction': 'desc',
+        'per_page': PER_PAGE
+    }
+    for response in iter_pages(client, f"/repos/{repo_name}/pulls", params):
+        reached_cutoff = False
+        for pr in response.json():
+            if parse_github_date(pr['updated_at']) < v1_date:
+                reached_cutoff = True
+                break
+            if pr['merged_at'] and v1_date < parse_github_date(pr['merged_at']) < v2_date:
+                yield pr
+        if reached_cutoff:
+            return
+
+
+def search_window(client, repo_name, start, end):
+    """Yield search hits merged in [start, end], splitting the window at the result cap"""
+    params = {
+        'q': f"repo:{repo_name} is:pr is:merged "
+             f"merged:{format_search_date(start)}..{format_search_date(end)}",
+        'sort': 'updated',
+        'order': 'desc',
+        'per_page': PER_PAGE
+    }
+    pages = iter_pages(client, '/search/issues', params)
+    first = next(pages)
+    total = first.json().get('total_count', 0)
+    if total > SEARCH_RESULT_CAP and (end - start).total_seconds() > 1:
+        pages.close()
+        middle = start + (end - start) / 2
+        yield from search_window(client, repo_name, start, middle)
+        yield from search_window(client, repo_name, middle, end)
+        return
+
+    yield from first.json().get('items', [])
+    for response in pages:
+        yield from response.json().get('items', [])
+
+
+def iter_merged_prs_search(client, repo_name, v1_date, v2_date):
+    seen = set()
+    for item in search_window(client, repo_name, v1_date, v2_date):
+        merged_at = (item.get('pull_request') or {}).get('merged_at') or item.get('closed_at')
+        if item['number'] in seen or not merged_at:
+            continue
+        # Split windows share their boundary second; keep the strict window of the list mode
+        if not v1_date < parse_github_date(merged_at) < v2_date:
+            continue
+        seen.add(item['number'])
+        item['merged_at'] = merged_at
+        yield item
+
+
+def iter_merged_prs(client, repo_name, v1_date, v2_date, mode='list'):
+    """Yield the PRs of repo_name merged strictly between v1_date and v2_date.
+
+    Items use the /pulls field names (number, title, html_url, body, user,
+    merged_at). Raises requests.exceptions.HTTPError if a page fails.
+    """
+    if mode == 'search':
+        return iter_merged_prs_search(client, repo_name, v1_date, v2_date)
+    if mode == 'list':
+        return iter_merged_prs_list(client, repo_name, v1_date, v2_date)
+    raise ValueError(f"Unknown PR enumeration mode: {mode}")
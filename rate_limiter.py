@@ -0,0 +1,154 @@
+"""
+Header-driven GitHub rate limiting shared by all API callers.
+
+Requests run at full speed while a token has budget left. When every token
+in the pool is out of budget the caller sleeps until the earliest reset
+reported in X-RateLimit-Reset. Secondary (abuse) limits are honoured via
+Retry-After, or with an exponential back-off when GitHub does not send one.
+"""
+import os
+import time
+import threading
+
+SECONDARY_BACKOFF = 60  # seconds; GitHub asks for at least a minute
+MAX_SECONDARY_BACKOFF = 15 * 60
+RESET_SKEW = 1  # seconds added to X-RateLimit-Reset to absorb clock drift
+
+
+def load_tokens():
+    """Read the token pool from GITHUB_TOKENS (comma separated) or GITHUB_TOKEN"""
+    tokens = [t.strip() for t in os.getenv('GITHUB_TOKENS', '').split(',') if t.strip()]
+    if not tokens and os.getenv('GITHUB_TOKEN'):
+        tokens = [os.getenv('GITHUB_TOKEN')]
+    return tokens or [None]
+
+
+def request_resource(path):
+    """Rate-limit bucket a request is charged to"""
+    if path.rstrip('/').endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in path:
+        return 'search'
+    return 'core'
+
+
+class Budget:
+    """Rate-limit state of one token for one resource"""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None  # None until GitHub has told us
+        self.reset = 0.0
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.secondary_hits = 0
+
+    def available(self, now):
+        if now < self.blocked_until:
+            return None
+        if self.remaining is None or now >= self.reset:
+            return float('inf')
+        spare = self.remaining - self.in_flight
+        return spare if spare > 0 else None
+
+    def ready_at(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until
+        return max(self.reset, now)
+
+
+class RateLimiter:
+    """Spreads requests across a pool of tokens using GitHub's rate-limit headers"""
+
+    def __init__(self, tokens=None):
+        self.tokens = list(tokens) if tokens else load_tokens()
+        self._budgets = {}
+        self._cond = threading.Condition()
+        self._next = 0
+        self.used = 0  # requests charged against the primary limit
+        self.waited = 0.0  # seconds spent waiting for budget
+
+    def _budget(self, token, resource):
+        key = (token, resource)
+        if key not in self._budgets:
+            self._budgets[key] = Budget()
+        return self._budgets[key]
+
+    def acquire(self, resource='core'):
+        """Block until some token has budget for resource and return it"""
+        with self._cond:
+            while True:
+                now = time.time()
+                best, best_spare = None, None
+                count = len(self.tokens)
+                for offset in range(count):
+                    token = self.tokens[(self._next + offset) % count]
+                    spare = self._budget(token, resource).available(now)
+                    if spare is not None and (best_spare is None or spare > best_spare):
+                        best, best_spare = token, spare
+                if best_spare is not None:
+                    self._next = (self.tokens.index(best) + 1) % count
+                    self._budget(best, resource).in_flight += 1
+                    return best
+
+                wake = min(self._budget(t, resource).ready_at(now) for t in self.tokens)
+                delay = max(wake - now, 0) + RESET_SKEW
+                print(f"Rate limit reached for {resource}; waiting {delay:.0f}s")
+                self._cond.wait(timeout=delay)
+                self.waited += time.time() - now
+
+    def release(self, token, resource='core'):
+        """Give back a slot taken by acquire when no response was received"""
+        with self._cond:
+            budget = self._budget(token, resource)
+            budget.in_flight = max(budget.in_flight - 1, 0)
+            self._cond.notify_all()
+
+    def update(self, token, resource, response):
+        """Record the rate-limit headers of a response.
+
+        Returns the number of seconds to wait before retrying if the response
+        was rejected by a primary or secondary rate limit, otherwise None.
+        """
+        headers = response.headers
+        now = time.time()
+        with self._cond:
+            budget = self._budget(token, resource)
+            budget.in_flight = max(budget.in_flight - 1, 0)
+            if headers.get('X-RateLimit-Resource'):
+                budget = self._budget(token, headers['X-RateLimit-Resource'])
+            if 'X-RateLimit-Remaining' in headers:
+                budget.remaining = int(headers['X-RateLimit-Remaining'])
+                budget.reset = float(headers.get('X-RateLimit-Reset', 0))
+                budget.limit = int(headers.get('X-RateLimit-Limit', 0)) or budget.limit
+            if response.status_code != 304:
+                self.used += 1
+
+            delay = None
+            if response.status_code in (403, 429):
+                if 'Retry-After' in headers:
+                    delay = float(headers['Retry-After'])
+                elif budget.remaining == 0:
+                    delay = max(budget.reset - now, 0) + RESET_SKEW
+                elif 'secondary rate limit' in response.text.lower():
+                    delay = min(SECONDARY_BACKOFF * 2 ** budget.secondary_hits, MAX_SECONDARY_BACKOFF)
+                if delay is not None:
+                    budget.secondary_hits += 1
+                    budget.blocked_until = max(budget.blocked_until, now + delay)
+                    print(f"GitHub rate limited a request ({response.status_code}); "
+                          f"backing off token for {delay:.0f}s")
+            elif response.ok:
+                budget.secondary_hits = 0
+            self._cond.notify_all()
+            return delay
+
+    def status(self):
+        """Snapshot of the known budgets, keyed by resource"""
+        with self._cond:
+            totals = {}
+            for (token, resource), budget in self._budgets.items():
+                entry = totals.setdefault(resource, {'remaining': 0, 'limit': 0, 'tokens': 0})
+                entry['tokens'] += 1
+                entry['remaining'] += budget.remaining or 0
+                entry['limit'] += budget.limit or 0
+            return totals
@@ -0,0 +1,382 @@
+"""
+Compact, sorted repo -> sha store written by the ingest scripts.
+
+Index file layout (all integers little-endian):
+
+    header   magic 'SCRIDX2\\0', count, offsets_start, names_start, shas_start,
+             stats_start (uint64 each; stats_start is 0 without a stats section)
+    offsets  count + 1 uint64 offsets of each name inside the names blob
+    names    repo names, UTF-8, concatenated in byte order
+    shas     count * 20 raw SHA-1 bytes, in the same order
+    stats    optional, count * 3 int32: stars, forks, issues (-1 if unknown)
+
+Indexes in the older 'SCRIDX1' layout (no stats_start) are still readable.
+
+Building it is an external sort. Every shard (or chunk of streamed rows) is
+deduped in memory and written as a sorted run file. The runs are then
+merged with heapq.merge, so only one record per run is held at a time.
+Runs are given in dataset order, and when a repo appears with several SHAs
+the one from the latest run wins, the same rule as the last-row-wins dict
+in dataset_loading.py.
+
+RepoIndex memory-maps an index: opening it only parses the header, lookups
+are a binary search over the sorted names, and iteration slices the map
+without building a dict. Existing CSVs are converted with
+
+    python repo_index.py starcoder_v1_repos.csv [starcoder_v1_repos.idx]
+"""
+import os
+import sys
+import csv
+import mmap
+import heapq
+import struct
+import shutil
+import tempfile
+from array import array
+from itertools import groupby
+
+MAGIC = b'SCRIDX2\0'
+HEADER = struct.Struct('<8s5Q')
+MAGIC_V1 = b'SCRIDX1\0'
+HEADER_V1 = struct.Struct('<8s4Q')
+SHA_BYTES = 20
+STATS = struct.Struct('<3i')  # stars, forks, issues
+UNKNOWN_STATS = STATS.pack(-1, -1, -1)
+RUN_NAME_LENGTH = struct.Struct('<H')
+RUN_FORMAT = 'r2'  # Bumped whenever the run record layout changes, so old runs are not reused
+CSV_CHUNK_REPOS = 5_000_000  # Repos deduped in memory per run when converting a CSV
+MERGE_FAN_IN = 256  # Runs merged at once; keeps open files under the usual 1024 limit
+IO_BUFFER = 1024 * 1024
+
+
+def sha_to_bytes(sha):
+    """40-char hex SHA to 20 raw bytes, or None if it is not a SHA-1"""
+    try:
+        raw = bytes.fromhex(sha)
+    except (TypeError, ValueError):
+        return None
+    return raw if len(raw) == SHA_BYTES else None
+
+
+def sha_to_hex(raw):
+    return raw.hex()
+
+
+def pack_stats(stars=None, forks=None, issues=None):
+    return STATS.pack(*(-1 if value is None else min(int(value), 2 ** 31 - 1) for value in (stars, forks, issues)))
+
+
+def write_run_records(f, records):
+    for name, raw, stats in records:
+        f.write(RUN_NAME_LENGTH.pack(len(name)))
+        f.write(name)
+        f.write(raw)
+        f.write(stats)
+
+
+def write_run(path, repos, stats=None):
+    """Write a repo -> sha dict as a run file sorted by UTF-8 repo name; returns the record count.
+
+    stats optionally maps repos to (stars, forks, issues). Values that are
+    not SHA-1 hex strings are dropped.
+    """
+    records = []
+    for repo_name, sha in repos.items():
+        raw = sha_to_bytes(sha)
+        if repo_name and raw is not None:
+            repo_stats = stats.get(repo_name) if stats else None
+            records.append((repo_name.encode('utf-8'), raw,
+                            pack_stats(*repo_stats) if repo_stats else UNKNOWN_STATS))
+    records.sort()
+    with open(path, 'wb', buffering=IO_BUFFER) as f:
+        write_run_records(f, records)
+    return len(records)
+
+
+def iter_run(path):
+    """Yield (name bytes, sha bytes, packed stats) from a run file in sorted order"""
+    with open(path, 'rb', buffering=IO_BUFFER) as f:
+        while True:
+            length = f.read(RUN_NAME_LENGTH.size)
+            if not length:
+                return
+            name = f.read(RUN_NAME_LENGTH.unpack(length)[0])
+            yield name, f.read(SHA_BYTES), f.read(STATS.size)
+
+
+def iter_tagged_run(path, order):
+    for name, raw, stats in iter_run(path):
+        yield name, order, raw, stats
+
+
+def merge_sorted_runs(run_paths):
+    """Merge runs into one sorted (name, sha, stats) stream; the last run holding a repo wins"""
+    merged = heapq.merge(*(iter_tagged_run(path, order) for order, path in enumerate(run_paths)))
+    for name, group in groupby(merged, key=lambda record: record[0]):
+        for record in group:
+            pass
+        yield name, record[2], record[3]
+
+
+def merge_runs(run_paths, fan_in=MERGE_FAN_IN, temp_dir=None):
+    """Merge any number of runs, in passes of at most fan_in open files.
+
+    Intermediate runs merge consecutive groups of runs, so dataset order and
+    therefore the last-run-wins rule survive every pass.
+    """
+    run_paths = list(run_paths)
+    work_dir = None
+    merge_pass = 0
+    try:
+        while len(run_paths) > fan_in:
+            if work_dir is None:
+                work_dir = tempfile.mkdtemp(prefix='repo_index_merge_', dir=temp_dir)
+            merge_pass += 1
+            merged_paths = []
+            for start in range(0, len(run_paths), fan_in):
+                path = os.path.join(work_dir, f'pass{merge_pass}_{len(merged_paths):06d}.run')
+                with open(path, 'wb', buffering=IO_BUFFER) as f:
+                    write_run_records(f, merge_sorted_runs(run_paths[start:start + fan_in]))
+                merged_paths.append(path)
+            if merge_pass > 1:
+                for path in run_paths:
+                    os.remove(path)  # Intermediate runs of the previous pass
+            run_paths = merged_paths
+        yield from merge_sorted_runs(run_paths)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class RepoIndexWriter:
+    """Stream sorted (name bytes, sha bytes[, packed stats]) records into an index file.
+
+    Names, SHAs and stats are spooled to side files while records arrive, so
+    memory stays bounded; close() assembles the final file. The stats section
+    is only written if some record had known stats.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._last = None
+        self._tmp_path = path + '.tmp'
+        self._names = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self._shas = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self._offsets = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self._stats = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self.has_stats = False
+        self._offset_buffer = array('Q', [0])
+        self._names_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, name, raw_sha, stats=UNKNOWN_STATS):
+        if self._last is not None and name <= self._last:
+            raise ValueError(f"Index records must be strictly sorted: {name!r} after {self._last!r}")
+        if len(raw_sha) != SHA_BYTES:
+            raise ValueError(f"Expected a {SHA_BYTES}-byte SHA for {name!r}")
+        self._last = name
+        self._names.write(name)
+        self._shas.write(raw_sha)
+        self._stats.write(stats)
+        if stats != UNKNOWN_STATS:
+            self.has_stats = True
+        self._names_size += len(name)
+        self._offset_buffer.append(self._names_size)
+        self.count += 1
+        if len(self._offset_buffer) >= 65536:
+            self._flush_offsets()
+
+    def _flush_offsets(self):
+        if sys.byteorder != 'little':
+            self._offset_buffer.byteswap()
+        self._offset_buffer.tofile(self._offsets)
+        self._offset_buffer = array('Q')
+
+    def close(self):
+        """Write the index to a temporary name and move it into place"""
+        self._flush_offsets()
+        offsets_start = HEADER.size
+        names_start = offsets_start + (self.count + 1) * 8
+        shas_start = names_start + self._names_size
+        stats_start = shas_start + self.count * SHA_BYTES if self.has_stats else 0
+        spools = [self._offsets, self._names, self._shas] + ([self._stats] if self.has_stats else [])
+        with open(self._tmp_path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, self.count, offsets_start, names_start, shas_start, stats_start))
+            for spool in spools:
+                spool.seek(0)
+                shutil.copyfileobj(spool, out, IO_BUFFER)
+        for spool in (self._offsets, self._names, self._shas, self._stats):
+            spool.close()
+        os.replace(self._tmp_path, self.path)
+        return self.count
+
+    def abort(self):
+        for spool in (self._offsets, self._names, self._shas, self._stats):
+            spool.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class RepoIndex:
+    """Read-only, memory-mapped view of an index file.
+
+    Behaves like a read-only dict of repo name -> hex SHA: `in`, [], get(),
+    len(), iteration over names and items(), all in sorted name order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._mm[:len(MAGIC)]
+        if magic == MAGIC:
+            _, self.count, offsets_start, self._names_start, self._shas_start, self._stats_start = \
+                HEADER.unpack_from(self._mm)
+        elif magic == MAGIC_V1:
+            _, self.count, offsets_start, self._names_start, self._shas_start = HEADER_V1.unpack_from(self._mm)
+            self._stats_start = 0
+        else:
+            self._mm.close()
+            raise ValueError(f"{path} is not a repo index")
+        self.has_stats = self._stats_start != 0
+        self._view = memoryview(self._mm)
+        offsets = self._view[offsets_start:self._names_start]
+        if sys.byteorder == 'little':
+            self._offsets = offsets.cast('Q')
+        else:
+            self._offsets = array('Q', offsets)
+            self._offsets.byteswap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def name_bytes(self, i):
+        return self._mm[self._names_start + self._offsets[i]:self._names_start + self._offsets[i + 1]]
+
+    def raw_sha(self, i):
+        start = self._shas_start + i * SHA_BYTES
+        return self._mm[start:start + SHA_BYTES]
+
+    def stats_at(self, i):
+        """(stars, forks, issues) at position i, each None if unknown; None without stats"""
+        if not self.has_stats:
+            return None
+        return tuple(None if value < 0 else value
+                     for value in STATS.unpack_from(self._mm, self._stats_start + i * STATS.size))
+
+    def get_stats(self, repo_name):
+        """(stars, forks, issues) of a repo, or None if it or the stats section is missing"""
+        i = self.find(repo_name)
+        return None if i < 0 else self.stats_at(i)
+
+    def find(self, repo_name):
+        """Position of repo_name in the index, or -1; O(log n)"""
+        key = repo_name.encode('utf-8') if isinstance(repo_name, str) else repo_name
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.name_bytes(lo) == key:
+            return lo
+        return -1
+
+    def get(self, repo_name, default=None):
+        i = self.find(repo_name)
+        return default if i < 0 else sha_to_hex(self.raw_sha(i))
+
+    def __contains__(self, repo_name):
+        return self.find(repo_name) >= 0
+
+    def __getitem__(self, repo_name):
+        i = self.find(repo_name)
+        if i < 0:
+            raise KeyError(repo_name)
+        return sha_to_hex(self.raw_sha(i))
+
+    def iter_raw(self):
+        """Yield (name, sha) as memoryview slices of the map, without copying"""
+        view, offsets = self._view, self._offsets
+        names_start, sha = self._names_start, self._shas_start
+        for i in range(self.count):
+            yield view[names_start + offsets[i]:names_start + offsets[i + 1]], view[sha:sha + SHA_BYTES]
+            sha += SHA_BYTES
+
+    def __iter__(self):
+        for name, _ in self.iter_raw():
+            yield str(name, 'utf-8')
+
+    def items(self):
+        for name, raw in self.iter_raw():
+            yield str(name, 'utf-8'), raw.hex()
+
+    def close(self):
+        # Views into the map must be released before it can be closed
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._view.release()
+        self._mm.close()
+
+
+def convert_csv(csv_path, index_path, chunk_repos=CSV_CHUNK_REPOS, temp_dir=None):
+    """Build an index from a repo_name,commit_hash CSV; the last row of a repo wins"""
+    run_dir = tempfile.mkdtemp(prefix='repo_index_runs_', dir=temp_dir)
+    run_paths = []
+    chunk = {}
+    try:
+        with open(csv_path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                chunk[row['repo_name'].strip()] = row['commit_hash'].strip()
+                if len(chunk) >= chunk_repos:
+                    run_paths.append(os.path.join(run_dir, f'{len(run_paths):06d}.run'))
+                    write_run(run_paths[-1], chunk)
+                    chunk = {}
+        if chunk:
+            run_paths.append(os.path.join(run_dir, f'{len(run_paths):06d}.run'))
+            write_run(run_paths[-1], chunk)
+        with RepoIndexWriter(index_path) as index:
+            for name, raw_sha, stats in merge_runs(run_paths, temp_dir=temp_dir):
+                index.add(name, raw_sha, stats)
+        return index.count
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def index_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + '.idx'
+
+
+def open_repo_index(csv_path):
+    """Open the index next to a repos CSV, converting the CSV first if the index is missing or older"""
+    index_path = index_path_for(csv_path)
+    if not os.path.exists(index_path) or (os.path.exists(csv_path) and
+                                          os.path.getmtime(index_path) < os.path.getmtime(csv_path)):
+        print(f"Converting {csv_path} to {index_path}...")
+        convert_csv(csv_path, index_path)
+    return RepoIndex(index_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit("Usage: python repo_index.py repos.csv [repos.idx]")
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) == 3 else index_path_for(source)
+    print(f"Wrote {convert_csv(source, target):,} repos to {target}")
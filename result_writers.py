@@ -0,0 +1,202 @@
+"""
+Streaming writers for the per-PR analysis records.
+
+Records are written as they are produced instead of being collected for
+one big write at the end, so memory stays flat however long the run. The
+CSV writer keeps the original layout, with languages_changed and
+change_types JSON-encoded. The Parquet writer buffers ROW_GROUP_SIZE
+records and flushes each batch as a row group. It stores the two maps as
+map<string, int64> columns and the dates as UTC timestamps, so readers can
+load just the columns they need:
+
+    pq.read_table('code_changes_analysis.parquet', columns=['repo_name', 'languages_changed'])
+
+Both write to a temporary name and move the file into place on close. A
+resumed run rewrites the outputs by replaying the checkpointed records of
+finished repos.
+"""
+import os
+import csv
+import json
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROW_GROUP_SIZE = 10000  # Records per Parquet row group / CSV flush
+MAP_FIELDS = ('languages_changed', 'change_types')
+DATE_FIELDS = ('v1_date', 'v2_date', 'merge_date')
+
+ANALYSIS_SCHEMA = pa.schema([
+    ('repo_name', pa.string()),
+    ('v1_commit', pa.string()),
+    ('v2_commit', pa.string()),
+    ('v1_date', pa.timestamp('us', tz='UTC')),
+    ('v2_date', pa.timestamp('us', tz='UTC')),
+    ('pr_number', pa.int64()),
+    ('pr_title', pa.string()),
+    ('pr_url', pa.string()),
+    ('merge_date', pa.timestamp('us', tz='UTC')),
+    ('author', pa.string()),
+    ('files_changed', pa.int64()),
+    ('api_additions', pa.int64()),
+    ('api_deletions', pa.int64()),
+    ('files_added', pa.int64()),
+    ('files_modified', pa.int64()),
+    ('files_deleted', pa.int64()),
+    ('total_lines_added', pa.int64()),
+    ('total_lines_removed', pa.int64()),
+    ('code_additions', pa.int64()),
+    ('code_deletions', pa.int64()),
+    ('comment_additions', pa.int64()),
+    ('comment_deletions', pa.int64()),
+    ('languages_changed', pa.map_(pa.string(), pa.int64())),
+    ('change_types', pa.map_(pa.string(), pa.int64())),
+    ('imports_added', pa.int64()),
+    ('functions_added', pa.int64()),
+    ('classes_added', pa.int64()),
+    ('test_changes', pa.int64()),
+])
+ANALYSIS_FIELDS = ANALYSIS_SCHEMA.names
+
+
+def record_map(value):
+    """A map field as a dict; records checkpointed by older runs hold JSON strings"""
+    if isinstance(value, str):
+        return json.loads(value) if value else {}
+    return dict(value or {})
+
+
+class ResultWriter:
+    """Write records to a temporary name and move the file into place on close"""
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._tmp_path = path + '.tmp'
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, record):
+        self._buffer.append(record)
+        self.count += 1
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._close_file()
+        os.replace(self._tmp_path, self.path)
+        return self.count
+
+    def abort(self):
+        self._buffer = []
+        self._close_file()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class CsvResultWriter(ResultWriter):
+    """The original CSV layout, map fields JSON-encoded"""
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE, fieldnames=ANALYSIS_FIELDS):
+        super().__init__(path, row_group_size)
+        self._file = open(self._tmp_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        self._writer.writeheader()
+
+    def _write_batch(self, records):
+        self._writer.writerows(
+            dict(record, **{field: json.dumps(record_map(record.get(field))) for field in MAP_FIELDS})
+            for record in records
+        )
+        self._file.flush()
+
+    def _close_file(self):
+        self._file.close()
+
+
+class ParquetResultWriter(ResultWriter):
+    """Typed columns, one row group per ROW_GROUP_SIZE records"""
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE, schema=ANALYSIS_SCHEMA):
+        super().__init__(path, row_group_size)
+        self.schema = schema
+        self._writer = pq.ParquetWriter(self._tmp_path, schema)
+
+    def _write_batch(self, records):
+        rows = []
+        for record in records:
+            row = dict(record)
+            for field in MAP_FIELDS:
+                row[field] = record_map(record.get(field))
+            for field in DATE_FIELDS:
+                if isinstance(row.get(field), str):
+                    row[field] = datetime.fromisoformat(row[field].replace('Z', '+00:00'))
+            rows.append(row)
+        self._writer.write_table(pa.Table.from_pylist(rows, schema=self.schema),
+                                 row_group_size=self.row_group_size)
+
+    def _close_file(self):
+        self._writer.close()
+
+
+WRITERS = {'csv': CsvResultWriter, 'parquet': ParquetResultWriter}
+
+
+class ResultWriters:
+    """Fan records out to one writer per output format"""
+
+    def __init__(self, path_stem, formats, row_group_size=ROW_GROUP_SIZE):
+        unknown = [output_format for output_format in formats if output_format not in WRITERS]
+        if unknown:
+            raise ValueError(f"Unknown output formats {unknown}; expected some of {sorted(WRITERS)}")
+        self.writers = [WRITERS[output_format](f'{path_stem}.{output_format}', row_group_size)
+                        for output_format in formats]
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self.writers]
+
+    @property
+    def count(self):
+        return self.writers[0].count if self.writers else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_many(self, records):
+        for writer in self.writers:
+            writer.write_many(records)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        return self.count
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
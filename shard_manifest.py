@@ -0,0 +1,92 @@
+"""
+Manifest of processed Parquet shards for incremental dataset refreshes.
+
+Every shard the ingest processes is recorded with its identity (path,
+size and fingerprint: the LFS sha256 on the Hub, the mtime for a local
+mirror) and the sorted run file it produced. A rerun only reprocesses
+shards that are new or whose identity changed, drops runs of shards that
+disappeared, and re-merges. Shards are recorded as they finish, so an
+interrupted run resumes where it stopped. Runs live under the state
+directory next to the manifest; delete that directory to start from scratch.
+"""
+import os
+import glob
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+class ShardManifest:
+    """SQLite record of processed shards and their run files"""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(state_dir, 'manifest.sqlite'), check_same_thread=False,
+                                     timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS shards (
+                dataset TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                run_path TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                repos INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (dataset, variant, path)
+            )''')
+        self._conn.commit()
+
+    def run_path(self, dataset, variant, shard_path):
+        """Stable run file location of a shard; variant separates differently filtered runs"""
+        slug = hashlib.sha1(f'{dataset}\0{variant}'.encode('utf-8')).hexdigest()[:12]
+        run_dir = os.path.join(self.state_dir, 'runs', slug)
+        os.makedirs(run_dir, exist_ok=True)
+        return os.path.join(run_dir, hashlib.sha1(shard_path.encode('utf-8')).hexdigest()[:20] + '.run')
+
+    def is_current(self, dataset, variant, shard):
+        """True if the shard was processed with the same identity and its run file is still there"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, fingerprint, run_path FROM shards WHERE dataset = ? AND variant = ? AND path = ?',
+                (dataset, variant, shard['path'])).fetchone()
+        return (row is not None and row[0] == shard['size'] and row[1] == shard['fingerprint']
+                and os.path.exists(row[2]))
+
+    def record(self, dataset, variant, shard, run_path, rows, repos):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (dataset, variant, shard['path'], shard['size'], shard['fingerprint'],
+                                run_path, rows, repos, time.time()))
+            self._conn.commit()
+
+    def prune(self, dataset, variant, shard_paths):
+        """Forget shards no longer in the dataset and delete their runs; returns how many.
+
+        Runs of an older variant of the same kind (e.g. overlap runs filtered
+        against a previous V1 index) are dropped as well.
+        """
+        keep = set(shard_paths)
+        kind = variant.split(':')[0]
+        with self._lock:
+            stale = [(row_variant, path, run_path) for row_variant, path, run_path in self._conn.execute(
+                'SELECT variant, path, run_path FROM shards WHERE dataset = ?', (dataset,))
+                     if (row_variant == variant and path not in keep)
+                     or (row_variant != variant and row_variant.split(':')[0] == kind)]
+            self._conn.executemany('DELETE FROM shards WHERE dataset = ? AND variant = ? AND path = ?',
+                                   [(dataset, row_variant, path) for row_variant, path, _ in stale])
+            self._conn.commit()
+        for _, _, run_path in stale:
+            # The run and any per-shard sidecars written next to it
+            for path in glob.glob(glob.escape(run_path) + '*'):
+                os.remove(path)
+        return sum(row_variant == variant for row_variant, _, _ in stale)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
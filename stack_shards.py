@@ -0,0 +1,217 @@
+"""
+Column-projected reading of The Stack V1/V2 Parquet shards.
+
+The ingest scripts only need the repo name and commit hash of each row,
+but streaming rows through `datasets` downloads and decodes the whole
+`content` column. Reading the Parquet shards directly with pyarrow and a
+column projection only fetches the column chunks that are asked for.
+Shards are read from the Hugging Face Hub through HfFileSystem (ranged
+reads), or from a local mirror of the dataset repository when a
+directory is given, so offline rebuilds work the same way.
+"""
+import os
+import glob
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from repo_index import write_run
+from language_index import batch_languages, write_languages
+from bloom_filter import BloomFilter, bloom_path_for
+
+BATCH_SIZE = 65536  # rows per record batch
+
+_blooms = {}  # V1 index path -> Bloom filter, loaded once per worker process
+
+V1_DATASET = {
+    'name': 'bigcode/the-stack-dedup',
+    'config': None,
+    'repo_key': 'max_stars_repo_name',
+    'hash_key': 'max_stars_repo_head_hexsha',
+    'lang_key': 'lang',
+    'size_key': 'size',
+    # Popularity kept in the repo index: stars, forks, issues of the max-stars repo
+    'stats_keys': ('max_stars_count', 'max_forks_count', 'max_issues_count'),
+    'local_dir_env': 'STACK_V1_DIR',
+}
+V2_DATASET = {
+    'name': 'bigcode/the-stack-v2-dedup',
+    'config': 'default',
+    'repo_key': 'repo_name',
+    'hash_key': 'revision_id',
+    'lang_key': 'language',
+    'size_key': 'length_bytes',
+    'stats_keys': None,  # V2 only has GH Archive star/fork events, not counts
+    'local_dir_env': 'STACK_V2_DIR',
+}
+
+
+def hub_filesystem():
+    from huggingface_hub import HfFileSystem
+    return HfFileSystem(token=os.getenv('HF_TOKEN'))
+
+
+def local_dir_for(dataset):
+    """Local mirror of a dataset from its environment variable, if set"""
+    return os.getenv(dataset['local_dir_env']) or None
+
+
+def list_shards(dataset_name, local_dir=None):
+    """Sorted Parquet shard paths of a dataset, local or on the Hub"""
+    return [shard['path'] for shard in list_shard_infos(dataset_name, local_dir)]
+
+
+def list_shard_infos(dataset_name, local_dir=None):
+    """Sorted shards with their identity: path, size and a content fingerprint.
+
+    On the Hub the fingerprint is the LFS sha256 (or the git blob id), so it
+    changes exactly when the shard content does; locally it is the mtime.
+    """
+    if local_dir:
+        shards = []
+        for path in sorted(glob.glob(os.path.join(local_dir, '**', '*.parquet'), recursive=True)):
+            stat = os.stat(path)
+            shards.append({'path': path, 'size': stat.st_size, 'fingerprint': f'mtime:{stat.st_mtime_ns}'})
+        return shards
+    fs = hub_filesystem()
+    infos = fs.glob(f'datasets/{dataset_name}/data/**/*.parquet', detail=True)
+    return [{'path': path, 'size': info.get('size', 0),
+             'fingerprint': (info.get('lfs') or {}).get('sha256') or info.get('blob_id') or ''}
+            for path, info in sorted(infos.items())]
+
+
+def open_shard(path, local_dir=None):
+    if local_dir:
+        return open(path, 'rb')
+    return hub_filesystem().open(path, 'rb', block_size=8 * 1024 * 1024)
+
+
+def iter_shard_batches(path, columns, local_dir=None, batch_size=BATCH_SIZE):
+    """Yield pyarrow RecordBatches holding only the projected columns of one shard"""
+    with open_shard(path, local_dir) as f:
+        parquet_file = pq.ParquetFile(f)
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def iter_shard_repo_rows(path, repo_key, hash_key, local_dir=None, stats_keys=None):
+    """Yield lists of (repo_name, commit_hash) tuples, one list per batch.
+
+    With stats_keys, the tuples are (repo_name, commit_hash, stats) with a
+    tuple of those columns' values as stats.
+    """
+    columns = [repo_key, hash_key] + list(stats_keys or ())
+    for batch in iter_shard_batches(path, columns, local_dir):
+        pairs = zip(batch.column(repo_key).to_pylist(), batch.column(hash_key).to_pylist())
+        if stats_keys:
+            stats = zip(*(batch.column(key).to_pylist() for key in stats_keys))
+            yield [(name, sha, repo_stats) for (name, sha), repo_stats in zip(pairs, stats)]
+        else:
+            yield list(pairs)
+
+
+def read_shard(path, dataset, local_dir=None, languages=False):
+    """Dedupe one shard into a repo -> sha dict; the last row of a repo wins.
+
+    The dataset's popularity columns (if any) are kept per repo the same
+    way. With languages, the language and size columns are read as well and
+    per-(repo, language) byte sums are collected. Returns (repos, stats,
+    rows read, list of partial language tables).
+    """
+    repo_key, hash_key, stats_keys = dataset['repo_key'], dataset['hash_key'], dataset.get('stats_keys')
+    columns = [repo_key, hash_key]
+    if stats_keys:
+        columns += list(stats_keys)
+    if languages:
+        columns += [dataset['lang_key'], dataset['size_key']]
+    repos = {}
+    stats = {}
+    rows = 0
+    histograms = []
+    for batch in iter_shard_batches(path, columns, local_dir):
+        names = batch.column(repo_key).to_pylist()
+        repos.update(zip(names, batch.column(hash_key).to_pylist()))
+        if stats_keys:
+            stats.update(zip(names, zip(*(batch.column(key).to_pylist() for key in stats_keys))))
+        rows += batch.num_rows
+        if languages:
+            histograms.append(batch_languages(batch, repo_key, dataset['lang_key'], dataset['size_key']))
+    return repos, stats, rows, histograms
+
+
+def write_shard_run(path, dataset, local_dir, run_path, languages_path=None):
+    """Dedupe one shard and write it as a sorted run file; runs in worker processes.
+
+    The last row of a repo wins, as in dataset_loading.py. With
+    languages_path, the shard's language histogram is written there too.
+    Returns (path, rows read, repos written, seconds).
+    """
+    start = time.monotonic()
+    repos, stats, rows, histograms = read_shard(path, dataset, local_dir, languages_path is not None)
+    if languages_path is not None:
+        write_languages(languages_path, histograms)
+    return path, rows, write_run(run_path, repos, stats), time.monotonic() - start
+
+
+def load_bloom(index_path):
+    """The saved Bloom filter of the V1 index, cached per process"""
+    if index_path not in _blooms:
+        _blooms[index_path] = BloomFilter.load(bloom_path_for(index_path))
+    return _blooms[index_path]
+
+
+def filter_overlap(repos, bloom):
+    """Keep the repos of a repo -> sha dict that may be in V1.
+
+    False positives (about 1%) are dropped later by the exact merge join
+    against the V1 index.
+    """
+    return {name: sha for name, sha in repos.items() if name in bloom}
+
+
+def write_shard_overlap_run(path, dataset, local_dir, run_path, index_path, languages_path=None):
+    """Like write_shard_run, but only keeps repos that pass the Bloom filter of the V1 index at index_path"""
+    start = time.monotonic()
+    repos, stats, rows, histograms = read_shard(path, dataset, local_dir, languages_path is not None)
+    overlap = filter_overlap(repos, load_bloom(index_path))
+    if languages_path is not None:
+        kept = pa.array(list(overlap), pa.string())
+        write_languages(languages_path, [table.filter(pc.is_in(table['repo_name'], value_set=kept))
+                                         for table in histograms])
+    return path, rows, write_run(run_path, overlap, stats), time.monotonic() - start
+
+
+def iter_datasets_repo_rows(dataset_name, repo_key, hash_key, config=None, stats_keys=None):
+    """Fallback through `datasets` streaming, projected with select_columns"""
+    from datasets import load_dataset
+    if config:
+        dataset = load_dataset(dataset_name, config, streaming=True)
+    else:
+        dataset = load_dataset(dataset_name, streaming=True)
+    batch = []
+    for row in dataset['train'].select_columns([repo_key, hash_key] + list(stats_keys or ())):
+        if stats_keys:
+            batch.append((row[repo_key], row[hash_key], tuple(row[key] for key in stats_keys)))
+        else:
+            batch.append((row[repo_key], row[hash_key]))
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_repo_rows(dataset, local_dir=None, mode='parquet', stats=False):
+    """Yield batches of (repo_name, commit_hash) for every row of a dataset, in shard order.
+
+    mode 'parquet' reads the shards with column projection; 'datasets'
+    streams through the datasets library with select_columns. With stats,
+    rows of a dataset with popularity columns carry them as a third item.
+    """
+    stats_keys = dataset.get('stats_keys') if stats else None
+    if mode == 'datasets':
+        yield from iter_datasets_repo_rows(dataset['name'], dataset['repo_key'], dataset['hash_key'],
+                                           dataset['config'], stats_keys)
+        return
+    local_dir = local_dir or local_dir_for(dataset)
+    for path in list_shards(dataset['name'], local_dir):
+        yield from iter_shard_repo_rows(path, dataset['repo_key'], dataset['hash_key'], local_dir, stats_keys)
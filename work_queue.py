@@ -0,0 +1,214 @@
+"""
+Durable lease queue for spreading repos over many worker processes and hosts.
+
+The queue is one SQLite file, e.g. on storage every worker can reach. It
+is filled once with the overlapping repos in order. Each worker then
+repeatedly leases a batch, processes it, and completes each repo with its
+records. A lease lasts LEASE_SECONDS and is renewed by the worker's
+heartbeat while it is busy. If a worker dies, its leases expire and the
+repos go to whichever worker asks next. A repo is given out at most
+MAX_ATTEMPTS times before it is marked failed.
+
+A completion is only accepted from the worker that still holds the lease,
+so a repo reassigned after an expiry is recorded once even if the old
+worker finishes it late. The records stay in the queue until the merge
+step streams them out in the original repo order.
+
+Workers also register here and get a token slot each. With N tokens in
+GITHUB_TOKENS, the first N live workers get different tokens, so every
+worker has its own rate-limit budget.
+
+The file uses SQLite's default rollback journal rather than WAL, because
+WAL needs shared memory and so does not work across hosts. Every write is
+a short BEGIN IMMEDIATE transaction.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+LEASE_SECONDS = 600  # How long a worker owns a leased repo without a heartbeat
+MAX_ATTEMPTS = 3  # Leases per repo before it is marked failed
+RESULT_PAGE = 500  # Results fetched per query when merging
+
+
+def default_worker_id():
+    """Unique per process on shared storage: host name plus pid"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue:
+    """SQLite table of tasks leased to workers, plus the worker registry"""
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Autocommit, so that every write below runs in its own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, position)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    host TEXT,
+                    token_slot INTEGER,
+                    started_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL,
+                    finished_at REAL,
+                    completed INTEGER NOT NULL DEFAULT 0
+                )''')
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def enqueue(self, tasks):
+        """Add (task_id, payload) pairs after the existing ones; known task ids are left alone"""
+        with self._transaction() as conn:
+            position = conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM tasks').fetchone()[0]
+            added = 0
+            for task_id, payload in tasks:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO tasks (task_id, position, payload, state, updated_at) "
+                    "VALUES (?, ?, ?, 'pending', ?)",
+                    (task_id, position, json.dumps(payload), time.time()))
+                if cursor.rowcount:
+                    position += 1
+                    added += 1
+        return added
+
+    def register(self, worker_id, token_slots=1):
+        """Register a worker and give it the token slot with the fewest live workers"""
+        now = time.time()
+        with self._transaction() as conn:
+            live = [row[0] for row in conn.execute(
+                'SELECT token_slot FROM workers WHERE finished_at IS NULL AND heartbeat_at > ? '
+                'AND worker_id != ?', (now - self.lease_seconds, worker_id))]
+            slot = min(range(token_slots), key=lambda index: (live.count(index), index))
+            conn.execute('INSERT OR REPLACE INTO workers (worker_id, host, token_slot, started_at, heartbeat_at) '
+                         'VALUES (?, ?, ?, ?, ?)', (worker_id, socket.gethostname(), slot, now, now))
+        return slot
+
+    def lease(self, worker_id, count):
+        """Lease up to count pending or expired tasks, in queue order; returns [(task_id, payload)]"""
+        now = time.time()
+        with self._transaction() as conn:
+            # Expired leases that used up their attempts are not handed out again
+            conn.execute("UPDATE tasks SET state = 'failed', error = 'lease expired', worker_id = NULL, "
+                         "updated_at = ? WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            rows = conn.execute(
+                "SELECT task_id, payload FROM tasks WHERE state = 'pending' "
+                "OR (state = 'leased' AND lease_expires < ?) ORDER BY position LIMIT ?",
+                (now, count)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+                [(worker_id, now + self.lease_seconds, now, task_id) for task_id, _ in rows])
+            conn.execute('UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?', (now, worker_id))
+        return [(task_id, json.loads(payload)) for task_id, payload in rows]
+
+    def heartbeat(self, worker_id):
+        """Extend every lease the worker holds; returns how many it holds"""
+        now = time.time()
+        with self._transaction() as conn:
+            held = conn.execute("UPDATE tasks SET lease_expires = ? WHERE state = 'leased' AND worker_id = ?",
+                                (now + self.lease_seconds, worker_id)).rowcount
+            conn.execute('UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?', (now, worker_id))
+        return held
+
+    def complete(self, worker_id, task_id, result=None, state='done'):
+        """Store a task's result; False if the worker lost the lease to another worker"""
+        with self._transaction() as conn:
+            accepted = conn.execute(
+                "UPDATE tasks SET state = ?, result = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE task_id = ? AND state = 'leased' AND worker_id = ?",
+                (state, json.dumps(result) if result is not None else None, time.time(),
+                 task_id, worker_id)).rowcount == 1
+            if accepted:
+                conn.execute('UPDATE workers SET completed = completed + 1 WHERE worker_id = ?', (worker_id,))
+        return accepted
+
+    def fail(self, worker_id, task_id, error):
+        """Give a task back for a retry, or mark it failed once it used up its attempts"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker_id = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE task_id = ? AND state = 'leased' AND worker_id = ?",
+                (self.max_attempts, str(error), time.time(), task_id, worker_id))
+
+    def release(self, worker_id):
+        """Return the worker's leases unused (e.g. on Ctrl-C) and mark it finished"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE tasks SET state = 'pending', worker_id = NULL, lease_expires = NULL, "
+                         "attempts = attempts - 1, updated_at = ? WHERE state = 'leased' AND worker_id = ?",
+                         (now, worker_id))
+            conn.execute('UPDATE workers SET finished_at = ?, heartbeat_at = ? WHERE worker_id = ?',
+                         (now, now, worker_id))
+
+    def counts(self):
+        """Number of tasks in each state"""
+        with self._lock:
+            return dict(self._conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+
+    def next_expiry(self):
+        """Earliest expiry of a lease held by any worker, or None if nothing is leased"""
+        with self._lock:
+            return self._conn.execute("SELECT MIN(lease_expires) FROM tasks WHERE state = 'leased'").fetchone()[0]
+
+    def workers(self):
+        with self._lock:
+            cursor = self._conn.execute('SELECT * FROM workers ORDER BY started_at')
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def results(self, states=('done',)):
+        """(task_id, state, result) of finished tasks in queue order, read a page at a time"""
+        marks = ', '.join('?' * len(states))
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT position, task_id, state, result FROM tasks WHERE state IN ({marks}) '
+                    'AND position > ? ORDER BY position LIMIT ?', (*states, position, RESULT_PAGE)).fetchall()
+            if not rows:
+                return
+            for position, task_id, state, result in rows:
+                yield task_id, state, json.loads(result) if result else None
+
+    def failures(self):
+        """{task_id: error} of the tasks that gave up"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT task_id, error FROM tasks WHERE state = 'failed' ORDER BY position"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()